@@ -1,23 +1,29 @@
 import argparse
-import datetime
+import json
+import os
+import queue
+import shutil
+import numpy as np
 import pandas as pd
 from pathlib import Path
 import multiprocessing as mp
-from geopy.distance import great_circle
+from geopy.distance import EARTH_RADIUS
+from sklearn.neighbors import BallTree
 from Levenshtein import distance as levDist
 import random
 import tqdm
+import deezy_utils
 
 """
 This script creates positive and negative matching pairs of toponyms given a gazetteer of alternate names. The code is based on https://github.com/Living-with-machines/LwM_SIGSPATIAL2020_ToponymMatching/blob/master/processing/toponym_matching_datasets/wikigaz/generate_wikigaz_comb.py
 """
 
-def get_placename_and_unique_alt_names(place_dict):
+def get_placename_and_unique_alt_names(place_id):
     """given a place we retrieve altnames and location (we don't use location for the moment)"""
     
-    placename = place_dict['placename']
-    unique_alt_names = list(place_dict['altnames'])
-    placeloc = (place_dict["lat"], place_dict["lon"])
+    placename = gazetteer.name(gazetteer.placenames[place_id])
+    unique_alt_names = [gazetteer.name(k) for k in gazetteer.entity_altnames(place_id)]
+    placeloc = (gazetteer.lat[place_id], gazetteer.lon[place_id])
     
     return placename, unique_alt_names, placeloc
 
@@ -35,7 +41,196 @@ def get_ngrams(placename, maxngrams,minngrams):
     return ngrams
 
 
-def get_final_wrong_cands_challenging(cand_ngrams,unique_alt_names,placename,placeloc,n_neg_cand_to_generate,place_id,wiki_ids,altnames):
+
+def csr_rows(offsets, values, rows):
+    """
+    Function that returns the values of some rows of a CSR adjacency (i.e.
+    values[offsets[row]:offsets[row + 1]] for each row), concatenated, and
+    the position in rows of the row of each value.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    lengths = offsets[rows + 1] - offsets[rows]
+    owners = np.repeat(np.arange(len(rows)), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(offsets[rows], lengths)
+    return values[positions], owners
+
+
+def gram_codes(codepoints, owners):
+    """
+    Function that returns the characters and character bigrams of strings
+    (given as the concatenation of their code points, and the string of each
+    code point) as integer codes: the code point of each character, and
+    (first + 1) * 0x110000 + second for each bigram.
+    """
+    codepoints = codepoints.astype(np.int64)
+    consecutive = owners[1:] == owners[:-1]
+    codes = np.concatenate([codepoints, (codepoints[:-1][consecutive] + 1) * 0x110000 + codepoints[1:][consecutive]])
+    return codes, np.concatenate([owners, owners[:-1][consecutive]])
+
+
+class CompiledGazetteer:
+    """
+    The gazetteer of alternate names compiled into compact read-only arrays,
+    stored as npy files in a folder and memory-mapped, so the workers of the
+    pool all read the same physical pages (instead of each of them slowly
+    duplicating dicts of Python sets through copy-on-write):
+    * The altnames, as the concatenation of their code points (codepoints)
+      and the offset of each altname in it (name_offsets).
+    * The latitude, longitude and placename (altname position) of each
+      entry of the gazetteer (entity).
+    * The altnames of each entity, and the entities of each altname, as CSR
+      adjacencies (entity_offsets and entity_names, name_offsets_entities
+      and name_entities).
+    * An inverted index of the characters and character bigrams of the
+      altnames (gram_codes, sorted, gram_offsets and postings), so that the
+      altnames that contain an ngram are found without scanning all of them.
+
+    Arguments:
+        folder (str): the folder of the compiled gazetteer (see compile).
+    """
+    arrays = ["codepoints", "name_offsets", "lat", "lon", "placenames", "entity_offsets", "entity_names",
+              "name_offsets_entities", "name_entities", "gram_codes", "gram_offsets", "postings"]
+
+    def __init__(self, folder):
+        for name in self.arrays:
+            setattr(self, name, np.load(os.path.join(folder, name + ".npy"), mmap_mode="r"))
+        self.lengths = np.diff(self.name_offsets)
+
+    @staticmethod
+    def source(input_gazetteer):
+        # The gazetteer file the arrays were compiled from:
+        stat = os.stat(input_gazetteer)
+        return {"gazetteer": os.path.abspath(input_gazetteer), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+    @classmethod
+    def compile(cls, input_gazetteer, folder):
+        """
+        Function that compiles the gazetteer (vectorised) into the arrays,
+        unless they have already been compiled from the same file, and
+        returns the compiled gazetteer.
+        """
+        source = cls.source(input_gazetteer)
+        if Path(folder, "source.json").exists():
+            with open(os.path.join(folder, "source.json")) as f:
+                if json.load(f) == source:
+                    return cls(folder)
+
+        gazdf = pd.read_csv(input_gazetteer, sep="\t")
+        gazdf = gazdf[gazdf['altname'].str.len() < 50]
+        gazdf = gazdf.dropna(subset=["wkid"])
+
+        # Entities and altnames are numbered in order of appearance:
+        entities, wkids = pd.factorize(gazdf["wkid"])
+        names, altnames = pd.factorize(gazdf["altname"])
+        arrays = dict()
+        lengths = np.array([len(x) for x in altnames], dtype=np.int64)
+        arrays["codepoints"] = np.frombuffer("".join(altnames).encode("utf-32-le"), dtype=np.uint32)
+        arrays["name_offsets"] = np.concatenate([[0], np.cumsum(lengths)])
+
+        # The location of an entity is that of its first row, and its placename the altname of its last row:
+        first = np.unique(entities, return_index=True)[1]
+        last = len(entities) - 1 - np.unique(entities[::-1], return_index=True)[1]
+        arrays["lat"] = gazdf["lat"].to_numpy(dtype=float)[first]
+        arrays["lon"] = gazdf["lon"].to_numpy(dtype=float)[first]
+        arrays["placenames"] = names[last]
+
+        pairs = np.unique(np.stack([entities, names], axis=1).reshape(-1, 2), axis=0)
+        arrays["entity_offsets"] = np.concatenate([[0], np.cumsum(np.bincount(pairs[:, 0], minlength=len(wkids)))])
+        arrays["entity_names"] = pairs[:, 1]
+        pairs = pairs[np.lexsort((pairs[:, 0], pairs[:, 1]))]
+        arrays["name_offsets_entities"] = np.concatenate([[0], np.cumsum(np.bincount(pairs[:, 1], minlength=len(altnames)))])
+        arrays["name_entities"] = pairs[:, 0]
+
+        # Inverted index of the characters and bigrams of the altnames:
+        codes, owners = gram_codes(arrays["codepoints"], np.repeat(np.arange(len(altnames)), lengths))
+        order = np.lexsort((owners, codes))
+        codes, owners = codes[order], owners[order]
+        distinct = np.ones(len(codes), dtype=bool)
+        distinct[1:] = (codes[1:] != codes[:-1]) | (owners[1:] != owners[:-1])
+        codes, owners = codes[distinct], owners[distinct]
+        arrays["gram_codes"], counts = np.unique(codes, return_counts=True)
+        arrays["gram_offsets"] = np.concatenate([[0], np.cumsum(counts)])
+        arrays["postings"] = owners
+
+        # The arrays are written to a temporary folder, which replaces the previous one when complete:
+        shutil.rmtree(folder + ".tmp", ignore_errors=True)
+        Path(folder + ".tmp").mkdir(parents=True)
+        for name in cls.arrays:
+            np.save(os.path.join(folder + ".tmp", name + ".npy"), np.ascontiguousarray(arrays[name]))
+        with open(os.path.join(folder + ".tmp", "source.json"), "w") as f:
+            json.dump(source, f)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(folder + ".tmp", folder)
+        return cls(folder)
+
+    def __len__(self):
+        return len(self.placenames)
+
+    def name(self, k):
+        return self.codepoints[self.name_offsets[k]:self.name_offsets[k + 1]].tobytes().decode("utf-32-le")
+
+    def entity_altnames(self, place_id):
+        return self.entity_names[self.entity_offsets[place_id]:self.entity_offsets[place_id + 1]]
+
+    def postings_of(self, code):
+        # Altnames that contain the character or bigram with the given code:
+        i = np.searchsorted(self.gram_codes, code)
+        if i == len(self.gram_codes) or self.gram_codes[i] != code:
+            return self.postings[:0]
+        return self.postings[self.gram_offsets[i]:self.gram_offsets[i + 1]]
+
+    def matches(self, ngram):
+        """
+        Function that returns the positions of the altnames that contain
+        ngram: they are among those that contain all its bigrams (or its
+        character, for one-character ngrams).
+        """
+        if ngram == "":
+            return np.arange(len(self.name_offsets) - 1)
+        codepoints = np.frombuffer(ngram.encode("utf-32-le"), dtype=np.uint32)
+        codes = gram_codes(codepoints, np.zeros(len(codepoints), dtype=np.int64))[0]
+        codes = np.unique(codes[len(codepoints):] if len(ngram) > 1 else codes)
+        postings = sorted((self.postings_of(code) for code in codes), key=len)
+        candidates = postings[0]
+        for other in postings[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, other, assume_unique=True)
+        if len(ngram) <= 2:
+            return np.asarray(candidates)
+        return np.array([k for k in candidates if ngram in self.name(k)], dtype=np.int64)
+
+    def entities_of(self, names):
+        # Entities of each of the altnames, and the position in names of the altname of each:
+        return csr_rows(self.name_offsets_entities, self.name_entities, names)
+
+
+class DistanceIndex:
+    """
+    Spatial index of the coordinates of the gazetteer entries (a BallTree
+    with the haversine metric), so that the entries within a distance of a
+    location are found in one radius query.
+
+    Arguments:
+        gazetteer (CompiledGazetteer): the compiled gazetteer.
+    """
+    def __init__(self, gazetteer):
+        located = ~(np.isnan(gazetteer.lat) | np.isnan(gazetteer.lon))
+        self.ids = np.flatnonzero(located)
+        self.tree = BallTree(np.radians(np.stack([gazetteer.lat[located], gazetteer.lon[located]], axis=1)), metric="haversine")
+
+    def within(self, lat, lon, km):
+        """
+        Function that returns the positions of the entries within km
+        kilometres of the location (on a sphere with the same radius as
+        geopy's great_circle).
+        """
+        if not len(self.ids) or np.isnan(lat) or np.isnan(lon):
+            return self.ids[:0]
+        return self.ids[self.tree.query_radius(np.radians([[lat, lon]]), r=km / EARTH_RADIUS)[0]]
+
+
+def get_final_wrong_cands_challenging(cand_ngrams,unique_alt_names,placename,placeloc,n_neg_cand_to_generate,place_id,gazetteer):
 
     selected_wrong_cands = set()
     
@@ -49,36 +244,26 @@ def get_final_wrong_cands_challenging(cand_ngrams,unique_alt_names,placename,pla
     # * are not possible positive altnames of the toponym
     # * are not exact matches of the toponym
     # * their length difference with respect to the toponym is less than 5 characters
-    for cand_ngram in cand_ngrams:
-        collected_wrong_cands = {x for x in altnames.keys() if cand_ngram in x if place_id not in altnames[x] and x!= placename and x not in unique_alt_names and (abs(len(x) - len(placename)) <= 5)}
-        for k in collected_wrong_cands:
-            if k not in selected_wrong_cands:
-                selected_wrong_cands.add(k)
+    # (the altnames that contain each ngram are looked up in the ngram index of the
+    # gazetteer; the toponym and its positive altnames are all altnames of the entity):
+    matching = np.unique(np.concatenate([gazetteer.matches(cand_ngram) for cand_ngram in set(cand_ngrams)] + [np.array([], dtype=np.int64)]))
+    matching = matching[np.abs(gazetteer.lengths[matching] - len(placename)) <= 5]
+    matching = matching[~np.isin(matching, gazetteer.entity_altnames(place_id))]
     
     # we filter out alternate names that can correspond to locations within 50 km from
-    # the main location
-    mindistance = kilometre_distance
-    filtered_by_distance = set()
-    for x in selected_wrong_cands:
-        within_distance = False
-        for alt in altnames[x]:
-            lat_alt = float(wiki_ids[alt]["lat"])
-            lon_alt = float(wiki_ids[alt]["lon"])
-            lat_main = float(wiki_ids[place_id]["lat"])
-            lon_main = float(wiki_ids[place_id]["lon"])
-            if great_circle((lat_alt, lon_alt), (lat_main,lon_main)).km < mindistance:
-                within_distance = True
-                break
-        if within_distance == False:
-            filtered_by_distance.add(x)
-                
-    selected_wrong_cands = filtered_by_distance
+    # the main location (the entities within that distance are found in one query of
+    # the distance index):
+    near = distance_index.within(placeloc[0], placeloc[1], kilometre_distance)
+    entities, owners = gazetteer.entities_of(matching)
+    within_distance = np.bincount(owners[np.isin(entities, near)], minlength=len(matching)) > 0
+    selected_wrong_cands = {gazetteer.name(k) for k in matching[~within_distance]}
         
     if len(selected_wrong_cands)<1:
         return None
     
     # we rank them using LevDist so that we have on top the most similar wrong ones 
-    rank_wrong_cands = [[placename,x,levDist(x,placename)] for x in selected_wrong_cands]
+    # (in a fixed order, so the output does not depend on the hash seed of the run)
+    rank_wrong_cands = [[placename,x,levDist(x,placename)] for x in sorted(selected_wrong_cands)]
     
     # we sort them, from more similar to less (unlike in the trivial setting)
     rank_wrong_cands.sort(key=lambda x: x[2])
@@ -88,7 +273,7 @@ def get_final_wrong_cands_challenging(cand_ngrams,unique_alt_names,placename,pla
     
     return final_wrong_cands
 
-def get_final_wrong_cands_trivial(unique_alt_names,placename,placeloc,n_neg_cand_to_generate,place_id,wiki_ids,altnames):
+def get_final_wrong_cands_trivial(unique_alt_names,placename,placeloc,n_neg_cand_to_generate,place_id,gazetteer):
 
     selected_wrong_cands = set()
     
@@ -96,17 +281,19 @@ def get_final_wrong_cands_trivial(unique_alt_names,placename,placeloc,n_neg_cand
     # * are not possible positive altnames of the toponym
     # * are not exact matches of the toponym
     # * their length difference with respect to the toponym is less than 5 characters
-    collected_wrong_cands = {x for x in random.sample(altnames.keys(), 50)}
+    collected_wrong_cands = random.sample(range(len(gazetteer.lengths)), 50)
+    positive = set(gazetteer.entity_altnames(place_id).tolist())
     for k in collected_wrong_cands:
-        if place_id not in altnames[k] and k != placename and k not in unique_alt_names and (abs(len(k) - len(placename)) <= 5):
-            if k not in selected_wrong_cands:
-                selected_wrong_cands.add(k)
+        x = gazetteer.name(k)
+        if k not in positive and x != placename and x not in unique_alt_names and (abs(len(x) - len(placename)) <= 5):
+            if x not in selected_wrong_cands:
+                selected_wrong_cands.add(x)
         
     if len(selected_wrong_cands)<1:
         return None
     
     # we rank them using LevDist so that we have on top the most similar wrong ones 
-    rank_wrong_cands = [[placename,x,levDist(x,placename)] for x in selected_wrong_cands]
+    rank_wrong_cands = [[placename,x,levDist(x,placename)] for x in sorted(selected_wrong_cands)]
     
     # we sort them, from more dissimilar to less (unlike in the challenging setting):
     rank_wrong_cands.sort(key=lambda x: x[2], reverse=True)
@@ -121,14 +308,12 @@ def normalized_lev(s1, s2):
 
 def generate_cands(place_id):
     
-    place_dict = wiki_ids[place_id]
-
     placename, unique_alt_names, placeloc = \
-            get_placename_and_unique_alt_names(place_dict)
+            get_placename_and_unique_alt_names(place_id)
 
     challenging_alt_names = [u for u in unique_alt_names if u != placename]
     challenging_alt_names = [u for u in challenging_alt_names if normalized_lev(u, placename) > 0.5]
-    challenging_alt_names = list(set(challenging_alt_names))
+    challenging_alt_names = sorted(set(challenging_alt_names))
 
     final_cands_chall = []
     final_cands_trivial = []
@@ -182,7 +367,7 @@ def generate_cands(place_id):
         
         # now, having a set of ngams, we try to retrieve negative candidates
         # so candidates that are similar based on ngrams overlap, like Marcelona for Barcelona
-        final_cands_chall = get_final_wrong_cands_challenging(cand_ngrams,challenging_alt_names,placename,placeloc,n_neg_cand_to_generate,place_id,wiki_ids,altnames)
+        final_cands_chall = get_final_wrong_cands_challenging(cand_ngrams,challenging_alt_names,placename,placeloc,n_neg_cand_to_generate,place_id,gazetteer)
 
         if final_cands_chall != None:
             # we keep only placename and wrongcand and add the label False
@@ -219,7 +404,7 @@ def generate_cands(place_id):
         n_neg_cand_to_generate = len(trivial_alt_names)
 
         # we try to retrieve negative trivial pairs for as many positive pairs
-        final_cands_trivial = get_final_wrong_cands_trivial(trivial_alt_names,placename,placeloc,n_neg_cand_to_generate,place_id,wiki_ids,altnames)
+        final_cands_trivial = get_final_wrong_cands_trivial(trivial_alt_names,placename,placeloc,n_neg_cand_to_generate,place_id,gazetteer)
 
         if final_cands_trivial != None:
             # we keep only placename and wrongcand and add the label False
@@ -251,47 +436,115 @@ def generate_cands(place_id):
         return None
 
 
-def main(kilometre_distance, N, titles_per_chunk, out_file):
-                
-    p = mp.Pool(processes = N)
-    start = datetime.datetime.now()
-    
-    # i have divided the list of wiki titles in small chunks 
-    # so i can process a few at a times and identify how long it will take
-    for split in tqdm.tqdm(wiki_titles_splits):
-        
-        # we assign them to different processes
-        res = p.map(generate_cands, split)
-        
-        # we exclude the Nones
-        res = [x for x in res if x!= None]
-        res = [y for x in res for y in x if len(y)>1]
-        
-        #write out the results
-        for el in res:
-            out_file.write('\t'.join(el)+"\n")
-            
-def process_args(number_cpus, input_gazetteer):
-    gazdf = pd.read_csv(input_gazetteer, sep="\t")
-    gazdf = gazdf[gazdf['altname'].str.len() < 50]
-    
-    wiki_ids = {row["wkid"]:{"placename":row["altname"], "altnames":set(),"lat":"","lon":""} for i, row in gazdf.iterrows()}
-    altnames = {row["altname"]:set() for i, row in gazdf.iterrows()}
-    
-    for i,row in gazdf.iterrows():
-        if len(wiki_ids[row["wkid"]]["altnames"])==0:
-            wiki_ids[row["wkid"]]["lat"] = row["lat"]
-            wiki_ids[row["wkid"]]["lon"] = row["lon"]
+def generate_chunk(task):
+    """
+    Function that generates the pairs of the titles of a chunk, and streams
+    them to the shard of the chunk. The random generator is seeded for each
+    chunk, so the output does not depend on which process gets the chunk.
+    The shard is written to a temporary file, which replaces it when
+    complete.
+    """
+    chunk, split, seed, shard = task
+    random.seed(str(seed) + ":" + str(chunk))
+    n_pairs = 0
+    with open(shard + ".tmp", "w") as f:
+        for place_id in split:
+            res = generate_cands(place_id)
+            if res == None:
+                continue
+            for el in res:
+                if len(el) > 1:
+                    f.write('\t'.join(el)+"\n")
+                    n_pairs += 1
+    os.replace(shard + ".tmp", shard)
+    return chunk, n_pairs
+
+
+def read_manifest(manifest_file, run):
+    """
+    Function that returns the chunks that an interrupted run with the same
+    parameters has already finished (according to its progress manifest).
+    """
+    if not Path(manifest_file).exists():
+        return dict()
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+    if manifest["run"] != run:
+        return dict()
+    return {int(chunk): n_pairs for chunk, n_pairs in manifest["done"].items()}
 
-        if row["altname"] not in wiki_ids[row["wkid"]]["altnames"]:
-            wiki_ids[row["wkid"]]["altnames"].add(row["altname"])
 
-        if row["wkid"] not in altnames[row["altname"]]:
-            altnames[row["altname"]].add(row["wkid"])
+def write_manifest(manifest_file, run, done):
+    with open(manifest_file + ".tmp", "w") as f:
+        json.dump({"run": run, "done": {str(chunk): done[chunk] for chunk in sorted(done)}}, f)
+    os.replace(manifest_file + ".tmp", manifest_file)
 
-    wiki_titles = [x for x in wiki_ids.keys()]
 
-    random.shuffle(wiki_titles)
+def main(N, wiki_titles_splits, output_dataset, shards_folder, run):
+    """
+    Function that generates the pairs of all the chunks in parallel (with at
+    most two chunks per process in flight), each into its own shard, and
+    then joins the shards, in the order of the chunks, into the output
+    dataset. Finished chunks are recorded in a progress manifest, so an
+    interrupted run resumes at the chunks that were not finished.
+    """
+    manifest_file = os.path.join(shards_folder, "manifest.json")
+    done = read_manifest(manifest_file, run)
+    if not done:
+        shutil.rmtree(shards_folder, ignore_errors=True)
+    Path(shards_folder).mkdir(parents=True, exist_ok=True)
+    shard = lambda chunk: os.path.join(shards_folder, "part-{:05d}.txt".format(chunk))
+    done = {chunk: n_pairs for chunk, n_pairs in done.items() if Path(shard(chunk)).exists()}
+    if done:
+        print("Resuming: " + str(len(done)) + " of " + str(len(wiki_titles_splits)) + " chunks already done.")
+
+    # Chunks are submitted from this process, and only when one of the (at
+    # most two per process) chunks in flight is finished, so the pending work
+    # (and the memory it takes) stays bounded. Finished chunks, and errors,
+    # come back through a queue, so a failing chunk stops the run:
+    pending = iter([chunk for chunk in range(len(wiki_titles_splits)) if chunk not in done])
+    finished = queue.Queue()
+    with mp.Pool(processes = N) as p, tqdm.tqdm(total=len(wiki_titles_splits) - len(done)) as pbar:
+        def submit():
+            chunk = next(pending, None)
+            if chunk is None:
+                return 0
+            p.apply_async(generate_chunk, ((chunk, wiki_titles_splits[chunk], run["seed"], shard(chunk)),),
+                          callback=finished.put, error_callback=finished.put)
+            return 1
+
+        in_flight = sum(submit() for _ in range(2 * N))
+        while in_flight:
+            result = finished.get()
+            in_flight -= 1
+            if isinstance(result, BaseException):
+                raise result
+            chunk, n_pairs = result
+            done[chunk] = n_pairs
+            write_manifest(manifest_file, run, done)
+            pbar.update()
+            in_flight += submit()
+
+    # Join the shards into the dataset:
+    with open(output_dataset + ".tmp", "w") as out_file:
+        for chunk in range(len(wiki_titles_splits)):
+            with open(shard(chunk)) as f:
+                shutil.copyfileobj(f, out_file)
+    os.replace(output_dataset + ".tmp", output_dataset)
+    return sum(done.values())
+
+def process_args(number_cpus, input_gazetteer, compiled_gazetteer, seed):
+    # The gazetteer, compiled into memory-mapped arrays shared by the workers:
+    gazetteer = CompiledGazetteer.compile(input_gazetteer, compiled_gazetteer)
+
+    # Index of the coordinates of the entries (for the distance filter of the negative pairs):
+    distance_index = DistanceIndex(gazetteer)
+
+    # The entries are given to the workers by their position in the gazetteer:
+    wiki_titles = list(range(len(gazetteer)))
+
+    # (shuffled with the seed of the run, so the chunks are the same if it is resumed)
+    random.Random(seed).shuffle(wiki_titles)
     
     # we organize it in chunks, each chink has titles_per_chunk titles
     wiki_titles_splits = list(chunks(wiki_titles, titles_per_chunk))
@@ -302,10 +555,12 @@ def process_args(number_cpus, input_gazetteer):
     else:
         N = int(number_cpus)
     
-    return N, wiki_titles, wiki_titles_splits, wiki_ids, altnames
+    return N, wiki_titles, wiki_titles_splits, gazetteer, distance_index
 
 if __name__ == '__main__':
     
+    deezy_utils.enter_sandbox("deezymatch")
+
     parser = argparse.ArgumentParser()
     parser.add_argument("-g", "--gazetteer",
                     help="Gazetter from which to create the toponym matching dataset. Options:\n*british_isles\n*british_isles_stations", required=True)
@@ -315,20 +570,28 @@ if __name__ == '__main__':
                     help="Number of titles per chunk")
     parser.add_argument("-km", "--kilometre_distance", default=50, 
                     help="Minimum distance of negative toponym pair")
+    parser.add_argument("-s", "--seed", default=42,
+                    help="Seed of the random choices (the output is the same for the same seed). Default: 42")
     args = parser.parse_args()
 
     # Parameters you can tune tune:
     kilometre_distance = int(args.kilometre_distance)
     number_cpus = int(args.number_cpus) # Use all
     titles_per_chunk = int(args.titles_per_chunk)
+    seed = int(args.seed)
     
     gazetteer = args.gazetteer # gb or gb_stations
     
     input_gazetteer = "../processed/wikidata/altname_" + gazetteer + "_gazetteer.tsv"
     output_dataset = "../processed/deezymatch/datasets/" + gazetteer + "_toponym_pairs.txt"
+    compiled_gazetteer = "../processed/deezymatch/datasets/" + gazetteer + "_compiled_gazetteer"
+    shards_folder = "../processed/deezymatch/datasets/" + gazetteer + "_toponym_pairs_shards"
     Path("../processed/deezymatch/datasets/").mkdir(parents=True, exist_ok=True)
     
-    output_file = open(output_dataset, "w")
-    N, wiki_titles, wiki_titles_splits, wiki_ids, altnames = process_args(number_cpus, input_gazetteer)
-    main(kilometre_distance, N, titles_per_chunk, output_file)
-    output_file.close()
+    N, wiki_titles, wiki_titles_splits, gazetteer, distance_index = process_args(number_cpus, input_gazetteer, compiled_gazetteer, seed)
+
+    # A run can only be resumed with the same gazetteer and parameters:
+    run = {"source": CompiledGazetteer.source(input_gazetteer), "titles_per_chunk": titles_per_chunk,
+           "kilometre_distance": kilometre_distance, "seed": seed}
+    n_pairs = main(N, wiki_titles_splits, output_dataset, shards_folder, run)
+    print("Toponym pairs: " + str(n_pairs) + ", stored in " + output_dataset)
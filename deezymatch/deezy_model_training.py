@@ -4,7 +4,13 @@ from DeezyMatch import combine_vecs
 from pathlib import Path
 import pandas as pd
 import numpy as np
+import shutil
 import time
+import os
+import vector_store
+import deezy_utils
+
+deezy_utils.enter_sandbox("deezymatch")
 
 # --------------------------------------
 # TRAIN THE GB DEEZYMATCH MODEL
@@ -24,66 +30,112 @@ if not Path('../processed/deezymatch/models/wikidata_gb/wikidata_gb.model').is_f
 
 ##### UTILS
 
+# Cleaning candidates for DeezyMatch input:
+def clean_candidates(unique_placenames_array):
+    """
+    This function returns the unique alternate names in a given gazetteer
+    as they are given to DeezyMatch (sorted, so they are always in the same order)."""
+    cleaned = set()
+    for pl in unique_placenames_array:
+        pl = pl.strip()
+        pl = pl.replace('"', "").strip()
+        if pl:
+            cleaned.add(pl)
+    return sorted(cleaned)
+
 # Formatting candidates for DeezyMatch innput:
 def format_for_candranker(gazname, unique_placenames_array):
     """
-    This function returns the unique alternate names in a given gazetteer
-    in the format required by DeezyMatch candidate ranker."""
+    This function writes the (cleaned) alternate names in the format
+    required by DeezyMatch candidate ranker."""
     Path("/".join(gazname.split("/")[:-1])).mkdir(parents=True, exist_ok=True)
     with open(gazname + ".txt", "w") as fw:
         for pl in unique_placenames_array:
-            pl = pl.strip()
-            if pl:
-                pl = pl.replace('"', "")
-                fw.write(pl.strip() + "\t0\tfalse\n")
+            fw.write(pl + "\t0\tfalse\n")
 
 # Generating and combining candidate vectors:
-def findcandidates(candidates, dm_model, inputfile):
+def findcandidates(candidates, dm_model, inputfile, unique_placenames_array):
+    """
+    The vectors of the candidates are kept in a store by (model, candidate)
+    (see vector_store.py), so only the candidates that are not in the store
+    yet (e.g. the new alternate names after a Wikidata refresh) are vectorised,
+    and the combined vectors are then assembled from the store, without the
+    candidates that are no longer in the gazetteer."""
+
+    store = vector_store.VectorStore("../processed/deezymatch/vector_store/" + dm_model + "_" + vector_store.model_hash(dm_model))
+    output_scenario = "../processed/deezymatch/combined/" + candidates + "_" + dm_model
+    if vector_store.combined_is_current(output_scenario, store, unique_placenames_array):
+        return
+
+    new_candidates = store.missing(unique_placenames_array)
+    print("Candidates: %s, to be vectorised: %s" % (len(unique_placenames_array), len(new_candidates)))
 
-    # generate vectors for candidates (specified in dataset_path) 
-    # using a model stored at pretrained_model_path and pretrained_vocab_path 
-    if not Path("../processed/deezymatch/candidate_vectors/" + candidates + "_" + dm_model + "/embeddings/").is_dir():
+    # generate vectors for new candidates (specified in dataset_path)
+    # using a model stored at pretrained_model_path and pretrained_vocab_path
+    if new_candidates:
+        new_name = candidates + "_" + dm_model + "_new"
+        shutil.rmtree("../processed/deezymatch/candidate_vectors/" + new_name, ignore_errors=True)
+        shutil.rmtree("../processed/deezymatch/combined/" + new_name, ignore_errors=True)
+        format_for_candranker("../processed/deezymatch/candidate_toponyms/" + candidates + "_new", new_candidates)
         start_time = time.time()
         dm_inference(input_file_path="../processed/deezymatch/models/" + dm_model + "/input_dfm.yaml",
-                     dataset_path="../processed/deezymatch/candidate_toponyms/" + candidates + ".txt", 
+                     dataset_path="../processed/deezymatch/candidate_toponyms/" + candidates + "_new.txt", 
                      pretrained_model_path="../processed/deezymatch/models/" + dm_model + "/" + dm_model + ".model", 
                      pretrained_vocab_path="../processed/deezymatch/models/" + dm_model + "/" + dm_model + ".vocab",
                      inference_mode="vect",
-                     scenario="../processed/deezymatch/candidate_vectors/" + candidates + "_" + dm_model)
+                     scenario="../processed/deezymatch/candidate_vectors/" + new_name)
         elapsed = time.time() - start_time
         print("Generate candidate vectors: %s" % elapsed)
 
-    # combine vectors stored in the scenario in candidates/ and save them in combined/
-    if not Path("../processed/deezymatch/combined/" + candidates + "_" + dm_model).is_dir():
+        # combine vectors stored in the scenario in candidates/, and add them to the store
         start_time = time.time()
-        combine_vecs(rnn_passes=["fwd", "bwd"], 
-                     input_scenario="../processed/deezymatch/candidate_vectors/" + candidates + "_" + dm_model, 
-                     output_scenario="../processed/deezymatch/combined/" + candidates + "_" + dm_model, 
+        combine_vecs(rnn_passes=vector_store.rnn_passes, 
+                     input_scenario="../processed/deezymatch/candidate_vectors/" + new_name, 
+                     output_scenario="../processed/deezymatch/combined/" + new_name, 
                      print_every=1000)
+        vectorised, items, vectors, id_shape, skipped = vector_store.read_combined("../processed/deezymatch/combined/" + new_name, new_candidates)
+        store.add(vectorised, items, vectors, id_shape)
+        store.skip(skipped)
+        if skipped:
+            print("Skipped by DeezyMatch: %s" % len(skipped))
+        shutil.rmtree("../processed/deezymatch/candidate_vectors/" + new_name)
+        shutil.rmtree("../processed/deezymatch/combined/" + new_name)
+        os.remove("../processed/deezymatch/candidate_toponyms/" + candidates + "_new.txt")
         elapsed = time.time() - start_time
         print("Combine candidate vectors: %s" % elapsed)
 
+    # write the combined vectors of all candidates, from the store, in combined/
+    start_time = time.time()
+    vector_store.write_combined(store, unique_placenames_array, output_scenario, "../processed/deezymatch/models/" + dm_model + "/" + inputfile + ".yaml")
+    elapsed = time.time() - start_time
+    print("Assemble candidate vectors: %s" % elapsed)
+
         
 ##### IN USE
-        
+
+dm_model = "wikidata_gb"
+inputfile = "input_dfm"
+candidates_in_use = []
+
 # Generate candidate vectors for the British Isles stations gazetteer
 wkgazetteer = pd.read_csv("../processed/wikidata/altname_gb_stations_gazetteer.tsv", sep="\t")
-unique_placenames_array = list(set(list(np.array(wkgazetteer["altname"]))))
+unique_placenames_array = clean_candidates(wkgazetteer["altname"].dropna().astype(str))
 format_for_candranker("../processed/deezymatch/candidate_toponyms/gb_stations", unique_placenames_array)
 
 candidates = "gb_stations"
-dm_model = "wikidata_gb"
-inputfile = "input_dfm"
 
-findcandidates(candidates, dm_model, inputfile)
+findcandidates(candidates, dm_model, inputfile, unique_placenames_array)
+candidates_in_use += unique_placenames_array
 
 # Generate candidate vectors for the British Isles gazetteer
 wkgazetteer = pd.read_csv("../processed/wikidata/altname_gb_gazetteer.tsv", sep="\t")
-unique_placenames_array = list(set(list(np.array(wkgazetteer["altname"]))))
+unique_placenames_array = clean_candidates(wkgazetteer["altname"].dropna().astype(str))
 format_for_candranker("../processed/deezymatch/candidate_toponyms/gb", unique_placenames_array)
 
 candidates = "gb"
-dm_model = "wikidata_gb"
-inputfile = "input_dfm"
 
-findcandidates(candidates, dm_model, inputfile)
\ No newline at end of file
+findcandidates(candidates, dm_model, inputfile, unique_placenames_array)
+candidates_in_use += unique_placenames_array
+
+# Drop the vectors of the candidates that are no longer in any gazetteer from the store:
+vector_store.VectorStore("../processed/deezymatch/vector_store/" + dm_model + "_" + vector_store.model_hash(dm_model)).compact(candidates_in_use)
@@ -0,0 +1,13 @@
+import os
+
+
+# --------------------------------------
+def enter_sandbox(stage):
+    """
+    Function that runs the scripts of a stage on the sampled development
+    subset (see wikidata/dev_sample.py) if S2S_DEV is set, by moving to the
+    folder of the stage in the sandbox, in which the pipeline paths (in
+    ../resources/ and ../processed/) resolve.
+    """
+    if os.environ.get("S2S_DEV"):
+        os.chdir(os.path.join("../dev/station-to-station/", stage))
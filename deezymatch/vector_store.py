@@ -0,0 +1,227 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import torch
+from pathlib import Path
+
+
+# ==========================================
+# Store of DeezyMatch candidate vectors
+# ==========================================
+
+# The vectors of the candidate toponyms are stored by (model, toponym): a
+# store is a folder named after the hash of the model files, with a shard
+# (a folder) per batch of toponyms that were vectorised together. Each shard
+# contains the toponyms (keys.npy), the items that DeezyMatch made of them
+# (items.npy) and their vectors for each rnn pass (e.g. fwd.npy), in the
+# same order. Only the toponyms that are not in the store yet have to be
+# vectorised when a gazetteer changes (see deezy_model_training.py). The
+# toponyms that DeezyMatch skips (e.g. mostly out of its vocabulary) are
+# recorded in store.json, so they are not vectorised again.
+rnn_passes = ["fwd", "bwd"]
+
+
+def model_hash(dm_model, models_folder="../processed/deezymatch/models/"):
+    """
+    Function that returns the md5 hash of the files of a DeezyMatch model
+    (the model, its vocabulary and its input file), which identifies the
+    vectors the model produces.
+    """
+    md5 = hashlib.md5()
+    for filename in [dm_model + ".model", dm_model + ".vocab", "input_dfm.yaml"]:
+        with open(os.path.join(models_folder, dm_model, filename), "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                md5.update(block)
+    return md5.hexdigest()
+
+
+def keys_hash(keys):
+    # md5 hash of a list of toponyms:
+    return hashlib.md5("\n".join(keys).encode("utf-8")).hexdigest()
+
+
+class VectorStore:
+    """
+    Store of the DeezyMatch vectors of the candidate toponyms of a model.
+
+    Arguments:
+        folder (str): the folder of the store (named after the model hash,
+            see model_hash).
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        Path(folder).mkdir(parents=True, exist_ok=True)
+        self.shards = sorted(glob.glob(os.path.join(folder, "part-*")))
+        self.positions = dict()
+        for shard, path in enumerate(self.shards):
+            for row, key in enumerate(np.load(os.path.join(path, "keys.npy"), allow_pickle=True)):
+                self.positions[key] = (shard, row)
+        self.metadata = dict()
+        if Path(folder, "store.json").exists():
+            with open(os.path.join(folder, "store.json")) as f:
+                self.metadata = json.load(f)
+
+    def missing(self, keys):
+        # Toponyms that are not in the store yet (and were not skipped by DeezyMatch):
+        skipped = set(self.metadata.get("skipped", []))
+        return [key for key in keys if key not in self.positions and key not in skipped]
+
+    def skip(self, keys):
+        # Records the toponyms that DeezyMatch did not vectorise:
+        if not len(keys):
+            return
+        self.metadata["skipped"] = sorted(set(self.metadata.get("skipped", [])) | set(keys))
+        with open(os.path.join(self.folder, "store.json"), "w") as f:
+            json.dump(self.metadata, f)
+
+    def add(self, keys, items, vectors, id_shape):
+        """
+        Function that adds a shard with the vectors of some toponyms to the
+        store.
+
+        Arguments:
+            keys (list): the toponyms.
+            items (np.array): the DeezyMatch items of the toponyms.
+            vectors (dict): the vectors of the toponyms for each rnn pass.
+            id_shape (list): the shape of the DeezyMatch ids of an item.
+        """
+        if not len(keys):
+            return
+        number = int(os.path.basename(self.shards[-1]).split("-")[1]) + 1 if self.shards else 0
+        path = os.path.join(self.folder, "part-{:05d}".format(number))
+        shutil.rmtree(path + ".tmp", ignore_errors=True)
+        Path(path + ".tmp").mkdir(parents=True)
+        np.save(os.path.join(path + ".tmp", "keys.npy"), np.array(keys, dtype=object))
+        np.save(os.path.join(path + ".tmp", "items.npy"), items)
+        for rnn_pass in rnn_passes:
+            np.save(os.path.join(path + ".tmp", rnn_pass + ".npy"), vectors[rnn_pass])
+        os.replace(path + ".tmp", path)
+        self.shards.append(path)
+        for row, key in enumerate(keys):
+            self.positions[key] = (len(self.shards) - 1, row)
+        self.metadata["id_shape"] = list(id_shape)
+        with open(os.path.join(self.folder, "store.json"), "w") as f:
+            json.dump(self.metadata, f)
+
+    def get(self, keys):
+        """
+        Function that returns the items and the vectors (for each rnn pass)
+        of some toponyms, in the same order, reading from each shard only
+        the rows that are needed.
+        """
+        located = np.array([self.positions[key] for key in keys], dtype=np.int64).reshape(-1, 2)
+        items = None
+        vectors = dict()
+        for name in ["items"] + rnn_passes:
+            result = None
+            for shard in np.unique(located[:, 0]):
+                selected = np.flatnonzero(located[:, 0] == shard)
+                data = np.load(os.path.join(self.shards[shard], name + ".npy"), mmap_mode=None if name == "items" else "r", allow_pickle=name == "items")
+                if result is None:
+                    result = np.empty((len(keys),) + data.shape[1:], dtype=data.dtype)
+                result[selected] = data[located[selected, 1]]
+            if result is None:
+                result = np.empty(0, dtype=object)
+            if name == "items":
+                items = result
+            else:
+                vectors[name] = result
+        return items, vectors
+
+    def compact(self, keys_in_use, max_unused=0.25):
+        """
+        Function that drops the toponyms that are no longer in use from the
+        store (rewriting it as a single shard), once they are more than
+        max_unused of it.
+        """
+        keys_in_use = [key for key in sorted(set(keys_in_use)) if key in self.positions]
+        if len(self.positions) - len(keys_in_use) <= max_unused * len(self.positions):
+            return
+        items, vectors = self.get(keys_in_use)
+        previous = list(self.shards)
+        self.add(keys_in_use, items, vectors, self.metadata.get("id_shape", []))
+        for path in previous:
+            shutil.rmtree(path)
+        self.shards = self.shards[len(previous):]
+        self.positions = {key: (0, row) for row, key in enumerate(keys_in_use)}
+
+
+# ==========================================
+# Read and write DeezyMatch combined vectors
+# ==========================================
+
+def read_combined(scenario, keys):
+    """
+    Function that reads the combined vectors of some toponyms (see
+    DeezyMatch's combine_vecs). The ids of the vectors are the rows of the
+    items of combine_vecs, whose original string (items[:, 1]) is the
+    toponym: they are not the lines of the dataset that was vectorised,
+    because DeezyMatch skips some toponyms (and renumbers the others).
+
+    Returns:
+        The toponyms that were vectorised, their items and their vectors for
+        each rnn pass (in the order of the toponyms), the shape of the
+        DeezyMatch ids of an item, and the toponyms that were skipped.
+    """
+    vectorised = None
+    vectors = dict()
+    for rnn_pass in rnn_passes:
+        ids = torch.load(os.path.join(scenario, rnn_pass + "_id.pt"))
+        ids = ids.numpy() if torch.is_tensor(ids) else np.asarray(ids)
+        id_shape = ids.shape[1:]
+        rows = ids.reshape(len(ids), -1)[:, 0].astype(np.int64)
+        order = np.argsort(rows, kind="stable")
+        vecs = torch.load(os.path.join(scenario, rnn_pass + ".pt"))
+        vecs = vecs.numpy() if torch.is_tensor(vecs) else np.asarray(vecs)
+        vectors[rnn_pass] = vecs[order]
+        if vectorised is None:
+            vectorised = rows[order]
+            items = np.load(os.path.join(scenario, rnn_pass + "_items.npy"), allow_pickle=True)[vectorised]
+        elif not np.array_equal(rows[order], vectorised):
+            raise ValueError("The rnn passes of " + scenario + " have vectors for different toponyms.")
+    # Keep only the toponyms that were requested (once each):
+    requested = set(keys)
+    found = dict()
+    for position, toponym in enumerate(items[:, 1]):
+        if toponym in requested and toponym not in found:
+            found[toponym] = position
+    kept = np.array(list(found.values()), dtype=np.int64)
+    skipped = [key for key in keys if key not in found]
+    return list(found), items[kept], {rnn_pass: vecs[kept] for rnn_pass, vecs in vectors.items()}, id_shape, skipped
+
+
+def combined_is_current(output_scenario, store, keys):
+    # Whether the combined vectors are those of the toponyms with the model of the store:
+    if not Path(output_scenario, "store.json").exists() or not glob.glob(os.path.join(output_scenario, "*.yaml")):
+        return False
+    with open(os.path.join(output_scenario, "store.json")) as f:
+        state = json.load(f)
+    return state == {"store": os.path.basename(store.folder), "keys": keys_hash(keys)}
+
+
+def write_combined(store, keys, output_scenario, input_file_path):
+    """
+    Function that writes the combined vectors of the toponyms that are in
+    the store (in the format of DeezyMatch's combine_vecs, so they can be
+    used by the candidate ranker), in the given order. The ids of the items
+    are their positions. As combine_vecs does, the input file of the model
+    is copied with them (the candidate ranker reads it from there).
+    """
+    requested = keys_hash(keys)
+    keys = [key for key in keys if key in store.positions]
+    items, vectors = store.get(keys)
+    ids = torch.arange(len(keys)).reshape([len(keys)] + store.metadata.get("id_shape", []))
+    shutil.rmtree(output_scenario + ".tmp", ignore_errors=True)
+    Path(output_scenario + ".tmp").mkdir(parents=True)
+    for rnn_pass in rnn_passes:
+        torch.save(torch.from_numpy(np.ascontiguousarray(vectors[rnn_pass])), os.path.join(output_scenario + ".tmp", rnn_pass + ".pt"))
+        torch.save(ids, os.path.join(output_scenario + ".tmp", rnn_pass + "_id.pt"))
+        np.save(os.path.join(output_scenario + ".tmp", rnn_pass + "_items.npy"), items)
+    shutil.copy2(input_file_path, output_scenario + ".tmp")
+    with open(os.path.join(output_scenario + ".tmp", "store.json"), "w") as f:
+        json.dump({"store": os.path.basename(store.folder), "keys": requested}, f)
+    shutil.rmtree(output_scenario, ignore_errors=True)
+    os.replace(output_scenario + ".tmp", output_scenario)
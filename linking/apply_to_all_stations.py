@@ -6,13 +6,15 @@ import time
 import numpy as np
 from pathlib import Path
 from collections import OrderedDict
-from tools import eval_methods, selection_methods, resolution_methods
+from tools import eval_methods, selection_methods, resolution_methods, utils
 from tqdm.auto import tqdm
 from dateutil import parser
 import pickle
 import re
 tqdm.pandas()
 
+utils.enter_sandbox("linking")
+
 setting = "allquicks" # dev or test
 num_candidates = 1
 
@@ -94,6 +96,11 @@ if not Path("../processed/resolution/candranking_" + setting + ".pkl").is_file()
     df.to_pickle("../processed/resolution/candranking_" + setting + ".pkl")
     
 gazetteer_df = pd.read_csv("../processed/wikidata/gb_gazetteer.csv", header=0, index_col=0, low_memory=False)
+
+# Load the index of Wikidata labels, if it has been created (see wikidata/entity_extraction.py):
+label_index = None
+if Path("../processed/wikidata/labels/starts.npy").exists():
+    label_index = resolution_methods.LabelIndex("../processed/wikidata/labels/")
     
 # -------------------------------
 # Feature selection:
@@ -105,7 +112,7 @@ candrank = "deezy_match"
 features_file = "../processed/resolution/features_" + setting + "_" + candrank + ".tsv"
 if not Path(features_file).is_file():
     df = pd.read_pickle("../processed/resolution/candranking_" + setting + ".pkl")
-    exp_df = resolution_methods.feature_selection(candrank, df, gazetteer_df, wikipedia_entity_overall_dict, False)
+    exp_df = resolution_methods.feature_selection(candrank, df, gazetteer_df, wikipedia_entity_overall_dict, False, label_index=label_index)
     exp_df.drop_duplicates(subset=['SubId','Candidate'], inplace=True)
     exp_df.to_csv(features_file, sep="\t")
 print(candrank + " " + setting + " done!")
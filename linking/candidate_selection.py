@@ -1,10 +1,12 @@
 import pandas as pd
 from pathlib import Path
 from collections import OrderedDict
-from tools import eval_methods, selection_methods
+from tools import eval_methods, selection_methods, utils
 from tqdm.auto import tqdm
 tqdm.pandas()
 
+utils.enter_sandbox("linking")
+
 
 # ----------------------------------------
 # Function that finds candidates for each scenario:
@@ -0,0 +1,216 @@
+import fcntl
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import torch
+from pathlib import Path
+from sklearn.metrics.pairwise import cosine_similarity
+
+# --------------------------------------
+# Memory-mapped candidate vectors
+# --------------------------------------
+
+# The combined candidate vectors of a DeezyMatch scenario (see combine_vecs)
+# are converted once into a folder of flat files that are memory-mapped, so
+# that several linking processes share one page-cached copy of them and do
+# not deserialise them at startup:
+# * vectors.npy: the fwd and bwd vectors of each candidate, concatenated (as
+#   in the candidate ranker), stored as float32 (the default, which ranks as
+#   the candidate ranker does), or, to save memory at the cost of approximate
+#   distances, as float16 or int8 quantised with a scale per dimension
+#   (scales.npy).
+# * norms.npy: the squared L2 norm of the (stored) vector of each candidate.
+# * items.bin and item_offsets.npy: the original strings of the candidates
+#   (before preprocessing), as UTF-8, which are only decoded when they are
+#   ranked. As in the candidate ranker, the original id of a candidate is
+#   its position.
+# * store.json: the format of the store, the number of candidates whose
+#   string repeats that of an earlier one, and the combined files it was
+#   converted from (it is converted again if they change).
+# The store is converted (or checked) under a lock file next to it, so that
+# linking processes that start together convert it only once.
+rnn_passes = ["fwd", "bwd"]
+
+
+def combined_source(scenario):
+    # Size and modification time of the combined files of a scenario:
+    source = dict()
+    for rnn_pass in rnn_passes:
+        for filename in [rnn_pass + ".pt", rnn_pass + "_id.pt", rnn_pass + "_items.npy"]:
+            stat = os.stat(os.path.join(scenario, filename))
+            source[filename] = [stat.st_size, stat.st_mtime_ns]
+    return source
+
+
+def load_combined(scenario):
+    """
+    Function that loads the combined vectors of a scenario (see DeezyMatch's
+    combine_vecs), returning the concatenated fwd and bwd vectors, the items
+    (the preprocessed and the original string of each toponym, indexed by
+    original id) and the original ids of the vectors.
+    """
+    vectors = []
+    for rnn_pass in rnn_passes:
+        vecs = torch.load(os.path.join(scenario, rnn_pass + ".pt"), map_location="cpu")
+        vectors.append(vecs.detach().numpy() if torch.is_tensor(vecs) else np.asarray(vecs))
+    ids = torch.load(os.path.join(scenario, "fwd_id.pt"), map_location="cpu")
+    ids = ids.numpy() if torch.is_tensor(ids) else np.asarray(ids)
+    items = np.load(os.path.join(scenario, "fwd_items.npy"), allow_pickle=True)
+    return np.concatenate(vectors, axis=1).astype(np.float32), items, ids.reshape(len(ids), -1)[:, 0]
+
+
+def quantise(vectors, dtype):
+    """
+    Function that converts vectors to the dtype of the store: float32,
+    float16, or int8 with a scale per dimension (the largest absolute value
+    of the dimension is mapped to 127).
+
+    Returns:
+        The converted vectors, and the scale of each dimension.
+    """
+    scales = np.ones(vectors.shape[1], dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=0) / 127 if len(vectors) else scales
+        scales[scales == 0] = 1
+        return np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(dtype), scales
+
+
+def convert_combined(scenario, folder, dtype):
+    """
+    Function that converts the combined vectors of a scenario into a store
+    of memory-mapped vectors with the given dtype (float32, float16 or
+    int8), written to a temporary folder that replaces the store when it is
+    complete (the caller holds the lock of the store).
+    """
+    source = combined_source(scenario)
+    vectors, items, ids = load_combined(scenario)
+    stored, scales = quantise(vectors, dtype)
+    restored = stored.astype(np.float32) * scales
+    originals = [str(item) for item in items[:, 1]]
+    encoded = [item.encode("utf-8") for item in originals]
+
+    tmp = folder + ".tmp" + str(os.getpid())
+    shutil.rmtree(tmp, ignore_errors=True)
+    Path(tmp).mkdir(parents=True)
+    np.save(os.path.join(tmp, "vectors.npy"), stored)
+    np.save(os.path.join(tmp, "scales.npy"), scales)
+    np.save(os.path.join(tmp, "norms.npy"), (restored * restored).sum(axis=1).astype(np.float32))
+    np.save(os.path.join(tmp, "item_offsets.npy"), np.concatenate([[0], np.cumsum([len(item) for item in encoded])]).astype(np.int64))
+    with open(os.path.join(tmp, "items.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    with open(os.path.join(tmp, "store.json"), "w") as f:
+        json.dump({"dtype": dtype, "source": source, "duplicates": len(originals) - len(set(originals))}, f)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(tmp, folder)
+
+
+class MappedVectors:
+    """
+    The memory-mapped vectors of the candidates of a scenario (converted
+    from its combined vectors the first time, or when they change).
+
+    Arguments:
+        scenario (str): the combined scenario of the candidates.
+        dtype (str): the dtype in which the vectors are stored: float32, or
+            float16 or int8 to use less memory with approximate distances.
+    """
+    def __init__(self, scenario, dtype="float32"):
+        folder = os.path.join(scenario, "mapped_" + dtype)
+        with open(folder + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = dict()
+            if Path(folder, "store.json").exists():
+                with open(os.path.join(folder, "store.json")) as f:
+                    state = json.load(f)
+            if [state.get("dtype"), state.get("source")] != [dtype, combined_source(scenario)]:
+                convert_combined(scenario, folder, dtype)
+                with open(os.path.join(folder, "store.json")) as f:
+                    state = json.load(f)
+            self.duplicates = state["duplicates"]
+            self.vectors = np.load(os.path.join(folder, "vectors.npy"), mmap_mode="r")
+            self.scales = np.load(os.path.join(folder, "scales.npy"))
+            self.norms = np.load(os.path.join(folder, "norms.npy"), mmap_mode="r")
+            self.item_offsets = np.load(os.path.join(folder, "item_offsets.npy"), mmap_mode="r")
+            self.items = np.memmap(os.path.join(folder, "items.bin"), dtype=np.uint8, mode="r") if self.item_offsets[-1] else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def item(self, i):
+        return self.items[self.item_offsets[i]:self.item_offsets[i + 1]].tobytes().decode("utf-8")
+
+    def block(self, start, end):
+        # Vectors of the candidates from start to end, as float32:
+        return self.vectors[start:end].astype(np.float32) * self.scales
+
+
+def rank_candidates(query_scenario, candidates, selection_threshold, num_candidates, block_size=65536, query_batch=256):
+    """
+    Function that finds, for each query of a combined scenario, the
+    num_candidates nearest candidates within selection_threshold, with the
+    distance of faiss's flat L2 index (the squared L2 distance between the
+    concatenated fwd and bwd vectors), reading the candidate vectors from
+    the memory-mapped store block by block (and comparing them with a batch
+    of queries at a time, so memory stays bounded). As in DeezyMatch's
+    candidate ranker, a candidate string is only kept at its nearest
+    position, and distances are rounded to 4 decimals.
+
+    Returns:
+        A dataframe like that of DeezyMatch's candidate ranker with the
+        faiss metric (indexed by the original id of the query), with the
+        query, the faiss_distance and cosine_dist of its candidates, their
+        original ids and the original id of the query. The columns that the
+        ranker fills from the model or from its search (pred_score,
+        1-pred_score and num_all_searches) are left out.
+    """
+    queries, query_items, query_ids = load_combined(query_scenario)
+    query_norms = (queries * queries).sum(axis=1)
+    # Enough neighbours to find num_candidates different strings:
+    k = max(min(num_candidates + candidates.duplicates, len(candidates)), 1)
+    best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+    best_positions = np.full((len(queries), k), -1, dtype=np.int64)
+    for start in range(0, len(candidates), block_size):
+        end = min(start + block_size, len(candidates))
+        block = candidates.block(start, end)
+        for first in range(0, len(queries), query_batch):
+            last = min(first + query_batch, len(queries))
+            distances = query_norms[first:last, None] + candidates.norms[start:end][None, :] - 2 * queries[first:last] @ block.T
+            np.maximum(distances, 0, out=distances)
+            positions = np.broadcast_to(np.arange(start, end), distances.shape)
+            if end - start > k:
+                kept = np.argpartition(distances, k - 1, axis=1)[:, :k]
+                distances = np.take_along_axis(distances, kept, axis=1)
+                positions = np.take_along_axis(positions, kept, axis=1)
+            # Merge with the nearest candidates of the previous blocks:
+            distances = np.concatenate([best_distances[first:last], distances], axis=1)
+            positions = np.concatenate([best_positions[first:last], positions], axis=1)
+            kept = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            best_distances[first:last] = np.take_along_axis(distances, kept, axis=1)
+            best_positions[first:last] = np.take_along_axis(positions, kept, axis=1)
+
+    rows = []
+    for q in range(len(queries)):
+        faiss_distance, cosine_dist, candidate_original_ids = dict(), dict(), dict()
+        positions = best_positions[q][best_positions[q] >= 0]
+        if len(positions):
+            # The distances of the nearest candidates, computed directly (as
+            # faiss does for a single query) rather than from the norms:
+            vectors = np.concatenate([candidates.block(position, position + 1) for position in positions])
+            distances = ((vectors - queries[q]) ** 2).sum(axis=1)
+            cosines = 1. - cosine_similarity(queries[q:q + 1], vectors)[0]
+            for j in np.argsort(distances, kind="stable"):
+                if distances[j] > selection_threshold or len(faiss_distance) == num_candidates:
+                    break
+                item = candidates.item(int(positions[j]))
+                if item in faiss_distance:
+                    continue
+                faiss_distance[item] = round(float(distances[j]), 4)
+                cosine_dist[item] = round(float(cosines[j]), 4)
+                candidate_original_ids[item] = int(positions[j])
+        query_id = int(query_ids[q])
+        rows.append([query_id, query_items[query_id][1], faiss_distance, cosine_dist, candidate_original_ids, query_id])
+    candidates_pd = pd.DataFrame(rows, columns=["id", "query", "faiss_distance", "cosine_dist", "candidate_original_ids", "query_original_id"])
+    return candidates_pd.set_index("id")
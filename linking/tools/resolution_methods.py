@@ -8,6 +8,8 @@ from sklearn.svm import SVC
 from sklearn.metrics import classification_report
 from urllib.parse import quote
 import random
+import os
+import mmap
 import pathlib
 import subprocess
 import itertools
@@ -26,6 +28,35 @@ stn_wkdt_classes = ["Q55488", "Q4663385", "Q55491", "Q18516630", "Q1335652", "Q2
 ppl_wkdt_classes = ["Q532", "Q1115575", "Q486972", "Q5084", "Q3957", "Q5124673", "Q3910694", "Q515", "Q18511725", "Q1549591", "Q1357964", "Q1968403", "Q902814"]
 
 
+# ----------------------------------
+# Wikidata labels
+# ----------------------------------
+
+class LabelIndex:
+    """
+    Memory-mapped index of the English labels of all Wikidata entities,
+    created by wikidata/entity_extraction.py (with -l). For each QID number,
+    starts.npy has the offset of its label in labels.bin (-1 if there is no
+    English label) and lengths.npy the length of the label in bytes, so a
+    label is read in constant time without loading the index in memory.
+
+    Arguments:
+        path (str): directory of the label index.
+    """
+    def __init__(self, path="../processed/wikidata/labels/"):
+        self.starts = np.load(os.path.join(path, "starts.npy"), mmap_mode="r")
+        self.lengths = np.load(os.path.join(path, "lengths.npy"), mmap_mode="r")
+        with open(os.path.join(path, "labels.bin"), "rb") as f:
+            self.labels = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f.name) else b""
+
+    def get(self, qid, default=None):
+        number = int(qid[1:]) if qid[1:].isdigit() else -1
+        if number < 0 or number >= len(self.starts) or self.starts[number] < 0:
+            return default
+        start = int(self.starts[number])
+        return self.labels[start:start + int(self.lengths[number])].decode("utf-8")
+
+
 # ----------------------------------
 # Feature selection
 # ----------------------------------
@@ -43,7 +74,10 @@ def closest_geo(gazetteer_df, c, place_cands, closest):
                 closest = dcands
     return closest
 
-def feature_selection(candrank, df, gazetteer_df, wikipedia_entity_overall_dict, experiment=True):
+def feature_selection(candrank, df, gazetteer_df, wikipedia_entity_overall_dict, experiment=True, label_index=None):
+    # The labels of the historical counties and administrative regions of the
+    # candidates are read from label_index (a LabelIndex) if given, otherwise
+    # from the gazetteer (which does not have all of them).
 
     mainid_column = []
     subid_column = []
@@ -120,11 +154,17 @@ def feature_selection(candrank, df, gazetteer_df, wikipedia_entity_overall_dict,
                 wikidata_text = ""
                 if wikidata_data["description_set"] != "set()":
                     wikidata_text += ", " + ", ".join(literal_eval(wikidata_data["description_set"]))
-                for hc in literal_eval(wikidata_data["hcounties"]):
-                    wikidata_text += ", " + gazetteer_df.loc[hc]["english_label"]
-                for ar in literal_eval(wikidata_data["adm_regions"]):
-                    if ar in gazetteer_df.index:
-                        wikidata_text += ", " + gazetteer_df.loc[ar]["english_label"]
+                if label_index is not None:
+                    for qid in list(literal_eval(wikidata_data["hcounties"])) + list(literal_eval(wikidata_data["adm_regions"])):
+                        qid_label = label_index.get(qid)
+                        if qid_label:
+                            wikidata_text += ", " + qid_label
+                else:
+                    for hc in literal_eval(wikidata_data["hcounties"]):
+                        wikidata_text += ", " + gazetteer_df.loc[hc]["english_label"]
+                    for ar in literal_eval(wikidata_data["adm_regions"]):
+                        if ar in gazetteer_df.index:
+                            wikidata_text += ", " + gazetteer_df.loc[ar]["english_label"]
 
                 embeddings = model.encode([disambiguator_text, wikidata_text])
                 feature_vector[3] = round(util.pytorch_cos_sim(embeddings[0], embeddings[1]).item(), 4)
@@ -4,6 +4,7 @@ from pathlib import Path
 from DeezyMatch import inference as dm_inference
 from DeezyMatch import combine_vecs
 from DeezyMatch import candidate_ranker
+from tools import mapped_vectors
 import time
 
 # --------------------------------------
@@ -100,7 +101,7 @@ def format_for_candranker(gazname, df, query_column):
                 fw.write(row["SubStFormatted"] + "\t0\tfalse\n")
 
 
-def find_deezymatch_candidates(gazetteer, quicks_df, query_column, dm_model, inputfile, candidates, queries, candrank_metric, candrank_thr, num_candidates):
+def find_deezymatch_candidates(gazetteer, quicks_df, query_column, dm_model, inputfile, candidates, queries, candrank_metric, candrank_thr, num_candidates, vector_dtype="float32"):
     Path("../processed/deezymatch/query_toponyms/").mkdir(parents=True, exist_ok=True)
     # Generate candidate vectors for the British Isles gazetteer
     format_for_candranker("../processed/deezymatch/query_toponyms/" + queries + "_" + query_column, quicks_df, query_column)
@@ -129,21 +130,34 @@ def find_deezymatch_candidates(gazetteer, quicks_df, query_column, dm_model, inp
     # Select candidates based on L2-norm distance (aka faiss distance):
     # find candidates from candidate_scenario 
     # for queries specified in query_scenario
+    # (with the faiss distance, the candidate vectors are read from a memory-mapped
+    # store, see mapped_vectors.py, in the dtype given by vector_dtype: float32
+    # ranks as candidate_ranker does, float16 or int8 use less memory)
     start_time = time.time()
-    candidates_pd = \
-        candidate_ranker(query_scenario="../processed/deezymatch/combined/" + queries + "_" + query_column + "_" + dm_model,
-                         candidate_scenario="../processed/deezymatch/combined/" + candidates + "_" + dm_model, 
-                         ranking_metric=candrank_metric, 
-                         selection_threshold=candrank_thr, 
-                         num_candidates=num_candidates, 
-                         search_size=num_candidates, 
-                         output_path="../processed/deezymatch/ranker_results/" + queries + "_" + query_column + "_" + candidates + "_" + dm_model + "_" + candrank_metric + str(num_candidates), 
-                         pretrained_model_path="../processed/deezymatch/models/" + dm_model + "/" + dm_model + ".model", 
-                         pretrained_vocab_path="../processed/deezymatch/models/" + dm_model + "/" + dm_model + ".vocab")
+    output_path = "../processed/deezymatch/ranker_results/" + queries + "_" + query_column + "_" + candidates + "_" + dm_model + "_" + candrank_metric + str(num_candidates)
+    if candrank_metric == "faiss":
+        candidate_vectors = mapped_vectors.MappedVectors("../processed/deezymatch/combined/" + candidates + "_" + dm_model, vector_dtype)
+        candidates_pd = mapped_vectors.rank_candidates("../processed/deezymatch/combined/" + queries + "_" + query_column + "_" + dm_model,
+                                                       candidate_vectors,
+                                                       selection_threshold=candrank_thr,
+                                                       num_candidates=num_candidates)
+        Path("../processed/deezymatch/ranker_results/").mkdir(parents=True, exist_ok=True)
+        candidates_pd.to_pickle(output_path + ".pkl")
+    else:
+        candidates_pd = \
+            candidate_ranker(query_scenario="../processed/deezymatch/combined/" + queries + "_" + query_column + "_" + dm_model,
+                             candidate_scenario="../processed/deezymatch/combined/" + candidates + "_" + dm_model, 
+                             ranking_metric=candrank_metric, 
+                             selection_threshold=candrank_thr, 
+                             num_candidates=num_candidates, 
+                             search_size=num_candidates, 
+                             output_path=output_path, 
+                             pretrained_model_path="../processed/deezymatch/models/" + dm_model + "/" + dm_model + ".model", 
+                             pretrained_vocab_path="../processed/deezymatch/models/" + dm_model + "/" + dm_model + ".vocab")
     elapsed = time.time() - start_time
     print("Rank candidates: %s" % elapsed)
     
-    ranked_candidates = pd.read_pickle("../processed/deezymatch/ranker_results/" + queries + "_" + query_column + "_" + candidates + "_" + dm_model + "_" + candrank_metric + str(num_candidates) + ".pkl")
+    ranked_candidates = pd.read_pickle(output_path + ".pkl")
     ranked_candidates["wkcands"] = ranked_candidates.progress_apply(lambda row : match_cands_wikidata_stn(row,gazetteer,"faiss_distance",candrank_thr), axis=1)
     
     drop_columns = ['pred_score', '1-pred_score', 'faiss_distance', 'cosine_dist', 'candidate_original_ids', 'query_original_id', 'num_all_searches']
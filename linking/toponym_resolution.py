@@ -1,9 +1,11 @@
 import pandas as pd
 from pathlib import Path
-from tools import eval_methods, resolution_methods
+from tools import eval_methods, resolution_methods, utils
 import numpy as np
 import pickle
 
+utils.enter_sandbox("linking")
+
 
 # Options for experiments
 num_candidates_list = [1, 5] # [1, 3, 5]
@@ -14,6 +16,11 @@ candrank_approaches = ["deezy_match"] #, "partial_match", "perfect_match"]
 # Load gazetteer
 gazetteer_df = pd.read_csv("../processed/wikidata/gb_gazetteer.csv", header=0, index_col=0, low_memory=False)
 
+# Load the index of Wikidata labels, if it has been created (see wikidata/entity_extraction.py):
+label_index = None
+if Path("../processed/wikidata/labels/starts.npy").exists():
+    label_index = resolution_methods.LabelIndex("../processed/wikidata/labels/")
+
 
 # Load pickle with wikipedia inlinks
 with open("../resources/wikipedia/overall_entity_freq.pickle", 'rb') as fp:
@@ -30,7 +37,7 @@ for num_candidates in num_candidates_list:
             features_file = "../processed/resolution/features_" + candrank + "_" + setting + str(num_candidates) + ".tsv"
             if not Path(features_file).is_file():
                 df = pd.read_pickle("../processed/resolution/candranking_" + candrank + "_" + setting + str(num_candidates) + ".pkl")
-                exp_df = resolution_methods.feature_selection(candrank, df, gazetteer_df, wikipedia_entity_overall_dict)
+                exp_df = resolution_methods.feature_selection(candrank, df, gazetteer_df, wikipedia_entity_overall_dict, label_index=label_index)
                 exp_df.drop_duplicates(subset=['SubId','Candidate'], inplace=True)
                 exp_df.to_csv(features_file, sep="\t")
 
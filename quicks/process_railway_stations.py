@@ -6,6 +6,10 @@ from lxml import etree
 import pathlib
 import utils
 import random
+import os
+import json
+
+utils.enter_sandbox("quicks")
 
 
 docxFileName = "../resources/quicks/quick_section4.docx"
@@ -78,6 +82,12 @@ else:
             lst.append([i, main_station, ss[0], ss[1], dSubstations[ss]])
     subsdf = pd.DataFrame(lst, columns=cols)
 
+    ### Keep the sampled main stations only, in the development sandbox (the
+    ### dev and test splits are not affected, as they are made before merging):
+    if os.environ.get("S2S_DEV"):
+        with open("../sample.json") as f:
+            subsdf = subsdf[subsdf["MainId"].isin(json.load(f)["mainids"])]
+
     ### Renaming abbreviated substations
     subsdf['SubStFormatted'] = subsdf.apply(lambda row: utils.subst_rename(row["MainStation"], row["SubStation"]), axis = 1)
     subsdf = subsdf[["MainId", "SubId", "MainStation", "SubStation", "SubStFormatted", "Description"]]
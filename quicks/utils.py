@@ -1,3 +1,4 @@
+import os
 import re
 import string
 import pandas as pd
@@ -609,4 +610,16 @@ def prepare_alt_queries(parsedf, scen, split):
     df_tmp[scen] = names
     df_tmp["MainId"] = mainId
     df_tmp["SubId"] = substId
-    df_tmp.to_csv("../resources/quicks/quicks_" + scen.lower() + "_" + split.lower() + ".tsv", sep="\t", index=False)
\ No newline at end of file
+    df_tmp.to_csv("../resources/quicks/quicks_" + scen.lower() + "_" + split.lower() + ".tsv", sep="\t", index=False)
+
+
+# ----------------------------------------
+def enter_sandbox(stage):
+    """
+    Function that runs the scripts of a stage on the sampled development
+    subset (see wikidata/dev_sample.py) if S2S_DEV is set, by moving to the
+    folder of the stage in the sandbox, in which the pipeline paths (in
+    ../resources/ and ../processed/) resolve.
+    """
+    if os.environ.get("S2S_DEV"):
+        os.chdir(os.path.join("../dev/station-to-station/", stage))
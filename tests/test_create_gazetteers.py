@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wikidata"))
+
+import create_gazetteers
+import utils
+
+
+def record(i, lat, lon, lastrevid, wikititle=None):
+    # An extracted record, as returned by parse_record:
+    fields = dict.fromkeys(utils.columns)
+    fields.update({"wikidata_id": "Q%d" % i, "english_label": "Place %d" % i, "instance_of": ["Q486972"],
+                   "latitude": lat, "longitude": lon, "lastrevid": lastrevid, "wikititle": wikititle})
+    return fields
+
+
+# Chunks of 2 records, some with a missing lastrevid (or a title that looks like a number):
+records = [record(1, 51.5, -0.1, 101), record(2, 53.4, -2.2, None, "1984"),
+           record(3, 40.4, -3.7, 103), record(4, 55.9, -3.2, 104, "1066"),
+           record(5, 52.2, 0.1, 105), record(6, 54.6, -5.9, 106)]
+
+
+@pytest.fixture(params=["csv", "parquet"])
+def extracted(request, tmp_path):
+    if request.param == "csv":
+        filename = str(tmp_path / "till_6_item.csv")
+        pd.DataFrame(records).to_csv(filename, index=False)
+    else:
+        filename = str(tmp_path / "part-00000.parquet")
+        pq.write_table(pa.Table.from_batches([utils.records_to_batch(records)]), filename)
+    return filename
+
+
+def test_uk_approx_gazetteer_formats_fields_as_in_memory(tmp_path, extracted):
+    assert create_gazetteers.uk_approx_gazetteer([extracted], str(tmp_path / "chunked.csv"), chunk_size=2) == 5
+    assert create_gazetteers.uk_approx_gazetteer([extracted], str(tmp_path / "whole.csv"), chunk_size=100) == 5
+    with open(tmp_path / "chunked.csv") as f:
+        chunked = f.read()
+    with open(tmp_path / "whole.csv") as f:
+        assert chunked == f.read()
+
+    gazetteer = pd.read_csv(tmp_path / "chunked.csv", dtype=str, keep_default_na=False)
+    assert list(gazetteer["wikidata_id"]) == ["Q1", "Q2", "Q4", "Q5", "Q6"]
+    assert list(gazetteer["lastrevid"]) == ["101", "", "104", "105", "106"]
+    assert list(gazetteer["wikititle"]) == ["", "1984", "1066", "", ""]
+
+
+def test_uk_approx_subset_matches_the_row_wise_filter():
+    bbox = (-9.05, 48.78, 2.41, 61.28)
+    rng = np.random.default_rng(3)
+    lats = list(rng.uniform(45, 65, 300)) + [48.78, 61.28, 50.0, 50.0, None, 50.0]
+    lons = list(rng.uniform(-12, 5, 300)) + [0.0, 0.0, -9.05, 2.41, 0.0, None]
+    df = pd.DataFrame({"wikidata_id": ["Q%d" % i for i in range(len(lats))], "latitude": lats, "longitude": lons}, dtype=object)
+    expected = [wkid for wkid, lat, lon in zip(df["wikidata_id"], lats, lons)
+                if lat is not None and lon is not None and bbox[1] <= lat <= bbox[3] and bbox[0] <= lon <= bbox[2]]
+    ukdf = create_gazetteers.uk_approx_subset(df)
+    assert list(ukdf["wikidata_id"]) == expected
+    assert ukdf["latitude"].dtype == float and ukdf["longitude"].dtype == float
@@ -0,0 +1,189 @@
+import os
+import random
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from geopy.distance import great_circle
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "deezymatch"))
+
+import deezy_dataset_creation as ddc
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    # A small gazetteer, compiled and shared with the workers as module globals (as in __main__):
+    names = ["London", "Londonderry", "Lonton", "Barton", "Burton", "Bartonville", "Marton", "Martin"]
+    rows = [["Q%d" % i, name + suffix, 50 + i / 10, -i / 10] for i, (name, suffix) in enumerate((name, suffix) for suffix in ["", " Hill", " Street"] for name in names)]
+    pd.DataFrame(rows, columns=["wkid", "altname", "lat", "lon"]).to_csv(tmp_path / "gazetteer.tsv", sep="\t", index=False)
+    monkeypatch.setattr(ddc, "titles_per_chunk", 2, raising=False)
+    N, wiki_titles, splits, gazetteer, distance_index = ddc.process_args(2, str(tmp_path / "gazetteer.tsv"), str(tmp_path / "compiled"), 42)
+    monkeypatch.setattr(ddc, "gazetteer", gazetteer, raising=False)
+    monkeypatch.setattr(ddc, "distance_index", distance_index, raising=False)
+    monkeypatch.setattr(ddc, "kilometre_distance", 1, raising=False)
+    run = {"titles_per_chunk": 2, "kilometre_distance": 1, "seed": 42}
+    return splits, str(tmp_path / "pairs.txt"), str(tmp_path / "shards"), run
+
+
+def run_main(splits, output, shards, run, timeout=30):
+    # Runs main in a thread, so that a hanging run fails the test instead of blocking it:
+    outcome = dict()
+    def target():
+        try:
+            outcome["pairs"] = ddc.main(1, splits, output, shards, run)
+        except BaseException as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "main did not exit"
+    return outcome
+
+
+def test_main_writes_and_resumes(dataset):
+    splits, output, shards, run = dataset
+    outcome = run_main(splits, output, shards, run)
+    assert "error" not in outcome
+    with open(output) as f:
+        first = f.read()
+    assert len(first.splitlines()) == outcome["pairs"]
+
+    # A finished run is resumed without generating anything again, and gives the same output:
+    outcome = run_main(splits, output, shards, run)
+    with open(output) as f:
+        assert f.read() == first
+
+
+def test_main_exits_when_a_chunk_fails(dataset, monkeypatch):
+    splits, output, shards, run = dataset
+    failing = splits[1][0]
+    generate_cands = ddc.generate_cands
+    def failing_generate_cands(place_id):
+        if place_id == failing:
+            raise RuntimeError("chunk failed")
+        return generate_cands(place_id)
+    monkeypatch.setattr(ddc, "generate_cands", failing_generate_cands)
+
+    outcome = run_main(splits, output, shards, run)
+    assert isinstance(outcome.get("error"), RuntimeError)
+    assert not os.path.exists(output)
+
+
+def random_gazetteer(filename, seed=20):
+    # A gazetteer of made-up place names (some shared by several entities, some
+    # with non-ASCII characters, some entities without coordinates):
+    rng = random.Random(seed)
+    syllables = ["lon", "don", "bar", "ton", "mar", "ley", "ham", "ford", "ås", "wick", "by", "ché"]
+    names = sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(1, 4))).title() for _ in range(300)})
+    rows = []
+    for i in range(200):
+        lat, lon = (np.nan, np.nan) if i % 37 == 0 else (rng.uniform(50, 58), rng.uniform(-6, 2))
+        for name in rng.sample(names, rng.randint(1, 4)):
+            rows.append(["Q%d" % i, name, lat, lon])
+    gazdf = pd.DataFrame(rows, columns=["wkid", "altname", "lat", "lon"])
+    gazdf.to_csv(filename, sep="\t", index=False)
+    return gazdf
+
+
+@pytest.fixture
+def gazetteer(tmp_path, monkeypatch):
+    gazdf = random_gazetteer(tmp_path / "gazetteer.tsv")
+    gazetteer = ddc.CompiledGazetteer.compile(str(tmp_path / "gazetteer.tsv"), str(tmp_path / "compiled"))
+    monkeypatch.setattr(ddc, "gazetteer", gazetteer, raising=False)
+    monkeypatch.setattr(ddc, "distance_index", ddc.DistanceIndex(gazetteer), raising=False)
+    monkeypatch.setattr(ddc, "kilometre_distance", 50, raising=False)
+    return gazdf, gazetteer
+
+
+def test_ngram_matches_are_the_altnames_containing_them(gazetteer):
+    gazdf, gazetteer = gazetteer
+    altnames = [gazetteer.name(k) for k in range(len(gazetteer.lengths))]
+    assert sorted(altnames) == sorted(gazdf["altname"].unique())
+    for ngram in ["", "o", "å", "on", "ås", "ndo", "Tonb", "arton", "Lonbarwick", "xyz", "onx"]:
+        assert gazetteer.matches(ngram).tolist() == [k for k, altname in enumerate(altnames) if ngram in altname], ngram
+
+
+def test_challenging_candidates_match_a_scan(gazetteer):
+    gazdf, gazetteer = gazetteer
+    # The negative candidates, as found by scanning all the altnames of the gazetteer:
+    locations = {wkid: (group["lat"].iloc[0], group["lon"].iloc[0]) for wkid, group in gazdf.groupby("wkid")}
+    entities = gazdf.groupby("altname")["wkid"].apply(set).to_dict()
+    def scan(cand_ngrams, placename, placeloc, n, wkid):
+        own = set(gazdf.loc[gazdf["wkid"] == wkid, "altname"])
+        candidates = set()
+        for altname in entities:
+            if any(ngram in altname for ngram in cand_ngrams) and abs(len(altname) - len(placename)) <= 5 and altname not in own:
+                if not any(great_circle(placeloc, locations[other]).km <= 50 for other in entities[altname]
+                           if not np.isnan(placeloc[0]) and not np.isnan(locations[other][0])):
+                    candidates.add(altname)
+        ranked = sorted([[placename, x, ddc.levDist(x, placename)] for x in sorted(candidates)], key=lambda x: x[2])
+        return ranked[:n] or None
+
+    found = 0
+    wkids = pd.factorize(gazdf["wkid"])[1]
+    for place_id in range(len(gazetteer)):
+        placename, unique_alt_names, placeloc = ddc.get_placename_and_unique_alt_names(place_id)
+        cand_ngrams = ddc.get_ngrams(placename, len(placename) - 1, len(placename) - 5)
+        expected = scan(cand_ngrams, placename, placeloc, 3, wkids[place_id])
+        assert ddc.get_final_wrong_cands_challenging(cand_ngrams, unique_alt_names, placename, placeloc, 3, place_id, gazetteer) == expected
+        found += expected is not None
+    assert found > 50
+
+
+def test_distance_index_matches_great_circle(gazetteer):
+    gazdf, gazetteer = gazetteer
+    index = ddc.DistanceIndex(gazetteer)
+    rng = np.random.default_rng(21)
+    for lat, lon in zip(rng.uniform(50, 58, 30), rng.uniform(-6, 2, 30)):
+        for km in [10, 50, 200]:
+            expected = [place_id for place_id in range(len(gazetteer)) if not np.isnan(gazetteer.lat[place_id])
+                        and great_circle((lat, lon), (gazetteer.lat[place_id], gazetteer.lon[place_id])).km <= km]
+            assert sorted(index.within(lat, lon, km).tolist()) == expected
+    assert len(index.within(54, -2, 200)) > 0
+    assert len(index.within(np.nan, np.nan, 50)) == 0
+
+
+def test_compiled_gazetteer_matches_the_gazetteer(tmp_path, monkeypatch):
+    gazdf = random_gazetteer(tmp_path / "gazetteer.tsv")
+    long_name = "Llanfairpwllgwyngyllgogerychwyrndrobwllllantysiliogogogoch"
+    extra = pd.DataFrame([["Q0", long_name, 53.2, -4.2], [None, "Nowhere", 51.0, 0.0]], columns=gazdf.columns)
+    pd.concat([gazdf, extra]).to_csv(tmp_path / "gazetteer.tsv", sep="\t", index=False)
+    gazdf = pd.read_csv(tmp_path / "gazetteer.tsv", sep="\t")[:-len(extra)]
+    gazetteer = ddc.CompiledGazetteer.compile(str(tmp_path / "gazetteer.tsv"), str(tmp_path / "compiled"))
+    monkeypatch.setattr(ddc, "gazetteer", gazetteer, raising=False)
+
+    # The entities, in order of appearance, with the location of their first row, the
+    # altname of their last row as placename, and all their altnames:
+    wkids = list(dict.fromkeys(gazdf["wkid"]))
+    assert len(gazetteer) == len(wkids)
+    for place_id, wkid in enumerate(wkids):
+        rows = gazdf[gazdf["wkid"] == wkid]
+        placename, unique_alt_names, placeloc = ddc.get_placename_and_unique_alt_names(place_id)
+        assert placename == rows["altname"].iloc[-1]
+        assert sorted(unique_alt_names) == sorted(set(rows["altname"]))
+        np.testing.assert_array_equal(placeloc, (rows["lat"].iloc[0], rows["lon"].iloc[0]))
+
+    # The entities of each altname (altnames of 50 characters or more, and rows without entity, are left out):
+    altnames = [gazetteer.name(k) for k in range(len(gazetteer.lengths))]
+    assert long_name not in altnames and "Nowhere" not in altnames
+    entities, owners = gazetteer.entities_of(np.arange(len(altnames)))
+    for k, altname in enumerate(altnames):
+        assert sorted(wkids[e] for e in entities[owners == k]) == sorted(set(gazdf.loc[gazdf["altname"] == altname, "wkid"]))
+    assert not gazetteer.codepoints.flags.writeable
+
+
+def test_compiled_gazetteer_is_reused_until_the_gazetteer_changes(tmp_path):
+    gazdf = random_gazetteer(tmp_path / "gazetteer.tsv")
+    folder = str(tmp_path / "compiled")
+    ddc.CompiledGazetteer.compile(str(tmp_path / "gazetteer.tsv"), folder)
+    modified = os.path.getmtime(os.path.join(folder, "postings.npy"))
+    assert len(ddc.CompiledGazetteer.compile(str(tmp_path / "gazetteer.tsv"), folder)) == gazdf["wkid"].nunique()
+    assert os.path.getmtime(os.path.join(folder, "postings.npy")) == modified
+
+    gazdf = random_gazetteer(tmp_path / "gazetteer.tsv", seed=22)
+    gazetteer = ddc.CompiledGazetteer.compile(str(tmp_path / "gazetteer.tsv"), folder)
+    assert sorted(gazetteer.name(k) for k in range(len(gazetteer.lengths))) == sorted(gazdf["altname"].unique())
+    assert sorted(os.listdir(tmp_path)) == ["compiled", "gazetteer.tsv"]
@@ -0,0 +1,59 @@
+import os
+import sys
+from argparse import Namespace
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wikidata"))
+
+import dev_sample
+import utils
+
+
+def test_larger_samples_contain_smaller_ones():
+    keys = range(2000)
+    small = {key for key in keys if dev_sample.in_sample(key, 0.05, 42)}
+    large = {key for key in keys if dev_sample.in_sample(key, 0.2, 42)}
+    assert small < large
+    assert 50 < len(small) < 150 and 300 < len(large) < 500
+    assert small == {key for key in keys if dev_sample.in_sample(key, 0.05, 42)}
+    assert small != {key for key in keys if dev_sample.in_sample(key, 0.05, 43)}
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    for folder in ["wikidata", "resources/quicks", "dev/station-to-station/wikidata", "dev/station-to-station/resources/quicks"]:
+        (tmp_path / folder).mkdir(parents=True)
+    monkeypatch.chdir(tmp_path / "wikidata")
+    return tmp_path
+
+
+def test_sample_quicks_keeps_the_sampled_main_stations(root):
+    parsed = pd.DataFrame({"MainId": [i // 2 for i in range(400)], "SubId": range(400)})
+    parsed.to_pickle(root / "resources" / "quicks" / "quicks_parsed.pkl")
+    annotated = pd.DataFrame({"MainId": range(200), "Final Wikidata ID": ["Q%d" % i for i in range(200)]})
+    annotated.to_csv(root / "resources" / "quicks" / "quicks_dev.tsv", sep="\t", index=False)
+
+    output = os.path.join(dev_sample.sandbox_path, "resources/quicks/")
+    mainids, qids = dev_sample.sample_quicks(0.1, 42, output)
+    assert mainids == [i for i in range(200) if dev_sample.in_sample(i, 0.1, 42)]
+    assert qids == sorted("Q%d" % i for i in mainids)
+    assert set(pd.read_pickle(output + "quicks_parsed.pkl")["MainId"]) == set(mainids)
+    assert list(pd.read_csv(output + "quicks_dev.tsv", sep="\t")["MainId"]) == mainids
+
+
+def test_enter_sandbox_resolves_other_paths_from_the_stage(root, monkeypatch):
+    args = Namespace(input="dumps/latest-all.json.bz2", output="../resources/wikidata/extracted/",
+                     polygon="/data/region.geojson", labels=None)
+    utils.enter_sandbox("wikidata", args, ["input", "output", "polygon", "labels"])
+    assert os.getcwd() == str(root / "wikidata")
+    assert args.input == "dumps/latest-all.json.bz2"
+
+    monkeypatch.setenv("S2S_DEV", "1")
+    utils.enter_sandbox("wikidata", args, ["input", "output", "polygon", "labels"])
+    assert os.getcwd() == str(root / "dev" / "station-to-station" / "wikidata")
+    assert args.input == str(root / "wikidata" / "dumps" / "latest-all.json.bz2")
+    assert args.output == "../resources/wikidata/extracted/"
+    assert args.polygon == "/data/region.geojson"
+    assert args.labels is None
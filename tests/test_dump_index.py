@@ -0,0 +1,58 @@
+import bz2
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wikidata"))
+
+import dump_index
+
+
+def entity_line(qid, rng):
+    # A compact dump line (as in the dumps), with a description that compresses badly,
+    # so that the dump spans many bz2 blocks:
+    description = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(50, 400)))
+    entity = {"type": "item", "id": "Q%d" % qid, "labels": {"en": {"language": "en", "value": "Place %d" % qid}},
+              "descriptions": {"en": {"language": "en", "value": description}}}
+    return json.dumps(entity, separators=(",", ":"))
+
+
+@pytest.fixture(params=["single", "multistream"])
+def dump(request, tmp_path):
+    rng = random.Random(8)
+    qids = rng.sample(range(1, 100000), 3000)
+    lines = [entity_line(qid, rng) for qid in qids]
+    lines.insert(1000, json.dumps({"type": "property", "id": "P625"}, separators=(",", ":")))
+    data = ("[\n" + ",\n".join(lines) + "\n]\n").encode()
+    filename = str(tmp_path / "dump.json.bz2")
+    with open(filename, "wb") as f:
+        if request.param == "single":
+            f.write(bz2.compress(data, 1))
+        else:
+            # Streams of a few hundred lines, split within lines, as in the multi-stream dumps:
+            for start in range(0, len(data), 150000):
+                f.write(bz2.compress(data[start:start + 150000], 1))
+    return filename, data, dict(zip(["Q%d" % qid for qid in qids], [line.encode() for line in lines[:1000] + lines[1001:]]))
+
+
+def test_blocks_decompress_to_the_dump(dump):
+    filename, data, _ = dump
+    starts, ends = dump_index.find_bz2_blocks(filename)
+    assert len(starts) > 5
+    with open(filename, "rb") as f:
+        assert b"".join(dump_index.decompress_block(f, start, end) for start, end in zip(starts, ends)) == data
+
+
+def test_fetch_lines_reads_the_indexed_items(tmp_path, dump):
+    filename, _, lines = dump
+    index = dump_index.build_index(filename, number_cpus=2, blocks_per_task=2)
+    assert sorted(index["qids"].tolist()) == sorted(int(qid[1:]) for qid in lines)
+    dump_index.save_index(index, dump_index.index_path(filename))
+
+    qids = random.Random(5).sample(sorted(lines), 200) + ["Q100000", "Q0"]
+    fetched = dump_index.fetch_lines(qids, filename)
+    assert fetched == {qid: lines[qid] for qid in qids if qid in lines}
+    assert dump_index.fetch_entities(qids[:3], filename)[qids[0]]["labels"]["en"]["value"] == "Place " + qids[0][1:]
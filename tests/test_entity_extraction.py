@@ -0,0 +1,79 @@
+import bz2
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+wikidata_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wikidata")
+sys.path.insert(0, wikidata_folder)
+
+import entity_extraction
+
+
+def write_dump(filename):
+    # A tiny dump with one item with coordinates:
+    entity = {"type": "item", "id": "Q84", "labels": {"en": {"language": "en", "value": "London"}},
+              "claims": {"P625": [{"mainsnak": {"datavalue": {"value": {"latitude": 51.5, "longitude": -0.1}}}}]}}
+    with bz2.open(filename, "wt") as f:
+        f.write("[\n" + json.dumps(entity) + "\n]\n")
+
+
+def run_extraction(dump, output, *options):
+    return subprocess.run([sys.executable, "entity_extraction.py", "-i", str(dump), "-o", str(output), "-n", "1"] + list(options),
+                          cwd=wikidata_folder, capture_output=True, text=True)
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "csv"])
+def test_fresh_run_keeps_existing_files(tmp_path, fmt):
+    dump = tmp_path / "dump.json.bz2"
+    write_dump(dump)
+    output = tmp_path / "extracted"
+    output.mkdir()
+    existing = ["till_Q5000_item.csv", "final_csv_till_Q9000_item.csv", "part-00000.parquet"]
+    for filename in existing:
+        (output / filename).write_text("baseline")
+
+    result = run_extraction(dump, output, "-f", fmt)
+    assert result.returncode != 0
+    assert "--overwrite" in result.stdout
+    for filename in existing:
+        assert (output / filename).read_text() == "baseline"
+
+    # The same holds when restarting a checkpointed run: only its own files are removed.
+    checkpoint = entity_extraction.Checkpoint(str(output), str(dump), 16 * 1024 * 1024)
+    checkpoint.state["files"] = ["part-00001.parquet"]
+    checkpoint.save()
+    (output / "part-00001.parquet").write_text("previous run")
+    result = run_extraction(dump, output, "-f", fmt, "--restart")
+    assert result.returncode != 0
+    assert not (output / "part-00001.parquet").exists()
+    for filename in existing:
+        assert (output / filename).read_text() == "baseline"
+
+
+def test_overwrite_removes_existing_files(tmp_path):
+    dump = tmp_path / "dump.json.bz2"
+    write_dump(dump)
+    output = tmp_path / "extracted"
+    output.mkdir()
+    (output / "till_Q5000_item.csv").write_text("baseline")
+
+    result = run_extraction(dump, output, "--overwrite")
+    assert result.returncode == 0, result.stderr
+    assert not (output / "till_Q5000_item.csv").exists()
+    assert (output / "part-00000.parquet").exists()
+    with open(output / "checkpoint.json") as f:
+        state = json.load(f)
+    assert state["done"] and state["files"] == ["part-00000.parquet"]
+
+
+def test_remove_uncommitted_only_removes_pending_file(tmp_path):
+    for filename in ["part-00000.parquet", "part-00001.parquet.tmp", "till_Q5000_item.csv"]:
+        (tmp_path / filename).write_text("")
+    checkpoint = entity_extraction.Checkpoint(str(tmp_path), "dump.json.bz2", 16 * 1024 * 1024)
+    checkpoint.state["files"] = ["part-00000.parquet"]
+    checkpoint.state["pending"] = "part-00001.parquet"
+    checkpoint.remove_uncommitted(str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["part-00000.parquet", "till_Q5000_item.csv"]
@@ -0,0 +1,80 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+wikidata_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wikidata")
+
+
+def write_gazetteer(root, geonames_ids):
+    # A GB gazetteer (as written by create_gazetteers.py) with the given geonames IDs by entity:
+    entities = [["Q84", "London", "['2643743']", "London", 51.5, -0.1],
+                ["Q39121", "Leeds", geonames_ids.get("Q39121"), "Leeds", 53.8, -1.5],
+                ["Q800753", "Leeds railway station", None, "Leeds railway station", 53.79, -1.54]]
+    gazetteer = pd.DataFrame(entities, columns=["wikidata_id", "english_label", "geonamesIDs", "wikititle", "latitude", "longitude"])
+    gazetteer["alias_dict"] = None
+    gazetteer["nativelabel"] = None
+    gazetteer.to_csv(root / "processed" / "wikidata" / "gb_gazetteer.csv", index=False)
+    gazetteer[gazetteer["wikidata_id"] == "Q800753"].to_csv(root / "processed" / "wikidata" / "gb_stations_gazetteer.csv", index=False)
+
+
+def write_alternate_names(root, rows):
+    with open(root / "resources" / "geonames" / "alternateNamesV2.txt", "w") as f:
+        for i, (geonameid, language, name) in enumerate(rows):
+            f.write("\t".join([str(i), str(geonameid), language, name] + [""] * 6) + "\n")
+
+
+@pytest.fixture
+def root(tmp_path):
+    for folder in ["wikidata", "processed/wikidata", "resources/geonames", "resources/wikigaz"]:
+        (tmp_path / folder).mkdir(parents=True)
+    write_gazetteer(tmp_path, {})
+    write_alternate_names(tmp_path, [(2643743, "en", "Londres"), (2644688, "en", "Leedes"), (2644688, "link", "https://en.wikipedia.org/wiki/Leeds")])
+    with open(tmp_path / "resources" / "geonames" / "GB.txt", "w") as f:
+        for geonameid, name in [(2643743, "London"), (2644688, "Leeds")]:
+            f.write("\t".join([str(geonameid), name, name] + [""] * 16) + "\n")
+    wikigaz = pd.DataFrame([["London", "Lundenwic", 51.5, -0.1, "wikiredirect"], ["Leeds_railway_station", "Leeds City station", 53.79, -1.54, "wikiredirect"]],
+                           columns=["pid", "altname", "lat", "lon", "source"])
+    wikigaz.to_pickle(tmp_path / "resources" / "wikigaz" / "wikigaz_en_basic.pkl")
+    return tmp_path
+
+
+def extend_altnames(root, *args):
+    # Runs extend_altnames.py from its folder, as described in the README:
+    process = subprocess.run([sys.executable, os.path.join(wikidata_folder, "extend_altnames.py")] + list(args),
+                             cwd=root / "wikidata", capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+    with open(root / "processed" / "wikidata" / "altname_gb_gazetteer.tsv") as f:
+        return f.read()
+
+
+def altnames(gazetteer, wkid):
+    rows = [line.split("\t") for line in gazetteer.splitlines()[1:]]
+    return {(row[1], row[2]) for row in rows if row[0] == wkid}
+
+
+def test_incremental_update_uses_new_geonames_ids(root):
+    gazetteer = extend_altnames(root)
+    assert altnames(gazetteer, "Q84") == {("London", "english_label"), ("Londres", "geonames"), ("Lundenwic", "wikigaz")}
+    assert altnames(gazetteer, "Q39121") == {("Leeds", "english_label")}
+
+    # A refresh gives Leeds a geonames ID that the geonames altnames were not filtered for:
+    write_gazetteer(root, {"Q39121": "['2644688']"})
+    gazetteer = extend_altnames(root)
+    assert altnames(gazetteer, "Q39121") == {("Leeds", "english_label"), ("Leedes", "geonames")}
+    changes = pd.read_csv(root / "processed" / "wikidata" / "altname_gb_gazetteer_changes.tsv", sep="\t")
+    assert changes.values.tolist() == [["Leedes", "added"]]
+    assert extend_altnames(root, "--full") == gazetteer
+
+
+def test_changed_sources_rebuild_the_gazetteer(root):
+    extend_altnames(root)
+    write_alternate_names(root, [(2643743, "en", "Londres"), (2643743, "cy", "Llundain"), (2644688, "en", "Leedes")])
+    gazetteer = extend_altnames(root)
+    assert altnames(gazetteer, "Q84") == {("London", "english_label"), ("Londres", "geonames"), ("Llundain", "geonames"), ("Lundenwic", "wikigaz")}
+    assert extend_altnames(root, "--full") == gazetteer
+
+    stations = pd.read_csv(root / "processed" / "wikidata" / "altname_gb_stations_gazetteer.tsv", sep="\t")
+    assert set(stations["altname"]) == {"Leeds railway station", "Leeds City station", "Leeds", "Leeds City"}
@@ -0,0 +1,67 @@
+import bz2
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+root_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root_folder, "wikidata"))
+
+import entity_extraction
+
+# Items of a dump, with and without coordinates (the labels of all of them are stored):
+labels = {"Q1": "Universe", "Q42": "Douglas Adams", "Q84": "London", "Q1490": "Tōkyō", "Q7": 'The "quoted" \\ one', "Q9": None}
+
+
+def entity_line(qid, label):
+    entity = {"type": "item", "id": qid, "labels": {"fr": {"language": "fr", "value": "fr:" + qid}}}
+    if label is not None:
+        entity["labels"]["en"] = {"language": "en", "value": label}
+    # A description in English after the labels, which must not be taken for the label:
+    entity["descriptions"] = {"en": {"language": "en", "value": "description of " + qid}}
+    if qid == "Q84":
+        entity["claims"] = {"P625": [{"mainsnak": {"datavalue": {"value": {"latitude": 51.5, "longitude": -0.1}}}}]}
+    return json.dumps(entity, separators=(",", ":"), ensure_ascii=qid != "Q1490").encode()
+
+
+def test_english_label_reads_raw_lines():
+    for qid, label in labels.items():
+        expected = None if label is None else (int(qid[1:]), label.encode("utf-8"))
+        assert entity_extraction.english_label(entity_line(qid, label)) == expected
+    assert entity_extraction.english_label(b'{"type":"property","id":"P31","labels":{"en":{"language":"en","value":"instance of"}}}') is None
+
+
+@pytest.fixture
+def label_path(tmp_path):
+    dump = tmp_path / "dump.json.bz2"
+    with bz2.open(dump, "wb") as f:
+        f.write(b"[\n" + b",\n".join(entity_line(qid, label) for qid, label in labels.items()) + b"\n]\n")
+    process = subprocess.run([sys.executable, "entity_extraction.py", "-i", str(dump), "-o", str(tmp_path / "extracted"),
+                              "-n", "2", "-l", str(tmp_path / "labels")],
+                             cwd=os.path.join(root_folder, "wikidata"), capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+    return str(tmp_path / "labels")
+
+
+def test_extraction_stores_the_labels_of_all_items(label_path):
+    assert sorted(os.listdir(label_path)) == ["labels.bin", "lengths.npy", "starts.npy"]
+    starts, lengths = np.load(os.path.join(label_path, "starts.npy")), np.load(os.path.join(label_path, "lengths.npy"))
+    with open(os.path.join(label_path, "labels.bin"), "rb") as f:
+        blob = f.read()
+    assert len(starts) == len(lengths) == 1491
+    stored = {"Q%d" % number: blob[start:start + lengths[number]].decode("utf-8") for number, start in enumerate(starts) if start >= 0}
+    assert stored == {qid: label for qid, label in labels.items() if label is not None}
+
+
+def test_label_index_lookups(label_path):
+    pytest.importorskip("sentence_transformers")
+    sys.path.insert(0, os.path.join(root_folder, "linking"))
+    from tools import resolution_methods
+    label_index = resolution_methods.LabelIndex(label_path)
+    for qid, label in labels.items():
+        assert label_index.get(qid) == label
+    for qid in ["Q2", "Q100000", "P31", "Q"]:
+        assert label_index.get(qid, "missing") == "missing"
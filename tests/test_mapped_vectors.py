@@ -0,0 +1,115 @@
+import importlib
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("faiss")
+DeezyMatch = pytest.importorskip("DeezyMatch")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "linking"))
+
+from tools import mapped_vectors
+
+columns = ["query", "faiss_distance", "cosine_dist", "candidate_original_ids", "query_original_id"]
+
+
+def write_scenario(path, names, rng, ids=None):
+    # A combined scenario (as written by combine_vecs), with the items indexed by original id:
+    os.makedirs(path)
+    ids = np.arange(len(names)) if ids is None else np.asarray(ids)
+    for rnn_pass in ["fwd", "bwd"]:
+        torch.save(torch.from_numpy(rng.normal(size=(len(names), 4)).astype(np.float32)), os.path.join(path, rnn_pass + ".pt"))
+        torch.save(torch.from_numpy(ids).reshape(len(names), 1), os.path.join(path, rnn_pass + "_id.pt"))
+        np.save(os.path.join(path, rnn_pass + "_items.npy"), np.array([[name.lower(), name] for name in names], dtype=object))
+    with open(os.path.join(path, "input_dfm.yaml"), "w") as f:
+        f.write("general:\n  use_gpu: False\ngru_lstm:\n  learning_rate: 0.001\npreprocessing: {}\n")
+
+
+@pytest.fixture
+def scenarios(tmp_path):
+    rng = np.random.default_rng(1364)
+    # Some candidate strings are repeated (the ranker keeps their nearest vector):
+    names = ["Station %d" % (i % 150) for i in range(200)]
+    write_scenario(str(tmp_path / "candidates"), names, rng)
+    # The query vectors are not in the order of their ids:
+    write_scenario(str(tmp_path / "queries"), ["Query %d" % i for i in range(12)], rng, ids=rng.permutation(12))
+    return str(tmp_path / "queries"), str(tmp_path / "candidates")
+
+
+def deezymatch_ranker(tmp_path, monkeypatch, query_scenario, candidate_scenario, threshold, num_candidates):
+    # DeezyMatch's candidate ranker, as called by find_deezymatch_candidates, with a
+    # model whose confidences (not used with the faiss metric) are all 0:
+    candidate_ranker_module = importlib.import_module("DeezyMatch.candidateRanker")
+    monkeypatch.setattr(candidate_ranker_module, "candidate_conf_calc", lambda df, *args, **kwargs: torch.zeros(len(df)))
+    if not hasattr(pd.DataFrame, "append"):
+        monkeypatch.setattr(pd.DataFrame, "append", lambda self, other: pd.concat([self, other]), raising=False)
+    torch.save({}, str(tmp_path / "model.model"))
+    with open(tmp_path / "model.vocab", "wb") as f:
+        pickle.dump({}, f)
+    return DeezyMatch.candidate_ranker(query_scenario=query_scenario,
+                                       candidate_scenario=candidate_scenario,
+                                       ranking_metric="faiss",
+                                       selection_threshold=threshold,
+                                       num_candidates=num_candidates,
+                                       search_size=num_candidates,
+                                       output_path=str(tmp_path / "ranker_results" / "ranked"),
+                                       pretrained_model_path=str(tmp_path / "model.model"),
+                                       pretrained_vocab_path=str(tmp_path / "model.vocab"))
+
+
+@pytest.mark.parametrize("threshold,num_candidates", [(100., 5), (6., 3), (4., 10)])
+def test_float32_matches_candidate_ranker(tmp_path, monkeypatch, scenarios, threshold, num_candidates):
+    query_scenario, candidate_scenario = scenarios
+    expected = deezymatch_ranker(tmp_path, monkeypatch, query_scenario, candidate_scenario, threshold, num_candidates)[columns]
+    ranked = mapped_vectors.rank_candidates(query_scenario, mapped_vectors.MappedVectors(candidate_scenario), threshold, num_candidates, block_size=64, query_batch=5)
+    pd.testing.assert_frame_equal(ranked, expected, check_index_type=False)
+    for column in ["faiss_distance", "cosine_dist", "candidate_original_ids"]:
+        assert [list(candidates.items()) for candidates in ranked[column]] == [list(candidates.items()) for candidates in expected[column]]
+    assert sum(len(candidates) for candidates in ranked["faiss_distance"]) > 0
+
+
+def test_lower_precision_is_opt_in(scenarios):
+    query_scenario, candidate_scenario = scenarios
+    assert mapped_vectors.MappedVectors(candidate_scenario).vectors.dtype == np.float32
+    assert os.listdir(candidate_scenario).count("mapped_float32") == 1
+    for dtype in ["float16", "int8"]:
+        candidates = mapped_vectors.MappedVectors(candidate_scenario, dtype)
+        assert candidates.vectors.dtype == np.dtype(dtype)
+        ranked = mapped_vectors.rank_candidates(query_scenario, candidates, 100., 5)
+        assert all(len(candidates) == 5 for candidates in ranked["faiss_distance"])
+
+
+def open_store(candidate_scenario, barrier, results):
+    # Opens the store of the candidates as a linking process does, once all the processes are ready:
+    barrier.wait()
+    try:
+        candidates = mapped_vectors.MappedVectors(candidate_scenario)
+        results.put([candidates.item(i) for i in range(len(candidates))])
+    except BaseException as e:
+        results.put(repr(e))
+
+
+def test_concurrent_processes_convert_once(monkeypatch, scenarios):
+    query_scenario, candidate_scenario = scenarios
+    # A conversion slow enough that the processes all find the store missing,
+    # and all replace it together:
+    load_combined, replace = mapped_vectors.load_combined, os.replace
+    monkeypatch.setattr(mapped_vectors, "load_combined", lambda scenario: time.sleep(0.5) or load_combined(scenario))
+    monkeypatch.setattr(os, "replace", lambda source, destination: time.sleep(0.2) or replace(source, destination))
+    context = multiprocessing.get_context("fork")
+    barrier, results = context.Barrier(8), context.Queue()
+    processes = [context.Process(target=open_store, args=(candidate_scenario, barrier, results)) for _ in range(8)]
+    for process in processes:
+        process.start()
+    opened = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join()
+    assert opened == [["Station %d" % (i % 150) for i in range(200)]] * 8
+    assert sorted(os.listdir(candidate_scenario)) == sorted(["fwd.pt", "bwd.pt", "fwd_id.pt", "bwd_id.pt", "fwd_items.npy", "bwd_items.npy", "input_dfm.yaml", "mapped_float32", "mapped_float32.lock"])
@@ -0,0 +1,94 @@
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyproj
+import pytest
+from shapely.geometry import MultiPolygon, Point, Polygon
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wikidata"))
+
+import create_gazetteers
+import utils
+
+
+def circle(x, y, radius, resolution=64):
+    return Point(x, y).buffer(radius, resolution)
+
+
+@pytest.fixture
+def polygons():
+    # Polygons in metres: a mainland with a lake, an island split from its own
+    # polygon, and a polygon that shares an edge with the mainland:
+    mainland = Polygon([(0, 0), (20000, 0), (20000, 30000), (0, 30000)], [list(circle(8000, 15000, 3000).exterior.coords)])
+    islands = MultiPolygon([circle(30000, 10000, 4000), circle(8000, 15000, 1500)])
+    neighbour = Polygon([(20000, 0), (26000, 0), (26000, 5000), (20000, 5000)])
+    return gpd.GeoSeries([mainland, islands, neighbour], crs="EPSG:27700")
+
+
+def expected_location(polygons, x, y):
+    located = np.full(len(x), -1)
+    for i, point in enumerate(map(Point, x, y)):
+        for position, polygon in enumerate(polygons):
+            if polygon.contains(point):
+                located[i] = position
+                break
+    return located
+
+
+def test_locate_matches_contains(polygons):
+    rng = np.random.default_rng(13)
+    x = np.concatenate([rng.uniform(-5000, 40000, 3000), [20000, 0, 23000, 10000, 100000]])
+    y = np.concatenate([rng.uniform(-5000, 35000, 3000), [2000, 10000, 0, 30000, 100000]])
+    index = utils.PolygonIndex(polygons, cell_size=1000)
+    grid = index.grid
+    assert (grid >= 0).any() and (grid == index.outside).any() and (grid == index.boundary).any()
+    assert index.locate(x, y).tolist() == expected_location(polygons, x, y).tolist()
+    # Points on the boundaries (the last ones) are not contained, as with "contains":
+    assert index.locate(x[-5:], y[-5:]).tolist() == [-1] * 5
+
+    # The grid and the exact tests can be computed in parallel:
+    parallel = utils.PolygonIndex(polygons, cell_size=1000, number_cpus=2)
+    assert np.array_equal(parallel.grid, grid)
+    x, y = rng.uniform(-5000, 40000, 30000), rng.uniform(-5000, 35000, 30000)
+    assert np.array_equal(parallel.locate(x, y, number_cpus=2), index.locate(x, y))
+
+
+def test_cached_grid_is_rebuilt_for_other_polygons(tmp_path, polygons, monkeypatch):
+    path = str(tmp_path / "grid.npz")
+    built = []
+    build_grid = utils.PolygonIndex.build_grid
+    monkeypatch.setattr(utils.PolygonIndex, "build_grid", lambda self, number_cpus=1: built.append(self.cell_size) or build_grid(self, number_cpus))
+    grid = utils.PolygonIndex.cached(polygons, path).grid
+    assert np.array_equal(utils.PolygonIndex.cached(polygons, path).grid, grid)
+    assert built == [1000]
+
+    # A change in the polygons or in the cell size invalidates the cached grid:
+    changed = polygons.copy()
+    changed[1] = changed[1].geoms[0]
+    utils.PolygonIndex.cached(changed, path)
+    index = utils.PolygonIndex.cached(polygons, path, cell_size=2000)
+    assert built == [1000, 1000, 2000]
+    assert index.grid.shape == (16, 18)
+
+
+def test_gb_subset_matches_the_spatial_join(tmp_path, polygons):
+    # The polygons are given in WGS84, as the extracted coordinates:
+    offset = polygons.translate(400000, 200000)
+    shapefile = gpd.GeoDataFrame({"NAME": ["Mainland", "Islands", "Neighbour"]}, geometry=offset.to_crs(epsg=4326))
+    rng = np.random.default_rng(5)
+    eastings, northings = rng.uniform(395000, 440000, 2000), rng.uniform(195000, 235000, 2000)
+    lats, lons = pyproj.Transformer.from_crs("epsg:27700", "epsg:4326").transform(eastings, northings)
+    gbdf = pd.DataFrame({"wikidata_id": ["Q%d" % i for i in range(2000)], "latitude": lats, "longitude": lons})
+
+    gb = create_gazetteers.gb_subset(gbdf.copy(), shapefile, grid_path=str(tmp_path / "grid.npz"))
+    assert list(gb.columns) == list(gbdf.columns)
+
+    # Entities ordered by the polygon that contains them, as with the spatial join of the shapefile:
+    points = gpd.GeoDataFrame(gbdf, geometry=gpd.points_from_xy(*pyproj.Transformer.from_crs("epsg:4326", "epsg:27700").transform(lats, lons)), crs="EPSG:27700")
+    joined = gpd.sjoin(shapefile.to_crs(epsg=27700), points, how="inner", predicate="contains")
+    expected = joined.reset_index().sort_values(["index", "index_right"], kind="stable")["wikidata_id"]
+    assert list(gb["wikidata_id"]) == list(expected)
+    assert len(gb) > 500
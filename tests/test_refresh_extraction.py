@@ -0,0 +1,73 @@
+import bz2
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import pyarrow.parquet as pq
+import pytest
+
+wikidata_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wikidata")
+sys.path.insert(0, wikidata_folder)
+
+import utils
+
+
+def entity(entity_id, label, lastrevid, coordinates=True):
+    # A dump entity, with its revision at the end of its line (as in the dumps):
+    record = {"type": "item", "id": entity_id, "labels": {"en": {"language": "en", "value": label}}, "claims": {}}
+    if coordinates:
+        record["claims"]["P625"] = [{"mainsnak": {"datavalue": {"value": {"latitude": 51.5, "longitude": -0.1}}}}]
+    record["lastrevid"] = lastrevid
+    return json.dumps(record)
+
+
+def write_dump(filename, entities):
+    with bz2.open(filename, "wt") as f:
+        f.write("[\n" + ",\n".join(entities) + "\n]\n")
+
+
+def run(root, script, *args):
+    # Runs a script from the wikidata folder of root, as described in the README:
+    process = subprocess.run([sys.executable, os.path.join(wikidata_folder, script), "-n", "1"] + list(args),
+                             cwd=root / "wikidata", capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+
+
+def extracted_records(path):
+    records = []
+    for filename in sorted(glob.glob(os.path.join(path, "part-*.parquet"))):
+        records += utils.table_to_records(pq.read_table(filename))
+    return [(record["wikidata_id"], record["english_label"], record["lastrevid"]) for record in records]
+
+
+@pytest.fixture
+def root(tmp_path):
+    (tmp_path / "wikidata").mkdir()
+    write_dump(tmp_path / "old.json.bz2", [entity("Q1", "One", 1), entity("Q2", "Two", 1), entity("Q3", "Three", 1)])
+    run(tmp_path, "entity_extraction.py", "-i", "../old.json.bz2", "-o", "../extracted/")
+    # In the newer dump, Q1 did not change (but its label is different, to tell whether
+    # it is parsed again), Q2 changed, Q3 was deleted, Q4 is new and Q5 has no coordinates:
+    write_dump(tmp_path / "new.json.bz2", [entity("Q1", "One (again)", 1), entity("Q2", "Two (new)", 2),
+                                           entity("Q4", "Four", 1), entity("Q5", "Five", 1, coordinates=False)])
+    return tmp_path
+
+
+def test_refresh_patches_changed_entities_only(root):
+    assert extracted_records(root / "extracted") == [("Q1", "One", 1), ("Q2", "Two", 1), ("Q3", "Three", 1)]
+    run(root, "refresh_extraction.py", "-i", "../new.json.bz2", "-e", "../extracted/")
+    assert extracted_records(root / "extracted") == [("Q1", "One", 1), ("Q2", "Two (new)", 2), ("Q4", "Four", 1)]
+
+
+def test_forced_refresh_matches_a_fresh_extraction(root):
+    run(root, "refresh_extraction.py", "-i", "../new.json.bz2", "-e", "../extracted/", "--force")
+    run(root, "entity_extraction.py", "-i", "../new.json.bz2", "-o", "../fresh/")
+    assert extracted_records(root / "extracted") == extracted_records(root / "fresh")
+
+
+def test_changes_file_keeps_the_other_entities(root):
+    with open(root / "changes.json", "w") as f:
+        f.write(entity("Q2", "Two (changed)", 3) + "\n" + entity("Q3", "Three", 2, coordinates=False) + "\n")
+    run(root, "refresh_extraction.py", "-i", "../changes.json", "-e", "../extracted/", "--changes")
+    assert extracted_records(root / "extracted") == [("Q1", "One", 1), ("Q2", "Two (changed)", 3)]
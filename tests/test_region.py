@@ -0,0 +1,64 @@
+import bz2
+import json
+import os
+import pickle
+import subprocess
+import sys
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import Polygon
+
+wikidata_folder = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "wikidata")
+sys.path.insert(0, wikidata_folder)
+
+import create_gazetteers
+import utils
+
+
+@pytest.fixture
+def polygon(tmp_path):
+    # A triangle around London (in the British National Grid), with a hole around Westminster:
+    triangle = Polygon([(480000, 150000), (580000, 150000), (530000, 230000)],
+                       [[(525000, 175000), (535000, 175000), (530000, 185000)]])
+    filename = str(tmp_path / "region.geojson")
+    gpd.GeoDataFrame(geometry=[triangle], crs="EPSG:27700").to_file(filename, driver="GeoJSON")
+    return filename
+
+
+def test_bbox_matches_the_uk_filter():
+    bbox = (-9.05, 48.78, 2.41, 61.28)
+    region = utils.Region(bbox=[str(x) for x in bbox])
+    rng = np.random.default_rng(7)
+    lats = np.concatenate([rng.uniform(45, 65, 500), [48.78, 61.28, 50.0, 50.0]])
+    lons = np.concatenate([rng.uniform(-12, 5, 500), [0.0, 0.0, -9.05, 2.41]])
+    assert [region.contains(lat, lon) for lat, lon in zip(lats, lons)] == create_gazetteers.filter_uk(lats, lons).tolist()
+    assert not region.contains(None, 0.0)
+
+
+def test_polygon_in_another_coordinate_system(polygon):
+    region = utils.Region(polygon=polygon)
+    assert region.contains(51.3, -0.3)
+    assert not region.contains(51.5, -0.13)  # In the hole
+    assert not region.contains(53.48, -2.24)  # Manchester
+    assert region.bbox[0] < -0.3 < region.bbox[2] and region.bbox[1] < 51.3 < region.bbox[3]
+
+    # The bbox and the polygon are combined, and the region can be sent to workers:
+    region = pickle.loads(pickle.dumps(utils.Region(bbox=(-1, 51.0, -0.2, 52.0), polygon=polygon)))
+    assert region.contains(51.3, -0.3)
+    assert not region.contains(51.3, 0.1)
+    assert region.spec == {"bbox": [-1.0, 51.0, -0.2, 52.0], "polygon": polygon}
+
+
+def test_extraction_keeps_the_entities_in_the_region(tmp_path, polygon):
+    entities = {"Q1": (51.3, -0.3), "Q2": (51.5, -0.13), "Q3": (53.48, -2.24)}
+    with bz2.open(tmp_path / "dump.json.bz2", "wt") as f:
+        f.write("[\n" + ",\n".join(json.dumps({"type": "item", "id": qid, "labels": {}, "claims": {"P625": [
+            {"mainsnak": {"datavalue": {"value": {"latitude": lat, "longitude": lon}}}}]}}) for qid, (lat, lon) in entities.items()) + "\n]\n")
+    process = subprocess.run([sys.executable, "entity_extraction.py", "-i", str(tmp_path / "dump.json.bz2"), "-o", str(tmp_path / "extracted"),
+                              "-n", "2", "-p", polygon], cwd=wikidata_folder, capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+    assert list(utils.read_extracted(str(tmp_path / "extracted" / "part-00000.parquet"))["wikidata_id"]) == ["Q1"]
+    with open(tmp_path / "extracted" / "checkpoint.json") as f:
+        assert json.load(f)["region"] == {"bbox": None, "polygon": polygon}
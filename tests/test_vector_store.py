@@ -0,0 +1,114 @@
+import importlib
+import os
+import pickle
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+torch = pytest.importorskip("torch")
+DeezyMatch = pytest.importorskip("DeezyMatch")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "deezymatch"))
+
+import vector_store
+from DeezyMatch import data_processing
+
+input_file = "general:\n  use_gpu: False\ngru_lstm:\n  learning_rate: 0.001\npreprocessing: {}\n"
+
+
+def vector(toponym):
+    # A vector that identifies the toponym it was computed from:
+    return [len(toponym), sum(map(ord, toponym)) % 1000, ord(toponym[0])]
+
+
+def vectorise(tmp_path, name, toponyms):
+    """
+    Function that vectorises toponyms as findcandidates does (dm_inference and
+    combine_vecs), with DeezyMatch's own tokenisation (which skips the toponyms
+    that are mostly out of the vocabulary) and vectors that identify the
+    toponyms instead of those of a model.
+    """
+    with open(tmp_path / (name + ".txt"), "w") as fw:
+        for toponym in toponyms:
+            fw.write(toponym + "\t0\tfalse\n")
+    scenario = tmp_path / "candidate_vectors" / name
+    vocab = SimpleNamespace(tok2index={tok: i for i, tok in enumerate("|abcdefghijklmnopqrstuvwxyz0123456789 ", 2)})
+    dataset = data_processing.test_tokenize(str(tmp_path / (name + ".txt")), vocab, save_test_class=str(scenario / "dataframe.df"), verbose=False).df
+    os.makedirs(scenario / "embeddings")
+    (scenario / "input_dfm.yaml").write_text(input_file)
+    vectors = torch.tensor([vector(toponym) for toponym in dataset["s1"]], dtype=torch.float32)
+    for rnn_pass, sign in [("fwd", 1), ("bwd", -1)]:
+        torch.save(sign * vectors, str(scenario / "embeddings" / ("rnn_" + rnn_pass + "_0")))
+    torch.save(torch.tensor(dataset.index.to_numpy()), str(scenario / "embeddings" / "rnn_indxs_0"))
+    DeezyMatch.combine_vecs(rnn_passes=vector_store.rnn_passes, input_scenario=str(scenario), output_scenario=str(tmp_path / "combined" / name))
+    return vector_store.read_combined(str(tmp_path / "combined" / name), toponyms)
+
+
+def test_skipped_toponyms_keep_the_other_vectors(tmp_path):
+    vectorised, items, vectors, id_shape, skipped = vectorise(tmp_path, "new", ["london", "伦敦市区", "paris"])
+    assert vectorised == ["london", "paris"]
+    assert skipped == ["伦敦市区"]
+    assert list(items[:, 1]) == vectorised
+    np.testing.assert_array_equal(vectors["fwd"], [vector("london"), vector("paris")])
+    np.testing.assert_array_equal(vectors["bwd"], [[-x for x in vector("london")], [-x for x in vector("paris")]])
+
+    store = vector_store.VectorStore(str(tmp_path / "store"))
+    store.add(vectorised, items, vectors, id_shape)
+    store.skip(skipped)
+    assert vector_store.VectorStore(str(tmp_path / "store")).missing(["paris", "伦敦市区", "berlin"]) == ["berlin"]
+
+
+def test_store_round_trip(tmp_path):
+    store = vector_store.VectorStore(str(tmp_path / "store"))
+    for name, toponyms in [("first", ["london", "伦敦市区", "paris"]), ("second", ["berlin", "york"])]:
+        vectorised, items, vectors, id_shape, skipped = vectorise(tmp_path, name, store.missing(toponyms))
+        store.add(vectorised, items, vectors, id_shape)
+        store.skip(skipped)
+
+    # The combined vectors written from the store are those of each toponym:
+    keys = ["york", "伦敦市区", "paris", "london"]
+    (tmp_path / "input_dfm.yaml").write_text(input_file)
+    vector_store.write_combined(store, keys, str(tmp_path / "combined" / "gb"), str(tmp_path / "input_dfm.yaml"))
+    assert vector_store.combined_is_current(str(tmp_path / "combined" / "gb"), store, keys)
+    fwd = torch.load(str(tmp_path / "combined" / "gb" / "fwd.pt")).numpy()
+    ids = torch.load(str(tmp_path / "combined" / "gb" / "fwd_id.pt")).numpy()
+    items = np.load(str(tmp_path / "combined" / "gb" / "fwd_items.npy"), allow_pickle=True)
+    assert list(items[ids, 1]) == ["york", "paris", "london"]
+    np.testing.assert_array_equal(fwd, [vector(toponym) for toponym in items[ids, 1]])
+
+    # Compacting drops the unused toponyms and keeps the vectors of the others:
+    store.compact(keys)
+    items, vectors = vector_store.VectorStore(str(tmp_path / "store")).get(["london", "york"])
+    assert list(items[:, 1]) == ["london", "york"]
+    np.testing.assert_array_equal(vectors["fwd"], [vector("london"), vector("york")])
+
+
+def test_candidate_ranker_reads_written_combined(tmp_path, monkeypatch):
+    # The cosine and conf metrics still rank with DeezyMatch's candidate ranker,
+    # which reads the input file from the combined candidates (here with a model
+    # whose confidences are all 0):
+    monkeypatch.setattr(importlib.import_module("DeezyMatch.candidateRanker"), "candidate_conf_calc", lambda df, *args, **kwargs: torch.zeros(len(df)))
+    if not hasattr(pd.DataFrame, "append"):
+        monkeypatch.setattr(pd.DataFrame, "append", lambda self, other: pd.concat([self, other]), raising=False)
+    torch.save({}, str(tmp_path / "model.model"))
+    with open(tmp_path / "model.vocab", "wb") as f:
+        pickle.dump({}, f)
+    store = vector_store.VectorStore(str(tmp_path / "store"))
+    vectorised, items, vectors, id_shape, skipped = vectorise(tmp_path, "candidates", ["london", "paris", "york"])
+    store.add(vectorised, items, vectors, id_shape)
+    (tmp_path / "input_dfm.yaml").write_text(input_file)
+    vector_store.write_combined(store, vectorised, str(tmp_path / "combined" / "gb"), str(tmp_path / "input_dfm.yaml"))
+    assert (tmp_path / "combined" / "gb" / "input_dfm.yaml").read_text() == input_file
+    vectorise(tmp_path, "queries", ["londom"])
+    ranked = DeezyMatch.candidate_ranker(query_scenario=str(tmp_path / "combined" / "queries"),
+                                         candidate_scenario=str(tmp_path / "combined" / "gb"),
+                                         ranking_metric="cosine",
+                                         selection_threshold=1.,
+                                         num_candidates=1,
+                                         output_path=str(tmp_path / "ranker_results" / "ranked"),
+                                         pretrained_model_path=str(tmp_path / "model.model"),
+                                         pretrained_vocab_path=str(tmp_path / "model.vocab"))
+    assert list(ranked["faiss_distance"].iloc[0]) == ["london"]
@@ -1,119 +1,112 @@
+import argparse
+import multiprocessing as mp
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Point
 import pyproj
 from pathlib import Path
 import glob
-import ast
+import os
 import sys
 import re
 import time
+import utils
 
 
-start_time = time.time()
-
 # ====================================================
-# Create an approximate subset with entities in the UK
+# Gazetteer filters
 # ====================================================
 
-print("\nCreating the approximate UK gazetteer.")
-
-
 # This function performs an approximate filtering of locations in
 # the United Kingdom, according to their position within the
 # predefined (very) approximate boundary box. The goal in this
 # step is to reduce the knowledge base to a more manageable size,
 # removing obvious non-GB entries, which we will refine later based
-# on a GB shapefile.
-def filter_uk(lat, lon, countries):
+# on a GB shapefile. It takes arrays of latitudes and longitudes and
+# returns a boolean mask (entities without coordinates are filtered out).
+def filter_uk(lat, lon):
     bbox = (-9.05,48.78,2.41,61.28)
-    if float(lat) >= bbox[1] and float(lat) <= bbox[3] and float(lon) >= bbox[0] and float(lon) <= bbox[2]:
-        return True
-    else:
-        return False
-    
-
-# Read the Wikidata extracted processed files, and store
-# an approximated UK gazetteer:
-if not Path("../processed/wikidata/uk_approx_gazetteer.csv").exists():
-    path = r"../resources/wikidata/extracted/"
-    Path(path).mkdir(parents=True, exist_ok=True)
-    Path("../processed/wikidata/").mkdir(parents=True, exist_ok=True)
-
-    all_files = glob.glob(path + "/*.csv")
-
-    li = []
-    for filename in all_files:
-        df_temp = pd.read_csv(filename, index_col=None, header=0)
-        li.append(df_temp)
-        
-    if not li:
-        print("\n***WARNING:***\n\nYou either don't have the processed version of Wikidata (see readme) or its path\nis not correct. This script will be skipped. Make sure you follow the instructions in\nhttps://github.com/Living-with-machines/station-to-station/blob/master/resources/README.md\nto make sure you have the files required to be able to run the linking experiments.")
-        print()
-        sys.exit()
-
-    else:
-        df = pd.concat(li, axis=0, ignore_index=True)
-        df = df.drop(columns=['Unnamed: 0'])
-
-        mask = df.apply(lambda x: filter_uk(x['latitude'], x['longitude'], x['countries']), axis=1)
-        ukdf = df.copy()
-        ukdf = ukdf[mask]
-        ukdf['latitude'] = ukdf['latitude'].astype(float)
-        ukdf['longitude'] = ukdf['longitude'].astype(float)
-        ukdf = ukdf[ukdf['latitude'].notna()]
-        ukdf = ukdf[ukdf['longitude'].notna()]
-        ukdf.to_csv("../processed/wikidata/uk_approx_gazetteer.csv", index=False)
-
-print("Time:", time.time() - start_time)
-
-# =======================================
-# Create generic GB gazetteer
-# =======================================
-
-print("\nCreating the GB gazetteer.")
-
-# Load the approximate UK gazetteer
-gbdf = pd.read_csv("../processed/wikidata/uk_approx_gazetteer.csv", header=0, index_col=None, low_memory=False)
-
-# Load Great Britain shapefile:
-# Boundary-Line™ ESRI Shapefile from https://osdatahub.os.uk/downloads/open/BoundaryLine (licence: http://www.nationalarchives.gov.uk/doc/open-government-licence/version/3/)
-shapefile = gpd.read_file("../resources/geoshapefiles/country_region.shp")
-
-# Set coordinate system converter:
-bng=pyproj.Proj('epsg:27700')
-wgs84 = pyproj.Proj('epsg:4326')
-transformer = pyproj.Transformer.from_crs('epsg:4326', 'epsg:27700')
-
-# Convert coordinates from Wikidata to OSGB 1936 system (British National Grid, United Kingdom Ordnance Survey)
-# Reference: http://epsg.io/27700
-print("* Transforming Wikidata coordinates to OSGB 1936 system.")
-gbdf["geometry"] = gbdf.apply(lambda x: Point(transformer.transform(x["latitude"], x["longitude"])), axis=1)
-geodf = gpd.GeoDataFrame(gbdf).set_crs(epsg=27700)
-
-# Inner merge if a location is contained in one of the shapefile polygons (i.e. if a
-# location is in Great Britain):
-print("* Filtering out locations not in GB.")
-data_merged_inner = gpd.sjoin(shapefile, geodf, how="inner", op='contains')
-cols = data_merged_inner.columns.tolist()
-cols = cols[16:] # Drop shapefile columns
-data_merged_inner = data_merged_inner[cols]
-data_merged_inner = data_merged_inner.reset_index()
-data_merged_inner = data_merged_inner.drop(columns = ["index_right", "index"])
-
-# Store GB gazetteer:
-data_merged_inner.to_csv("../processed/wikidata/gb_gazetteer.csv", index=False)
-
-print("Time:", time.time() - start_time)
-
-
-# ====================================================================
-# Create a subset with station entities in GB
-# ====================================================================
-
-print("\nCreating the GB stations gazetteer.")
-
-gbdf = pd.read_csv("../processed/wikidata/gb_gazetteer.csv", header=0, index_col=None, low_memory=False)
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    return (lat >= bbox[1]) & (lat <= bbox[3]) & (lon >= bbox[0]) & (lon <= bbox[2])
+
+
+def uk_approx_subset(df):
+    """
+    Function that keeps the extracted Wikidata entities whose coordinates
+    fall within the approximate UK boundary box.
+    """
+    ukdf = df[filter_uk(df['latitude'], df['longitude'])].copy()
+    ukdf['latitude'] = ukdf['latitude'].astype(float)
+    ukdf['longitude'] = ukdf['longitude'].astype(float)
+    return ukdf
+
+
+def uk_approx_gazetteer(files, output, chunk_size=100000):
+    """
+    Function that stores the approximate UK gazetteer of the extracted
+    Wikidata files as a csv file. The files are read in chunks (the next
+    chunk is read while the current one is filtered), and the entities of
+    each chunk are appended to the output, so memory stays bounded by the
+    chunk size rather than by the size of the extraction.
+
+    Arguments:
+        files (list): extracted Parquet or csv files (see entity_extraction.py).
+        output (str): path of the csv file of the gazetteer.
+        chunk_size (int): number of extracted entities per chunk.
+
+    Returns:
+        The number of entities in the gazetteer.
+    """
+    # Columns of the gazetteer, in the order of the files:
+    columns = []
+    for filename in files:
+        if filename.endswith(".parquet"):
+            names = [name for name, kind in utils.record_fields]
+        else:
+            names = pd.read_csv(filename, nrows=0).columns
+        columns += [name for name in names if name not in columns and name != 'Unnamed: 0']
+
+    chunks = (chunk for filename in files for chunk in utils.iter_extracted(filename, chunk_size, mask=filter_uk))
+    entities = 0
+    with open(output + ".tmp", "w") as f:
+        pd.DataFrame(columns=columns).to_csv(f, index=False)
+        for df in utils.prefetch(chunks):
+            ukdf = uk_approx_subset(df).reindex(columns=columns)
+            ukdf.to_csv(f, index=False, header=False)
+            entities += len(ukdf)
+    os.replace(output + ".tmp", output)
+    return entities
+
+
+def gb_subset(gbdf, shapefile, number_cpus=1, grid_path="../processed/wikidata/gb_grid.npz"):
+    """
+    Function that keeps the entities of the approximate UK gazetteer that
+    are contained in one of the polygons of the GB shapefile, ordered by
+    polygon. The polygons are indexed with a grid (see utils.PolygonIndex),
+    which is stored in grid_path and reused as long as the shapefile does
+    not change.
+    """
+    # Set coordinate system converter:
+    transformer = pyproj.Transformer.from_crs('epsg:4326', 'epsg:27700')
+
+    # Convert coordinates from Wikidata to OSGB 1936 system (British National Grid, United Kingdom Ordnance Survey)
+    # Reference: http://epsg.io/27700
+    print("* Transforming Wikidata coordinates to OSGB 1936 system.")
+    eastings, northings = transformer.transform(gbdf["latitude"].to_numpy(dtype=float), gbdf["longitude"].to_numpy(dtype=float))
+
+    # Keep a location if it is contained in one of the shapefile polygons (i.e. if a
+    # location is in Great Britain):
+    print("* Filtering out locations not in GB.")
+    polygons = shapefile.geometry if shapefile.crs is None else shapefile.to_crs(epsg=27700).geometry
+    Path(grid_path).parent.mkdir(parents=True, exist_ok=True)
+    polygon_index = utils.PolygonIndex.cached(polygons, grid_path, number_cpus=number_cpus)
+    located = polygon_index.locate(eastings, northings, number_cpus=number_cpus)
+    inside = np.flatnonzero(located >= 0)
+    inside = inside[np.argsort(located[inside], kind="stable")]
+    data_merged_inner = gbdf.iloc[inside].reset_index(drop=True)
+    return data_merged_inner
+
 
 # From: https://docs.google.com/spreadsheets/d/1sREU_TKBU0HXoSSm7nyOw-4kId_bfu6OTEXxtdZeLl0/edit#gid=0
 stn_wkdt_classes = ["Q55488", "Q4663385", "Q55491", "Q18516630", "Q1335652", "Q28109487",
@@ -128,14 +121,105 @@ re_station = r"(.*)\b(([Hh]alt)|([Ss]top)|([Ss]tation))((\, .*)|( \(.*))?$"
 # Most common non-railway stations in Wikidata:
 re_nostation = r".*\b(([Pp]olice [Ss]tation)|([Rr]elay [Ss]tation)|([Ff]ire [Ss]tation)|([Gg]enerating [Ss]tation)|([Ss]ignal [Ss]tation)|([Pp]ower [Ss]tation)|([Ll]ifeboat [Ss]tation)|([Pp]umping [Ss]tation)|([Tt]ransmitting [Ss]tation)|([Bb]us [Ss]tation)|([Cc]oach [Ss]tation)|([Ff]ishing [Ss]tation)).*$"
 
-stationgaz = pd.DataFrame(columns=['wikidata_id', 'english_label', 'instance_of', 'description_set', 'alias_dict', 'nativelabel', 'population_dict', 'area', 'hcounties', 'date_opening', 'date_closing', 'inception_date', 'dissolved_date', 'follows', 'replaces', 'adm_regions', 'countries', 'continents', 'capital_of', 'borders', 'near_water', 'latitude', 'longitude', 'wikititle', 'geonamesIDs', 'toIDs', 'vchIDs', 'vob_placeIDs', 'vob_unitIDs', 'epns', 'os_grid_ref', 'connectswith', 'street_address', 'adjacent_stations', 'ukrailcode', 'connectline', 'heritage_designation', 'getty', 'street_located', 'postal_code', 'ownedby', 'connectservice'])
 
-for i, row in gbdf.iterrows():
-    if type(row["instance_of"]) == str and type(row["english_label"]) == str:
-        wkdtcl = ast.literal_eval(row["instance_of"])
-        if any(x in wkdtcl for x in stn_wkdt_classes) or (re.match(re_station, row["english_label"]) and not re.match(re_nostation, row["english_label"])):
-            stationgaz = stationgaz.append(row, ignore_index=True)
+# Columns of the GB stations gazetteer:
+station_columns = ['wikidata_id', 'english_label', 'instance_of', 'description_set', 'alias_dict', 'nativelabel', 'population_dict', 'area', 'hcounties', 'date_opening', 'date_closing', 'inception_date', 'dissolved_date', 'follows', 'replaces', 'adm_regions', 'countries', 'continents', 'capital_of', 'borders', 'near_water', 'latitude', 'longitude', 'wikititle', 'geonamesIDs', 'toIDs', 'vchIDs', 'vob_placeIDs', 'vob_unitIDs', 'epns', 'os_grid_ref', 'connectswith', 'street_address', 'adjacent_stations', 'ukrailcode', 'connectline', 'heritage_designation', 'getty', 'street_located', 'postal_code', 'ownedby', 'connectservice', 'lastrevid']
+
+
+def stations_subset(gbdf):
+    """
+    Function that keeps the entities of the GB gazetteer (as read from its
+    csv file) that are instances of station-related classes or whose English
+    label looks like the name of a railway station.
+    """
+    has_fields = gbdf["instance_of"].notna() & gbdf["english_label"].notna()
+
+    # Station-related classes, from the list of classes of each entity (stored as a string):
+    classes = gbdf.loc[has_fields, "instance_of"].astype(str).str.findall(r"Q\d+").explode()
+    is_station_class = classes.isin(stn_wkdt_classes).groupby(level=0).any()
+    is_station_class = is_station_class.reindex(gbdf.index, fill_value=False)
+
+    labels = gbdf["english_label"].astype(str)
+    is_station_label = labels.str.match(re_station) & ~labels.str.match(re_nostation)
+
+    stationgaz = gbdf[has_fields & (is_station_class | is_station_label)]
+    stationgaz = stationgaz.reindex(columns=station_columns + [c for c in gbdf.columns if c not in station_columns])
+    return stationgaz.reset_index(drop=True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number_cpus", default=-1,
+                        help="Number of CPUs to be used for filtering the GB locations. Default: -1 (use all)")
+    args = parser.parse_args()
+
+    number_cpus = int(args.number_cpus)
+    if number_cpus < 0:
+        number_cpus = mp.cpu_count()
+
+    utils.enter_sandbox("wikidata")
+
+    start_time = time.time()
+
+    # ====================================================
+    # Create an approximate subset with entities in the UK
+    # ====================================================
+
+    print("\nCreating the approximate UK gazetteer.")
+
+    # Read the Wikidata extracted processed files, and store
+    # an approximated UK gazetteer:
+    if not Path("../processed/wikidata/uk_approx_gazetteer.csv").exists():
+        path = r"../resources/wikidata/extracted/"
+        Path(path).mkdir(parents=True, exist_ok=True)
+        Path("../processed/wikidata/").mkdir(parents=True, exist_ok=True)
+
+        # The extracted files are either Parquet files or csv files (see entity_extraction.py):
+        all_files = sorted(glob.glob(path + "/*.parquet")) + glob.glob(path + "/*.csv")
+
+        if not all_files:
+            print("\n***WARNING:***\n\nYou either don't have the processed version of Wikidata (see readme) or its path\nis not correct. This script will be skipped. Make sure you follow the instructions in\nhttps://github.com/Living-with-machines/station-to-station/blob/master/resources/README.md\nto make sure you have the files required to be able to run the linking experiments.")
+            print()
+            sys.exit()
+
+        else:
+            entities = uk_approx_gazetteer(all_files, "../processed/wikidata/uk_approx_gazetteer.csv")
+            print("Entities in the approximate UK gazetteer:", entities)
+
+    print("Time:", time.time() - start_time)
+
+    # =======================================
+    # Create generic GB gazetteer
+    # =======================================
+
+    print("\nCreating the GB gazetteer.")
+
+    # Load the approximate UK gazetteer
+    gbdf = pd.read_csv("../processed/wikidata/uk_approx_gazetteer.csv", header=0, index_col=None, low_memory=False)
+
+    # Load Great Britain shapefile:
+    # Boundary-Line™ ESRI Shapefile from https://osdatahub.os.uk/downloads/open/BoundaryLine (licence: http://www.nationalarchives.gov.uk/doc/open-government-licence/version/3/)
+    shapefile = gpd.read_file("../resources/geoshapefiles/country_region.shp")
+
+    data_merged_inner = gb_subset(gbdf, shapefile, number_cpus)
+
+    # Store GB gazetteer:
+    data_merged_inner.to_csv("../processed/wikidata/gb_gazetteer.csv", index=False)
+
+    print("Time:", time.time() - start_time)
+
+
+    # ====================================================================
+    # Create a subset with station entities in GB
+    # ====================================================================
+
+    print("\nCreating the GB stations gazetteer.")
+
+    gbdf = pd.read_csv("../processed/wikidata/gb_gazetteer.csv", header=0, index_col=None, low_memory=False)
+
+    stationgaz = stations_subset(gbdf)
 
-stationgaz.to_csv("../processed/wikidata/gb_stations_gazetteer.csv", index=False)
+    stationgaz.to_csv("../processed/wikidata/gb_stations_gazetteer.csv", index=False)
 
-print("Time:", time.time() - start_time)
\ No newline at end of file
+    print("Time:", time.time() - start_time)
@@ -0,0 +1,257 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+import pydash
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pathlib import Path
+from tqdm import tqdm
+import utils
+
+
+# ==========================================
+# Development sandbox
+# ==========================================
+
+# The development sandbox mirrors the layout of the repository: a folder for
+# each stage (from which the scripts are run when S2S_DEV is set, see the
+# READMEs), and its own resources and processed folders, so all the relative
+# paths of the pipeline resolve inside it. It is named after the repository
+# because the ranklib paths are resolved from the folder that contains it.
+sandbox_path = utils.sandbox_path
+stages = ["quicks", "wikidata", "deezymatch", "linking"]
+
+# Resources that are sampled (the rest are linked from the full resources):
+sampled_resources = {
+    "quicks": ["quicks_processed.pkl", "quicks_parsed.pkl", "quicks_dev.tsv", "quicks_test.tsv",
+               "quicks_altname_dev.tsv", "quicks_altname_test.tsv", "quicks_altname_allquicks.tsv"],
+    "wikidata": ["extracted", "dev_region.geojson"],
+}
+
+# Processed files that do not depend on the sample (they are linked from the
+# full processed folder, if they exist, so they are not created again):
+shared_processed = ["wikidata/labels", "wikidata/wikigaz_altnames.pkl", "wikidata/wikigaz_altnames_state.pkl",
+                    "wikidata/geonames_altnames.pkl", "wikidata/geonames_altnames_state.pkl"]
+
+
+def in_sample(key, fraction, seed):
+    """
+    Function that decides whether a key (e.g. a Quicks MainId) is in the
+    sample, by hashing it with the seed. The decision does not depend on
+    the other keys, and samples with a larger fraction (and the same seed)
+    contain those with a smaller one.
+    """
+    digest = hashlib.md5((str(seed) + ":" + str(key)).encode("utf-8")).hexdigest()
+    return int(digest, 16) / 16 ** 32 < fraction
+
+
+def link(source, target):
+    # Symbolic link to a file or folder of the full pipeline:
+    if os.path.lexists(target):
+        return
+    if os.path.exists(source):
+        os.symlink(os.path.abspath(source), target)
+
+
+# ==========================================
+# Sample the Quicks
+# ==========================================
+
+def sample_quicks(fraction, seed, output):
+    """
+    Function that keeps a fraction of the Quicks main stations (and their
+    substations) in all the processed Quicks files, and returns the sampled
+    MainIds and the Wikidata IDs of the stations annotated in the dev and
+    test sets.
+    """
+    parsedf = pd.read_pickle("../resources/quicks/quicks_parsed.pkl")
+    mainids = sorted(mainid for mainid in parsedf["MainId"].unique() if in_sample(mainid, fraction, seed))
+
+    qids = set()
+    for filename in sampled_resources["quicks"]:
+        path = "../resources/quicks/" + filename
+        if not Path(path).exists():
+            continue
+        if filename.endswith(".pkl"):
+            df = pd.read_pickle(path)
+            df[df["MainId"].isin(mainids)].to_pickle(output + filename)
+        else:
+            df = pd.read_csv(path, sep="\t")
+            df = df[df["MainId"].isin(mainids)]
+            df.to_csv(output + filename, sep="\t", index=False)
+            if "Final Wikidata ID" in df.columns:
+                qids.update(df["Final Wikidata ID"].dropna())
+    return mainids, sorted(qids)
+
+
+# ==========================================
+# Sample the extracted Wikidata entities
+# ==========================================
+
+def extracted_files(path):
+    # The extracted files are either Parquet files or csv files (see entity_extraction.py):
+    return sorted(glob.glob(os.path.join(path, "part-*.parquet"))) + sorted(glob.glob(os.path.join(path, "*.csv")))
+
+
+def read_coordinates(filename, columns=["wikidata_id", "latitude", "longitude"]):
+    if filename.endswith(".parquet"):
+        return pq.read_table(filename, columns=columns).to_pandas()
+    return pd.read_csv(filename, usecols=columns)
+
+
+def station_coordinates(qids, extracted, dump):
+    """
+    Function that returns the coordinates of the annotated stations, read
+    from the extracted entities, or, if Wikidata has not been extracted yet,
+    straight from the dump (which requires its index, see dump_index.py).
+    """
+    files = extracted_files(extracted)
+    if files:
+        coordinates = pd.concat([read_coordinates(f) for f in tqdm(files)], ignore_index=True)
+        coordinates = coordinates[coordinates["wikidata_id"].isin(qids)]
+    else:
+        import dump_index
+        rows = []
+        for qid, entity in dump_index.fetch_entities(qids, dump).items():
+            value = pydash.get(entity, "claims.P625.0.mainsnak.datavalue.value") or {}
+            rows.append([qid, value.get("latitude"), value.get("longitude")])
+        coordinates = pd.DataFrame(rows, columns=["wikidata_id", "latitude", "longitude"])
+    return coordinates.dropna(subset=["latitude", "longitude"]).drop_duplicates(subset=["wikidata_id"])
+
+
+def write_region(coordinates, radius, filename):
+    """
+    Function that stores, as a GeoJSON file, the region within radius km of
+    the annotated stations (measured in the British National Grid).
+    """
+    points = gpd.GeoSeries(gpd.points_from_xy(coordinates["longitude"], coordinates["latitude"]), crs="EPSG:4326")
+    region = points.to_crs(epsg=27700).buffer(radius * 1000).unary_union
+    gpd.GeoDataFrame(geometry=[region], crs="EPSG:27700").to_crs(epsg=4326).to_file(filename, driver="GeoJSON")
+
+
+def sample_extracted(extracted, region, output):
+    """
+    Function that keeps the extracted entities within the region, in files
+    with the same names as the full ones, and the alternate names of those
+    entities (if they were extracted). A checkpoint of a finished extraction
+    within the region is stored too, so the sample can be refreshed (see
+    refresh_extraction.py).
+
+    Returns:
+        The Wikidata IDs of the sampled entities.
+    """
+    kept = []
+    files = []
+    for filename in tqdm(extracted_files(extracted)):
+        name = os.path.basename(filename)
+        if filename.endswith(".parquet"):
+            table = pq.read_table(filename)
+            mask = [region.contains(lat, lon) for lat, lon in zip(table.column("latitude").to_pylist(), table.column("longitude").to_pylist())]
+            table = table.filter(pa.array(mask, type=pa.bool_()))
+            if table.num_rows:
+                pq.write_table(table, os.path.join(output, name))
+                kept += table.column("wikidata_id").to_pylist()
+                files.append(name)
+        else:
+            df = pd.read_csv(filename, index_col=None, header=0)
+            df = df[[region.contains(lat, lon) for lat, lon in zip(df["latitude"], df["longitude"])]]
+            if len(df):
+                df.to_csv(os.path.join(output, name), index=False)
+                kept += df["wikidata_id"].tolist()
+                files.append(name)
+
+    altnames_size = None
+    if Path(extracted, "altnames.tsv").exists():
+        altnames = pd.read_csv(os.path.join(extracted, "altnames.tsv"), sep="\t", dtype=str, keep_default_na=False)
+        altnames[altnames["wkid"].isin(set(kept))].to_csv(os.path.join(output, "altnames.tsv"), sep="\t", index=False)
+        altnames_size = os.path.getsize(os.path.join(output, "altnames.tsv"))
+
+    if Path(extracted, "checkpoint.json").exists():
+        with open(os.path.join(extracted, "checkpoint.json")) as f:
+            state = json.load(f)
+        state.update({"region": region.spec, "records": len(kept), "files": files, "altnames": altnames_size, "done": True})
+        with open(os.path.join(output, "checkpoint.json"), "w") as f:
+            json.dump(state, f)
+    return kept
+
+
+# ==========================================
+# Create the development sandbox
+# ==========================================
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--fraction", default=0.05,
+                        help="Fraction of the Quicks main stations in the sample. Default: 0.05")
+    parser.add_argument("-s", "--seed", default=42,
+                        help="Seed of the sample. Default: 42")
+    parser.add_argument("-r", "--radius", default=5,
+                        help="Wikidata entities within this distance (in km) of the annotated stations of the sample are kept. Default: 5")
+    parser.add_argument("-e", "--extracted", default="../resources/wikidata/extracted/",
+                        help="Directory of the full extracted Wikidata entities")
+    parser.add_argument("-i", "--input", default="../resources/wikidata/latest-all.json.bz2",
+                        help="Path to the bz2 Wikidata dump (the coordinates of the stations are read from it if Wikidata has not been extracted yet)")
+    args = parser.parse_args()
+
+    if not Path("../resources/quicks/quicks_parsed.pkl").exists():
+        print("The Quicks have not been processed yet: run quicks/process_railway_stations.py first.")
+        raise SystemExit
+
+    sample = {"fraction": float(args.fraction), "seed": int(args.seed), "radius": float(args.radius)}
+
+    # A different sample invalidates everything the pipeline has produced in the sandbox:
+    sample_file = os.path.join(sandbox_path, "sample.json")
+    if os.path.exists(sample_file):
+        with open(sample_file) as f:
+            previous = json.load(f)
+        if {key: previous.get(key) for key in sample} != sample:
+            print("The sample has changed: removing the processed files of the previous sample.")
+            shutil.rmtree(os.path.join(sandbox_path, "processed"), ignore_errors=True)
+    for folder in stages + ["processed/wikidata"]:
+        Path(sandbox_path, folder).mkdir(parents=True, exist_ok=True)
+    for filename in shared_processed:
+        link("../processed/" + filename, os.path.join(sandbox_path, "processed", filename))
+
+    # Link the resources that are not sampled:
+    for resource in sorted(os.listdir("../resources/")):
+        if resource in sampled_resources:
+            Path(sandbox_path, "resources", resource).mkdir(parents=True, exist_ok=True)
+            for filename in sorted(os.listdir("../resources/" + resource)):
+                if filename not in sampled_resources[resource]:
+                    link("../resources/" + resource + "/" + filename, os.path.join(sandbox_path, "resources", resource, filename))
+        else:
+            Path(sandbox_path, "resources").mkdir(parents=True, exist_ok=True)
+            link("../resources/" + resource, os.path.join(sandbox_path, "resources", resource))
+
+    print("Sampling the Quicks.")
+    mainids, qids = sample_quicks(sample["fraction"], sample["seed"], os.path.join(sandbox_path, "resources/quicks/"))
+    print("Main stations: " + str(len(mainids)) + ", annotated stations: " + str(len(qids)))
+
+    print("\nSampling the Wikidata entities.")
+    coordinates = station_coordinates(qids, args.extracted, args.input)
+    if coordinates.empty:
+        print("None of the annotated stations of the sample has coordinates: use a larger fraction.")
+        raise SystemExit
+    # The region file is given relative to the stage folders, so extracting
+    # Wikidata in the sandbox (with --polygon) gives the same sample:
+    region_file = "../resources/wikidata/dev_region.geojson"
+    write_region(coordinates, sample["radius"], os.path.join(sandbox_path, "resources/wikidata/dev_region.geojson"))
+    region = utils.Region(polygon=os.path.join(sandbox_path, "resources/wikidata/dev_region.geojson"))
+    region.spec["polygon"] = region_file
+
+    output = os.path.join(sandbox_path, "resources/wikidata/extracted/")
+    shutil.rmtree(output, ignore_errors=True)
+    Path(output).mkdir(parents=True, exist_ok=True)
+    entities = sample_extracted(args.extracted, region, output)
+    print("Wikidata entities: " + str(len(entities)))
+
+    sample.update({"mainids": [int(mainid) for mainid in mainids], "qids": qids, "entities": len(entities)})
+    with open(sample_file, "w") as f:
+        json.dump(sample, f)
+    print("\nThe sample is stored in " + os.path.abspath(sandbox_path) + ": set S2S_DEV=1 to run the pipeline on it.")
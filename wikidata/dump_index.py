@@ -0,0 +1,288 @@
+import argparse
+import bz2
+import multiprocessing as mp
+import os
+import re
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+import entity_extraction
+
+
+# ==========================================
+# Find the bz2 blocks of the dump
+# ==========================================
+
+# A bz2 stream is a sequence of blocks, each starting with a 48-bit magic
+# number (the BCD digits of pi), followed by an end-of-stream marker (the
+# BCD digits of sqrt(pi)) and the combined CRC of the stream. Blocks are
+# not byte-aligned, so both markers are searched for at each of the 8
+# possible bit shifts. Each block can be decompressed on its own (see
+# block_stream), which allows to seek to any block of the dump.
+block_magic = 0x314159265359
+eos_magic = 0x177245385090
+
+
+def shifted_patterns(magic):
+    """
+    Function that returns, for each of the 8 possible bit shifts of a 48-bit
+    marker, the bytes that are fully covered by the marker (to be searched
+    for) and their position relative to the byte where the marker starts.
+    """
+    patterns = []
+    for shift in range(8):
+        data = (magic << (8 - shift)).to_bytes(7, "big")
+        if shift == 0:
+            patterns.append((shift, data[0:6], 0))
+        else:
+            patterns.append((shift, data[1:6], 1))
+    return patterns
+
+
+def read_bits(data, bit_offset, nbits):
+    # Integer value of the nbits bits of data starting at bit_offset:
+    first = bit_offset // 8
+    last = (bit_offset + nbits + 7) // 8
+    value = int.from_bytes(data[first:last], "big")
+    return (value >> ((last - first) * 8 - (bit_offset - first * 8) - nbits)) & ((1 << nbits) - 1)
+
+
+def find_bz2_blocks(filename, buffer_size=64 * 1024 * 1024):
+    """
+    Function that returns the bit offsets at which the bz2 blocks of a bz2
+    file start and end (i.e. where the following block or end-of-stream
+    marker starts).
+
+    Returns:
+        starts (np.array): bit offset of the start of each block.
+        ends (np.array): bit offset of the end of each block.
+    """
+    markers = []
+    patterns = [(magic, pattern) for magic in [block_magic, eos_magic] for pattern in shifted_patterns(magic)]
+    file_size = os.path.getsize(filename)
+    with open(filename, "rb") as f, tqdm(total=file_size, unit="B", unit_scale=True) as pbar:
+        position = 0
+        tail = b""
+        while True:
+            buffer = f.read(buffer_size)
+            if not buffer:
+                break
+            data = tail + buffer
+            base = position - len(tail)
+            found = set()
+            for magic, (shift, pattern, skip) in patterns:
+                index = data.find(pattern)
+                while index >= 0:
+                    bit_offset = (index - skip) * 8 + shift
+                    if bit_offset >= 0 and (bit_offset + 55) // 8 <= len(data) and read_bits(data, bit_offset, 48) == magic:
+                        found.add((base * 8 + bit_offset, magic))
+                    index = data.find(pattern, index + 1)
+            markers += [marker for marker in sorted(found) if not markers or marker[0] > markers[-1][0]]
+            tail = data[-16:]
+            position += len(buffer)
+            pbar.update(len(buffer))
+    starts = []
+    ends = []
+    for i, (bit_offset, magic) in enumerate(markers):
+        if magic == block_magic and i + 1 < len(markers):
+            starts.append(bit_offset)
+            ends.append(markers[i + 1][0])
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def block_stream(f, start, end):
+    """
+    Function that returns a standalone bz2 stream containing the block
+    between the bit offsets start and end of the file f: a stream header,
+    the block, and an end-of-stream marker with the CRC of the block.
+    """
+    start, end = int(start), int(end)
+    first = start // 8
+    f.seek(first)
+    data = f.read((end + 7) // 8 - first)
+    nbits = end - start
+    block = read_bits(data, start - first * 8, nbits)
+    block_crc = (block >> (nbits - 80)) & 0xFFFFFFFF
+    bits = (((block << 48) | eos_magic) << 32) | block_crc
+    nbits += 80
+    padding = -nbits % 8
+    return b"BZh9" + (bits << padding).to_bytes((nbits + padding) // 8, "big")
+
+
+def decompress_block(f, start, end):
+    return bz2.decompress(block_stream(f, start, end))
+
+
+# ==========================================
+# Index the entities of the dump
+# ==========================================
+
+def index_blocks(task):
+    """
+    Function that finds the lines that start in a range of blocks of the
+    dump, i.e. after a newline in the range (or at the beginning of the
+    dump, for the first block), and reads the QID of those that are items.
+
+    Arguments:
+        task (tuple): (filename, first, starts, ends, nblocks), where the
+            range of blocks is [first, first + nblocks), and starts and ends
+            are the bit offsets of the blocks from the first one onwards
+            (including a few blocks after the range, in which the last line
+            of the range may continue).
+
+    Returns:
+        qids, blocks, offsets (np.array): the QID (as an integer) of each
+            item, the block where its line starts, and the offset of its line
+            in the decompressed block.
+    """
+    filename, first, starts, ends, nblocks = task
+    qids, blocks, offsets = [], [], []
+    with open(filename, "rb") as f:
+        decompressed = [decompress_block(f, starts[block], ends[block]) for block in range(nblocks)]
+        block_offsets = np.cumsum([0] + [len(data) for data in decompressed])
+        data = b"".join(decompressed)
+        line_starts = [0] if first == 0 else []
+        line_starts += [m.end() for m in re.finditer(b"\n", data)]
+
+        # Read the head of the line that starts at the end of the range:
+        following = nblocks
+        while line_starts and len(data) - line_starts[-1] < 200 and following < len(starts):
+            data += decompress_block(f, starts[following], ends[following])
+            following += 1
+
+    for line_start in line_starts:
+        match = entity_extraction.re_item_head.match(data, line_start)
+        if not match:
+            continue
+        # Lines that start at the very end of the range have offset equal to
+        # the size of the last block of the range:
+        block = min(np.searchsorted(block_offsets, line_start, side="right") - 1, nblocks - 1)
+        qids.append(int(match.group(1)))
+        blocks.append(first + block)
+        offsets.append(line_start - block_offsets[block])
+    return np.array(qids, dtype=np.int64), np.array(blocks, dtype=np.int32), np.array(offsets, dtype=np.int32)
+
+
+def build_index(filename, number_cpus, blocks_per_task=64):
+    """
+    Function that builds the index of a bz2 Wikidata dump: the bit offsets
+    of its bz2 blocks, and, for each item (sorted by QID), the block in
+    which its line starts and the offset of the line in the decompressed
+    block.
+    """
+    starts, ends = find_bz2_blocks(filename)
+    tasks = [(filename, first, starts[first:first + blocks_per_task + 8], ends[first:first + blocks_per_task + 8], min(blocks_per_task, len(starts) - first)) for first in range(0, len(starts), blocks_per_task)]
+    results = []
+    with mp.Pool(processes=number_cpus) as p:
+        for result in tqdm(p.imap(index_blocks, tasks), total=len(tasks)):
+            results.append(result)
+    qids = np.concatenate([r[0] for r in results]) if results else np.array([], dtype=np.int64)
+    blocks = np.concatenate([r[1] for r in results]) if results else np.array([], dtype=np.int32)
+    offsets = np.concatenate([r[2] for r in results]) if results else np.array([], dtype=np.int32)
+    order = np.argsort(qids, kind="stable")
+    return {"starts": starts, "ends": ends, "qids": qids[order], "blocks": blocks[order], "offsets": offsets[order]}
+
+
+def index_path(filename):
+    return filename + ".index.npz"
+
+
+def save_index(index, path):
+    np.savez(path, **index)
+
+
+def load_index(path):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+# ==========================================
+# Fetch entities from the dump
+# ==========================================
+def fetch_lines(qids, filename, index=None):
+    """
+    Function that reads the lines of the entities with the given QIDs
+    straight from their bz2 blocks of the dump, without scanning it.
+
+    Arguments:
+        qids (list): QIDs of the entities (e.g. "Q23070582").
+        filename (str): path to the bz2 Wikidata dump.
+        index (dict): index of the dump (loaded from the index file next
+            to the dump if None, see build_index).
+
+    Returns:
+        A dictionary with the line of each QID found in the dump.
+    """
+    if index is None:
+        index = load_index(index_path(filename))
+    numbers = np.array(sorted(set(int(qid.lstrip("Q")) for qid in qids)), dtype=np.int64)
+    positions = np.searchsorted(index["qids"], numbers)
+    positions = positions[positions < len(index["qids"])]
+    positions = positions[np.isin(index["qids"][positions], numbers)]
+
+    # Read the entities in the order of the dump, decompressing each block once:
+    positions = positions[np.lexsort((index["offsets"][positions], index["blocks"][positions]))]
+    lines = dict()
+    cached_block, cached_data = None, b""
+    with open(filename, "rb") as f:
+        for position in positions:
+            block = int(index["blocks"][position])
+            if block != cached_block:
+                cached_block, cached_data = block, decompress_block(f, index["starts"][block], index["ends"][block])
+            line = cached_data[int(index["offsets"][position]):]
+            following = block + 1
+            while b"\n" not in line and following < len(index["starts"]):
+                line += decompress_block(f, index["starts"][following], index["ends"][following])
+                following += 1
+            lines["Q" + str(index["qids"][position])] = line.split(b"\n", 1)[0].rstrip(b",\r")
+    return lines
+
+
+def fetch_entities(qids, filename, index=None):
+    """
+    Function that reads the entities with the given QIDs straight from
+    their bz2 blocks of the dump (see fetch_lines), and returns a
+    dictionary with the decoded entity of each QID found in the dump.
+    """
+    lines = fetch_lines(qids, filename, index)
+    return {qid: entity_extraction.json_loads(line) for qid, line in lines.items()}
+
+
+# ==========================================
+# Build the index, or fetch entities
+# ==========================================
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", default="../resources/wikidata/latest-all.json.bz2",
+                        help="Path to the bz2 Wikidata dump")
+    parser.add_argument("-q", "--qids", default=None,
+                        help="File with the QIDs of the entities to fetch: a text file with one QID per line, or a csv file with a wikidata_id column (e.g. a gazetteer). If not given, the index of the dump is built")
+    parser.add_argument("-o", "--output", default="../resources/wikidata/fetched_entities.jsonl",
+                        help="File where the fetched entities are stored (one JSON entity per line)")
+    parser.add_argument("-n", "--number_cpus", default=-1,
+                        help="Number of CPUs to be used for building the index. Default: -1 (use all)")
+    args = parser.parse_args()
+
+    number_cpus = int(args.number_cpus)
+    if number_cpus < 0:
+        number_cpus = mp.cpu_count()
+
+    if not os.path.exists(index_path(args.input)):
+        print("Building the index of " + args.input + ".")
+        index = build_index(args.input, number_cpus)
+        save_index(index, index_path(args.input))
+        print("Indexed items: " + str(len(index["qids"])) + ", bz2 blocks: " + str(len(index["starts"])))
+
+    if args.qids:
+        if args.qids.endswith(".csv"):
+            qids = pd.read_csv(args.qids, usecols=["wikidata_id"])["wikidata_id"].dropna().tolist()
+        else:
+            with open(args.qids) as f:
+                qids = [line.strip() for line in f if line.strip()]
+        lines = fetch_lines(qids, args.input)
+        with open(args.output, "wb") as f:
+            for line in lines.values():
+                f.write(line + b"\n")
+        print("Fetched entities: " + str(len(lines)) + " of " + str(len(set(qids))) + ", stored in " + args.output)
@@ -1,10 +1,18 @@
+import argparse
 import bz2
+import functools
+import glob
 import json
+import multiprocessing as mp
+import os
 import pandas as pd
 import pydash
 from tqdm import tqdm
 import pathlib
 import re
+import shutil
+import subprocess
+import utils
 
 pathlib.Path('../processed/wikidata/').mkdir(parents=True, exist_ok=True)
 
@@ -13,385 +21,837 @@ pd.options.mode.chained_assignment = None
 
 languages = ['en', 'cy', 'sco', 'gd', 'ga', 'kw']
 
+# Decode the dump with orjson if it is installed (several times faster than json):
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Entities with geographical coordinates have a "P625" claim. Lines that
+# do not contain this byte sequence can be skipped without decoding them:
+p625_bytes = b'"P625"'
+
+# Region to which the extracted entities are restricted, if any (it is set
+# in each worker by set_region, see utils.Region):
+region = None
+
+
+def set_region(extraction_region):
+    global region
+    region = extraction_region
+
 
 # ==========================================
 # Process bz2 wikidata dump
 # ==========================================
-def wikidata(filename):
-    with bz2.open(filename, mode='rt') as f:
+def wikidata(filename, prefilter=False):
+    """
+    Function that yields the decoded entities of the wikidata dump. In
+    prefilter mode, entities without geographical coordinates (P625) are
+    skipped before they are decoded.
+    """
+    with bz2.open(filename, mode='rb') as f:
         f.read(2) # skip first two bytes: "{\n"
         for line in f:
+            if prefilter and not p625_bytes in line:
+                continue
             try:
-                yield json.loads(line.rstrip(',\n'))
+                yield json_loads(line.rstrip(b',\r\n'))
             except json.decoder.JSONDecodeError:
                 continue
                 
 
 # ==========================================
-# Parse wikidata entry
+# Process bz2 wikidata dump in parallel
 # ==========================================
-def parse_record(record):
-    # Wikidata ID:
-    wikidata_id = record['id']
-
-    # ==========================================
-    # Place description and definition
-    # ==========================================
-
-    # Main label:
-    english_label = pydash.get(record, 'labels.en.value')
-
-    # Location is instance of
-    instance_of_dict = pydash.get(record, 'claims.P31')
-    instance_of = None
-    if instance_of_dict:
-        instance_of = [pydash.get(r, 'mainsnak.datavalue.value.id') for r in instance_of_dict]
 
-    # Descriptions in English:
-    description_set = set()
-    descriptions = pydash.get(record, 'descriptions')
-    for x in descriptions:
-        if x == 'en' or x.startswith('en-'):
-            description_set.add(pydash.get(descriptions[x], 'value'))
+# Every bz2 stream starts with the "BZh" header, the block size and the
+# magic number of its first block. Dumps compressed with pbzip2/lbzip2
+# are a concatenation of such streams, which can be decompressed on
+# their own and therefore processed by independent workers.
+re_bz2_stream = re.compile(rb"BZh[1-9]1AY&SY")
+
+
+def find_bz2_streams(filename, buffer_size=64 * 1024 * 1024):
+    """
+    Function that returns the byte offsets at which the bz2 streams of a
+    (possibly multi-stream) bz2 file start.
+    """
+    offsets = []
+    with open(filename, "rb") as f:
+        position = 0
+        tail = b""
+        while True:
+            buffer = f.read(buffer_size)
+            if not buffer:
+                break
+            data = tail + buffer
+            for match in re_bz2_stream.finditer(data):
+                offset = position - len(tail) + match.start()
+                if not offsets or offset > offsets[-1]:
+                    offsets.append(offset)
+            tail = data[-9:]
+            position += len(buffer)
+    return offsets
+
+
+def bz2_chunks(filename, chunk_size):
+    """
+    Function that groups consecutive bz2 streams into chunks of about
+    chunk_size compressed bytes, returned as (start, end) byte ranges.
+    """
+    offsets = find_bz2_streams(filename)
+    file_size = pathlib.Path(filename).stat().st_size
+    chunks = []
+    start = 0
+    for offset in offsets[1:]:
+        if offset - start >= chunk_size:
+            chunks.append((start, offset))
+            start = offset
+    chunks.append((start, file_size))
+    return chunks
+
+
+def decompress_range(f, start, end=None, read_size=1024 * 1024):
+    """
+    Function that yields the decompressed content of the bz2 streams
+    stored between the byte offsets start and end (end of file if None).
+    """
+    f.seek(start)
+    remaining = None if end is None else end - start
+    decompressor = bz2.BZ2Decompressor()
+    while remaining is None or remaining > 0:
+        data = f.read(read_size if remaining is None else min(read_size, remaining))
+        if not data:
+            break
+        if remaining is not None:
+            remaining -= len(data)
+        while data:
+            decompressed = decompressor.decompress(data)
+            if decompressed:
+                yield decompressed
+            if decompressor.eof:
+                data = decompressor.unused_data
+                decompressor = bz2.BZ2Decompressor()
+            else:
+                data = b""
+
+
+def chunk_lines(filename, start, end):
+    """
+    Function that yields the dump lines that belong to the chunk of bz2
+    streams between start and end. A chunk owns all the lines that start
+    after its first newline (or at its very beginning, for the first chunk),
+    including the line that continues into the following chunk.
+    """
+    with open(filename, "rb") as f:
+        pending = b""
+        skip_head = start > 0
+        for block in decompress_range(f, start, end):
+            lines = (pending + block).split(b"\n")
+            pending = lines.pop()
+            if skip_head and lines:
+                lines = lines[1:]
+                skip_head = False
+            for line in lines:
+                yield line
+
+        # There is no newline in the whole chunk: its content belongs to
+        # a line that is owned by a previous chunk.
+        if skip_head:
+            return
+
+        # Complete the last line with the head of the following chunk:
+        for block in decompress_range(f, end):
+            newline = block.find(b"\n")
+            if newline >= 0:
+                pending += block[:newline]
+                break
+            pending += block
+        if pending:
+            yield pending
+
+
+# Lines of items start with their type and id, followed by their labels:
+re_item_head = re.compile(rb'\{"type":"item","id":"Q(\d+)"')
+re_english_label = re.compile(rb'"en":\{"language":"en","value":"((?:[^"\\]|\\.)*)"\}')
+label_ends = [b'"descriptions":', b'"aliases":', b'"claims":', b'"sitelinks":']
+
+
+def english_label(line):
+    """
+    Function that reads the QID (as an integer) and the English label (as
+    UTF-8 bytes) of an item from its line in the dump, without decoding
+    the line. Returns None if the line is not an item or the item has no
+    English label.
+    """
+    head = re_item_head.match(line)
+    if not head:
+        return None
+    start = line.find(b'"labels":{')
+    if start < 0:
+        return None
+    ends = [end for end in (line.find(key, start) for key in label_ends) if end >= 0]
+    label = re_english_label.search(line, start, min(ends) if ends else len(line))
+    if not label:
+        return None
+    value = label.group(1)
+    if b"\\" in value:
+        value = json_loads(b'"' + value + b'"').encode("utf-8")
+    return int(head.group(1)), value
+
+
+def parse_lines(numbered_lines, prefilter=False, labels=False):
+    """
+    Function that decodes a list of numbered dump lines, i.e. (line number,
+    line) pairs, and returns (line number, parsed record) pairs for the
+    entities with geographical coordinates (P625) in the region (if set).
+    In prefilter mode, lines without "P625" are skipped before decoding.
+
+    If labels is True, the English labels of all the items in the lines are
+    also returned, as (QIDs, label lengths, concatenated labels), otherwise
+    None is returned instead.
+    """
+    records = []
+    qids, lengths, blob = [], [], []
+    for number, line in numbered_lines:
+        if labels:
+            label = english_label(line)
+            if label:
+                qids.append(label[0])
+                lengths.append(len(label[1]))
+                blob.append(label[1])
+        if prefilter and not p625_bytes in line:
+            continue
+        try:
+            record = json_loads(line.rstrip(b",\r\n"))
+        except json.decoder.JSONDecodeError:
+            continue
+        # Only extract items with geographical coordinates (P625)
+        if pydash.has(record, 'claims.P625'):
+            df_record = parse_record(record, region)
+            if df_record is not None:
+                records.append((number, df_record))
+    return records, (qids, lengths, b"".join(blob)) if labels else None
+
+
+def parse_chunk(chunk, prefilter=False, labels=False):
+    """
+    Function that parses the lines of a chunk (filename, start, end, skip)
+    of a multi-stream dump, ignoring its first skip lines.
+    """
+    filename, start, end, skip = chunk
+    numbered_lines = ((number, line) for number, line in enumerate(chunk_lines(filename, start, end)) if number >= skip)
+    return (start,) + parse_lines(numbered_lines, prefilter, labels)
+
+
+def dump_line_batches(filename, batch_size, prefilter=False, skip=0):
+    """
+    Function that reads a single-stream bz2 dump sequentially and yields
+    batches of numbered lines, ignoring the first skip lines. Decompression
+    is delegated to lbzip2 (which can decompress a single stream on several
+    cores) when it is installed. In prefilter mode, lines without "P625"
+    are not sent to the workers.
+    """
+    lbzip2 = shutil.which("lbzip2")
+    if lbzip2:
+        process = subprocess.Popen([lbzip2, "-dc", filename], stdout=subprocess.PIPE, bufsize=1024 * 1024)
+        f = process.stdout
+    else:
+        process = None
+        f = bz2.open(filename, mode='rb')
+    try:
+        batch = []
+        for number, line in enumerate(f):
+            if number < skip or (prefilter and not p625_bytes in line):
+                continue
+            batch.append((number, line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        f.close()
+        if process:
+            process.wait()
+
+
+def parse_line_batch(batch, prefilter=False, labels=False):
+    return (0,) + parse_lines(batch, prefilter, labels)
+
+
+def parallel_wikidata(filename, number_cpus, chunk_size=16 * 1024 * 1024, batch_size=5000, prefilter=False, start=(0, 0), extraction_region=None, on_labels=None):
+    """
+    Function that parses the wikidata dump with a pool of number_cpus
+    workers (or in this process, if number_cpus is 1) and yields the parsed
+    records in the order of the dump.
+
+    If the dump consists of several bz2 streams, each worker decompresses
+    and parses its own range of streams. Otherwise, the dump is decompressed
+    by a single reader and the workers decode and parse batches of lines.
+
+    Each record is yielded together with its position in the dump, i.e. an
+    (offset, lines) pair, where offset is the byte offset of the bz2 stream
+    at which its chunk starts (always 0 for single-stream dumps) and lines
+    is the number of lines of the chunk up to and including the record.
+    Passing a position as start resumes the parsing right after it.
+
+    If extraction_region is given, only the entities whose coordinates fall
+    within the region are yielded.
+
+    If on_labels is given, the English labels of all the items are read too,
+    and on_labels is called with them (see parse_lines) before the records of
+    each chunk (or batch of lines) are yielded.
+    """
+    offset, skip = start
+    labels = on_labels is not None
+    chunks = bz2_chunks(filename, chunk_size)
+    set_region(extraction_region)
+    p = mp.Pool(processes=number_cpus, initializer=set_region, initargs=(extraction_region,)) if number_cpus > 1 else None
+    imap = p.imap if p else map
+    try:
+        if len(chunks) > 1:
+            if not offset in [chunk_start for chunk_start, chunk_end in chunks]:
+                raise ValueError("There is no chunk of %d bytes starting at byte %d of %s." % (chunk_size, offset, filename))
+            tasks = [(filename, chunk_start, chunk_end, skip if chunk_start == offset else 0) for chunk_start, chunk_end in chunks if chunk_start >= offset]
+            results = imap(functools.partial(parse_chunk, prefilter=prefilter, labels=labels), tasks)
+        else:
+            # All lines are sent to the workers if they have to read the labels:
+            batches = dump_line_batches(filename, batch_size, prefilter and not labels, skip)
+            results = imap(functools.partial(parse_line_batch, prefilter=prefilter, labels=labels), batches)
+        for chunk_start, records, chunk_labels in results:
+            if labels:
+                on_labels(*chunk_labels)
+            for number, record in records:
+                yield (chunk_start, number + 1), record
+    finally:
+        if p:
+            p.terminate()
 
-    # Aliases and labels:
-    aliases = pydash.get(record, 'aliases')
-    labels = pydash.get(record, 'labels')
-    alias_dict = dict()
-    for x in aliases:
-        if x in languages or x.startswith('en-'):
-            for y in aliases[x]:
-                if "value" in y:
-                    if not y["value"].isupper() and not y["value"].islower() and any(x.isalpha() for x in y["value"]):
-                        if x in alias_dict:
-                            if not y["value"] in alias_dict[x]:
-                                alias_dict[x].append(y["value"])
-                        else:
-                            alias_dict[x] = [y["value"]]
-    for x in labels:
-        if x in languages or x.startswith('en-'):
-            if "value" in labels[x]:
-                if not labels[x]["value"].isupper() and not labels[x]["value"].islower() and any(z.isalpha() for z in labels[x]["value"]):
-                    if x in alias_dict:
-                        if not labels[x]["value"] in alias_dict[x]:
-                            alias_dict[x].append(labels[x]["value"])
-                    else:
-                        alias_dict[x] = [labels[x]["value"]]
 
-    # Native label
-    nativelabel_dict = pydash.get(record, 'claims.P1705')
-    nativelabel = None
-    if nativelabel_dict:
-        nativelabel = [pydash.get(c, 'mainsnak.datavalue.value.text') for c in nativelabel_dict]
+# ==========================================
+# Properties extracted from each wikidata entry
+# ==========================================
 
+# Each claim is described by a tuple (field, property, path, cardinality),
+# where path is the path to the relevant value within each claim of the
+# property, and cardinality is one of:
+# * "first": value of the first claim (None if there are no claims).
+# * "all": list with the value of each claim (None if there are no claims).
+# * "all_or_empty": list with the value of each claim (empty if there are no claims).
+claim_spec = [
     # ==========================================
-    # Geographic and demographic information
+    # Place description and definition
     # ==========================================
 
-    # Population at: dictionary of year-population pairs
-    population_dump = pydash.get(record, 'claims.P1082')
-    population_dict = dict()
-    if population_dump:
-        for ppl in population_dump:
-            pop_amount = pydash.get(ppl, 'mainsnak.datavalue.value.amount')
-            pop_time = pydash.get(ppl, 'qualifiers.P585[0].datavalue.value.time')
-            pop_time = "UNKNOWN" if not pop_time else pop_time
-            population_dict[pop_time] = pop_amount
-
-    # Area of location
-    dict_area_units = {'Q712226' : 'square kilometre',
-               'Q2737347': 'square millimetre',
-               'Q2489298': 'square centimetre',
-               'Q35852': 'hectare',
-               'Q185078': 'are',
-               'Q25343': 'square metre'}
-
-    area_loc = pydash.get(record, 'claims.P2046[0].mainsnak.datavalue.value')
-    area = None
-    if area_loc:
-        try:
-            if area_loc.get("unit"):
-                area = (area_loc.get("amount"), dict_area_units.get(area_loc.get("unit").split("/")[-1]))
-        except:
-            area = None
+    # Location is instance of
+    ('instance_of', 'P31', 'mainsnak.datavalue.value.id', 'all'),
+    # Native label
+    ('nativelabel', 'P1705', 'mainsnak.datavalue.value.text', 'all'),
 
     # ==========================================
     # Historical information
     # ==========================================
 
     # Historical counties
-    hcounties_dict = pydash.get(record, 'claims.P7959')
-    hcounties = []
-    if hcounties_dict:
-        hcounties = [pydash.get(hc, 'mainsnak.datavalue.value.id') for hc in hcounties_dict]
-
+    ('hcounties', 'P7959', 'mainsnak.datavalue.value.id', 'all_or_empty'),
     # Date of official opening (e.g. https://www.wikidata.org/wiki/Q2011)
-    date_opening = pydash.get(record, 'claims.P1619[0].mainsnak.datavalue.value.time')
-
+    ('date_opening', 'P1619', 'mainsnak.datavalue.value.time', 'first'),
     # Date of official closing
-    date_closing = pydash.get(record, 'claims.P3999[0].mainsnak.datavalue.value.time')
-
+    ('date_closing', 'P3999', 'mainsnak.datavalue.value.time', 'first'),
     # Inception: date or point in time when the subject came into existence as defined
-    inception_date = pydash.get(record, 'claims.P571[0].mainsnak.datavalue.value.time')
-
+    ('inception_date', 'P571', 'mainsnak.datavalue.value.time', 'first'),
     # Dissolved, abolished or demolished: point in time at which the subject ceased to exist
-    dissolved_date = pydash.get(record, 'claims.P576[0].mainsnak.datavalue.value.time')
-
+    ('dissolved_date', 'P576', 'mainsnak.datavalue.value.time', 'first'),
     # Follows...: immediately prior item in a series of which the subject is a part: e.g. Vanuatu follows New Hebrides
-    follows_dict = pydash.get(record, 'claims.P155')
-    follows = []
-    if follows_dict:
-        for f in follows_dict:
-            follows.append(pydash.get(f, 'mainsnak.datavalue.value.id'))
-
-    # Replaces...: item replaced: e.g. New Hebrides is replaced by 
-    replaces_dict = pydash.get(record, 'claims.P1365')
-    replaces = []
-    if replaces_dict:
-        for r in replaces_dict:
-            replaces.append(pydash.get(r, 'mainsnak.datavalue.value.id'))
-
+    ('follows', 'P155', 'mainsnak.datavalue.value.id', 'all_or_empty'),
+    # Replaces...: item replaced: e.g. New Hebrides is replaced by
+    ('replaces', 'P1365', 'mainsnak.datavalue.value.id', 'all_or_empty'),
     # Heritage designation
-    heritage_designation = pydash.get(record, 'claims.P1435[0].mainsnak.datavalue.value.id')
+    ('heritage_designation', 'P1435', 'mainsnak.datavalue.value.id', 'first'),
 
     # ==========================================
     # Neighbouring or part-of locations
     # ==========================================
 
-    # Located in adminitrative territorial entities (Wikidata ID)
-    adm_regions_dict = pydash.get(record, 'claims.P131')
-    adm_regions = dict()
-    if adm_regions_dict:
-        for r in adm_regions_dict:
-            regname = pydash.get(r, 'mainsnak.datavalue.value.id')
-            if regname:
-                entity_start_time = pydash.get(r, 'qualifiers.P580[0].datavalue.value.time')
-                entity_end_time = pydash.get(r, 'qualifiers.P582[0].datavalue.value.time')
-                adm_regions[regname] = (entity_start_time, entity_end_time)
-
-    # Country: sovereign state of this item
-    country_dict = pydash.get(record, 'claims.P17')
-    countries = dict()
-    if country_dict:
-        for r in country_dict:
-            countryname = pydash.get(r, 'mainsnak.datavalue.value.id')
-            if countryname:
-                entity_start_time = pydash.get(r, 'qualifiers.P580[0].datavalue.value.time')
-                entity_end_time = pydash.get(r, 'qualifiers.P582[0].datavalue.value.time')
-                countries[countryname] = (entity_start_time, entity_end_time)
-
     # Continents (Wikidata ID)
-    continent_dict = pydash.get(record, 'claims.P30')
-    continents = None
-    if continent_dict:
-        continents = [pydash.get(r, 'mainsnak.datavalue.value.id') for r in continent_dict]
-
+    ('continents', 'P30', 'mainsnak.datavalue.value.id', 'all'),
     # Location is capital of
-    capital_of_dict = pydash.get(record, 'claims.P1376')
-    capital_of = None
-    if capital_of_dict:
-        capital_of = [pydash.get(r, 'mainsnak.datavalue.value.id') for r in capital_of_dict]
-
+    ('capital_of', 'P1376', 'mainsnak.datavalue.value.id', 'all'),
     # Shares border with:
-    shares_border_dict = pydash.get(record, 'claims.P47')
-    borders = []
-    if shares_border_dict:
-        borders = [pydash.get(t, 'mainsnak.datavalue.value.id') for t in shares_border_dict]
-
+    ('borders', 'P47', 'mainsnak.datavalue.value.id', 'all_or_empty'),
     # Nearby waterbodies (Wikidata ID)
-    near_water_dict = pydash.get(record, 'claims.P206')
-    near_water = None
-    if near_water_dict:
-        near_water = [pydash.get(r, 'mainsnak.datavalue.value.id') for r in near_water_dict]
-
-    # Nearby waterbodies (Wikidata ID)
-    part_of_dict = pydash.get(record, 'claims.P361')
-    part_of = None
-    if part_of_dict:
-        part_of = [pydash.get(r, 'mainsnak.datavalue.value.id') for r in part_of_dict] 
-    
+    ('near_water', 'P206', 'mainsnak.datavalue.value.id', 'all'),
 
     # ==========================================
     # Coordinates
     # ==========================================
 
     # Latitude and longitude:
-    latitude = pydash.get(record, 'claims.P625[0].mainsnak.datavalue.value.latitude')
-    longitude = pydash.get(record, 'claims.P625[0].mainsnak.datavalue.value.longitude')
-    if latitude and longitude:
-        latitude = round(latitude, 6)
-        longitude = round(longitude, 6)
+    ('latitude', 'P625', 'mainsnak.datavalue.value.latitude', 'first'),
+    ('longitude', 'P625', 'mainsnak.datavalue.value.longitude', 'first'),
 
     # ==========================================
     # External data resources IDs
     # ==========================================
 
-    # English Wikipedia title:
-    wikititle = pydash.get(record, 'sitelinks.enwiki.title')
-
     # Geonames ID
-    geonamesID_dict = pydash.get(record, 'claims.P1566')
-    geonamesIDs = None
-    if geonamesID_dict:
-        geonamesIDs = [pydash.get(gn, 'mainsnak.datavalue.value') for gn in geonamesID_dict]
-
+    ('geonamesIDs', 'P1566', 'mainsnak.datavalue.value', 'all'),
     # TOID: TOpographic IDentifier assigned by the Ordnance Survey to identify a feature in Great Britain
-    toID_dict = pydash.get(record, 'claims.P3120')
-    toIDs = None
-    if toID_dict:
-        toIDs = [pydash.get(t, 'mainsnak.datavalue.value') for t in toID_dict]
-
+    ('toIDs', 'P3120', 'mainsnak.datavalue.value', 'all'),
     # British History Online VCH ID: identifier of a place, in the British History Online digitisation of the Victoria County History
-    vchID_dict = pydash.get(record, 'claims.P3628')
-    vchIDs = None
-    if vchID_dict:
-        vchIDs = [pydash.get(t, 'mainsnak.datavalue.value') for t in vchID_dict]
-
+    ('vchIDs', 'P3628', 'mainsnak.datavalue.value', 'all'),
     # Vision of Britain place ID: identifier of a place
-    vob_placeID_dict = pydash.get(record, 'claims.P3616')
-    vob_placeIDs = None
-    if vob_placeID_dict:
-        vob_placeIDs = [pydash.get(vobid, 'mainsnak.datavalue.value') for vobid in vob_placeID_dict]
-
-    # Vision of Britain unit ID: identifier of an administrative unit
-    vob_unitID_dict = pydash.get(record, 'claims.P3615')
-    vob_unitIDs = None
-    if vob_unitID_dict:
-        vob_unitIDs = dict()
-        for vobid in vob_unitID_dict:
-            unit_id = pydash.get(vobid, 'mainsnak.datavalue.value')
-            parish_name = pydash.get(vobid, 'qualifiers.P1810[0].datavalue.value')
-            vob_unitIDs[unit_id] = parish_name
-
+    ('vob_placeIDs', 'P3616', 'mainsnak.datavalue.value', 'all'),
     # Identifier for a place in the Historical Gazetteer of England's Place Names website
-    epns_dict = pydash.get(record, 'claims.P3627')
-    epns = None
-    if epns_dict:
-        epns = [pydash.get(p, 'mainsnak.datavalue.value') for p in epns_dict]
-
+    ('epns', 'P3627', 'mainsnak.datavalue.value', 'all'),
     # Identifier in the Getty Thesaurus of Geographic Names
-    getty_dict = pydash.get(record, 'claims.P1667')
-    getty = None
-    if getty_dict:
-        getty = [pydash.get(p, 'mainsnak.datavalue.value') for p in getty_dict]
-
+    ('getty', 'P1667', 'mainsnak.datavalue.value', 'all'),
     # OS grid reference (Wikidata ID)
-    os_grid_ref = pydash.get(record, 'claims.P613[0].mainsnak.datavalue.value')
+    ('os_grid_ref', 'P613', 'mainsnak.datavalue.value', 'first'),
 
     # ==========================================
     # Street-related properties
     # ==========================================
 
     # Street connects with
-    connectswith_dict = pydash.get(record, 'claims.P2789')
-    connectswith = None
-    if connectswith_dict:
-        connectswith = [pydash.get(c, 'mainsnak.datavalue.value.id') for c in connectswith_dict]
-
+    ('connectswith', 'P2789', 'mainsnak.datavalue.value.id', 'all'),
     # Street address
-    street_address = pydash.get(record, 'claims.P6375[0].mainsnak.datavalue.value.text')
-
+    ('street_address', 'P6375', 'mainsnak.datavalue.value.text', 'first'),
     # Located on street
-    street_located = pydash.get(record, 'claims.P669[0].mainsnak.datavalue.value.id')
-
+    ('street_located', 'P669', 'mainsnak.datavalue.value.id', 'first'),
     # Postal code
-    postal_code_dict = pydash.get(record, 'claims.P281')
-    postal_code = None
-    if postal_code_dict:
-        postal_code = [pydash.get(c, 'mainsnak.datavalue.value') for c in postal_code_dict]
+    ('postal_code', 'P281', 'mainsnak.datavalue.value', 'all'),
 
     # ==========================================
     # Rail-related properties
     # ==========================================
 
     # Adjacent stations
-    adjacent_stations = None
-    adj_st_dump = pydash.get(record, 'claims.P197')
-    if adj_st_dump:
-        adjacent_stations = [pydash.get(adj_st, 'mainsnak.datavalue.value.id') for adj_st in adj_st_dump]
-
+    ('adjacent_stations', 'P197', 'mainsnak.datavalue.value.id', 'all'),
     # UK railway station code
-    ukrailcode_dict = pydash.get(record, 'claims.P4755')
-    ukrailcode = None
-    if ukrailcode_dict:
-        ukrailcode = [pydash.get(ukrid, 'mainsnak.datavalue.value') for ukrid in ukrailcode_dict]
-
+    ('ukrailcode', 'P4755', 'mainsnak.datavalue.value', 'all'),
     # Connecting lines
-    connectline_dict = pydash.get(record, 'claims.P81')
-    connectline = None
-    if connectline_dict:
-        connectline = [pydash.get(conline, 'mainsnak.datavalue.value.id') for conline in connectline_dict]
-
+    ('connectline', 'P81', 'mainsnak.datavalue.value.id', 'all'),
     # Owned by
-    ownedby_dict = pydash.get(record, 'claims.P127')
-    ownedby = None
-    if ownedby_dict:
-        ownedby = [pydash.get(conline, 'mainsnak.datavalue.value.id') for conline in ownedby_dict]
-
+    ('ownedby', 'P127', 'mainsnak.datavalue.value.id', 'all'),
     # Connecting service
-    connectservice_dict = pydash.get(record, 'claims.P1192')
-    connectservice = None
-    if connectservice_dict:
-        connectservice = [pydash.get(conline, 'mainsnak.datavalue.value.id') for conline in connectservice_dict]
+    ('connectservice', 'P1192', 'mainsnak.datavalue.value.id', 'all'),
+]
+
+# Area units
+dict_area_units = {'Q712226' : 'square kilometre',
+                   'Q2737347': 'square millimetre',
+                   'Q2489298': 'square centimetre',
+                   'Q35852': 'hectare',
+                   'Q185078': 'are',
+                   'Q25343': 'square metre'}
+
+
+def compile_path(path):
+    """
+    Function that compiles a pydash-like path (e.g. 'qualifiers.P585[0].datavalue.value.time')
+    into a function that returns the value at that path of a given object, or None if the
+    path does not exist. The path is only parsed once, at compilation time.
+    """
+    keys = []
+    for part in path.split('.'):
+        name, *indices = part.split('[')
+        if name:
+            keys.append(name)
+        keys.extend(int(i.rstrip(']')) for i in indices)
+
+    def get(obj):
+        try:
+            for key in keys:
+                obj = obj[key]
+            return obj
+        except (KeyError, IndexError, TypeError):
+            return None
+    return get
+
+
+def compile_spec(spec):
+    """
+    Function that compiles a claim spec into a list of (field, property,
+    extractor) tuples, where extractor returns the value of the field given
+    the list of claims of the property.
+    """
+    compiled = []
+    for field, prop, path, cardinality in spec:
+        get = compile_path(path)
+        if cardinality == 'first':
+            extractor = lambda claims, get=get: get(claims[0]) if claims else None
+        elif cardinality == 'all':
+            extractor = lambda claims, get=get: [get(c) for c in claims] if claims else None
+        elif cardinality == 'all_or_empty':
+            extractor = lambda claims, get=get: [get(c) for c in claims] if claims else []
+        else:
+            raise ValueError("Unknown cardinality: " + cardinality)
+        compiled.append((field, prop, extractor))
+    return compiled
+
+
+claim_extractors = compile_spec(claim_spec)
+
+get_value = compile_path('mainsnak.datavalue.value')
+get_value_id = compile_path('mainsnak.datavalue.value.id')
+get_amount = compile_path('mainsnak.datavalue.value.amount')
+get_point_in_time = compile_path('qualifiers.P585[0].datavalue.value.time')
+get_start_time = compile_path('qualifiers.P580[0].datavalue.value.time')
+get_end_time = compile_path('qualifiers.P582[0].datavalue.value.time')
+get_named_as = compile_path('qualifiers.P1810[0].datavalue.value')
+
+language_set = set(languages)
+
+
+def is_valid_name(name):
+    # Keep names that are neither all upper-case nor all lower-case, and that
+    # contain at least one alphabetic character:
+    return not name.isupper() and not name.islower() and any(c.isalpha() for c in name)
+
+
+def time_intervals(claims):
+    # Dictionary of Wikidata ID-(start time, end time) pairs:
+    intervals = dict()
+    if claims:
+        for r in claims:
+            entity = get_value_id(r)
+            if entity:
+                intervals[entity] = (get_start_time(r), get_end_time(r))
+    return intervals
+
+
+# ==========================================
+# Parse wikidata entry
+# ==========================================
+def parse_record(record, region=None):
+    # Wikidata ID:
+    wikidata_id = record['id']
+
+    claims = record.get('claims') or {}
+
+    # Revision of the entity (used to refresh the extracted entities incrementally):
+    lastrevid = record.get('lastrevid')
+
+    df_record = {'wikidata_id': wikidata_id, 'lastrevid': lastrevid}
+    for field, prop, extractor in claim_extractors:
+        df_record[field] = extractor(claims.get(prop))
+
+    # ==========================================
+    # Coordinates
+    # ==========================================
+
+    # Latitude and longitude:
+    latitude = df_record['latitude']
+    longitude = df_record['longitude']
+    if latitude and longitude:
+        df_record['latitude'] = round(latitude, 6)
+        df_record['longitude'] = round(longitude, 6)
+
+    # Skip the entity if it is not in the region of interest:
+    if region is not None and not region.contains(df_record['latitude'], df_record['longitude']):
+        return None
+
+    # ==========================================
+    # Place description and definition
+    # ==========================================
+
+    # Main label:
+    labels = record.get('labels') or {}
+    english_label = labels['en'].get('value') if isinstance(labels.get('en'), dict) else None
+
+    # Descriptions in English:
+    description_set = set()
+    descriptions = record.get('descriptions') or {}
+    for x in descriptions:
+        if x == 'en' or x.startswith('en-'):
+            description_set.add(descriptions[x].get('value'))
+
+    # Aliases and labels:
+    aliases = record.get('aliases') or {}
+    alias_dict = dict()
+    for x in aliases:
+        if x in language_set or x.startswith('en-'):
+            for y in aliases[x]:
+                if "value" in y and is_valid_name(y["value"]):
+                    names = alias_dict.setdefault(x, [])
+                    if not y["value"] in names:
+                        names.append(y["value"])
+    for x in labels:
+        if x in language_set or x.startswith('en-'):
+            if "value" in labels[x] and is_valid_name(labels[x]["value"]):
+                names = alias_dict.setdefault(x, [])
+                if not labels[x]["value"] in names:
+                    names.append(labels[x]["value"])
+
+    # ==========================================
+    # Geographic and demographic information
+    # ==========================================
+
+    # Population at: dictionary of year-population pairs
+    population_dict = dict()
+    population_dump = claims.get('P1082')
+    if population_dump:
+        for ppl in population_dump:
+            pop_time = get_point_in_time(ppl)
+            pop_time = "UNKNOWN" if not pop_time else pop_time
+            population_dict[pop_time] = get_amount(ppl)
+
+    # Area of location
+    area_dump = claims.get('P2046')
+    area_loc = get_value(area_dump[0]) if area_dump else None
+    area = None
+    if area_loc:
+        try:
+            if area_loc.get("unit"):
+                area = (area_loc.get("amount"), dict_area_units.get(area_loc.get("unit").split("/")[-1]))
+        except:
+            area = None
+
+    # ==========================================
+    # Neighbouring or part-of locations
+    # ==========================================
+
+    # Located in adminitrative territorial entities (Wikidata ID)
+    adm_regions = time_intervals(claims.get('P131'))
+
+    # Country: sovereign state of this item
+    countries = time_intervals(claims.get('P17'))
+
+    # ==========================================
+    # External data resources IDs
+    # ==========================================
+
+    # English Wikipedia title:
+    sitelinks = record.get('sitelinks') or {}
+    wikititle = sitelinks['enwiki'].get('title') if isinstance(sitelinks.get('enwiki'), dict) else None
+
+    # Vision of Britain unit ID: identifier of an administrative unit
+    vob_unitID_dict = claims.get('P3615')
+    vob_unitIDs = None
+    if vob_unitID_dict:
+        vob_unitIDs = dict()
+        for vobid in vob_unitID_dict:
+            vob_unitIDs[get_value(vobid)] = get_named_as(vobid)
+
+    df_record.update({'english_label': english_label, 'description_set': description_set,
+                      'alias_dict': alias_dict, 'population_dict': population_dict,
+                      'area': area, 'adm_regions': adm_regions, 'countries': countries,
+                      'wikititle': wikititle, 'vob_unitIDs': vob_unitIDs})
 
     # ==========================================
     # Store records in a dictionary
     # ==========================================
-    df_record = {'wikidata_id': wikidata_id, 'english_label': english_label,
-                 'instance_of': instance_of, 'description_set': description_set,
-                 'alias_dict': alias_dict, 'nativelabel': nativelabel,
-                 'population_dict': population_dict, 'area': area,
-                 'hcounties': hcounties, 'date_opening': date_opening,
-                 'date_closing': date_closing, 'inception_date': inception_date,
-                 'dissolved_date': dissolved_date, 'follows': follows,
-                 'replaces': replaces, 'adm_regions': adm_regions,
-                 'countries': countries, 'continents': continents,
-                 'capital_of': capital_of, 'borders': borders, 'near_water': near_water,
-                 'latitude': latitude, 'longitude': longitude, 'wikititle': wikititle,
-                 'geonamesIDs': geonamesIDs, 'toIDs': toIDs, 'vchIDs': vchIDs,
-                 'vob_placeIDs': vob_placeIDs, 'vob_unitIDs': vob_unitIDs,
-                 'epns': epns, 'os_grid_ref': os_grid_ref, 'connectswith': connectswith,
-                 'street_address': street_address, 'adjacent_stations': adjacent_stations,
-                 'ukrailcode': ukrailcode, 'connectline': connectline,
-                 'heritage_designation': heritage_designation, 'getty': getty,
-                 'street_located': street_located, 'postal_code': postal_code,
-                 'ownedby': ownedby, 'connectservice': connectservice
-                }
-    return df_record
+    return {column: df_record[column] for column in utils.columns}
+
+
+# ==========================================
+# Checkpoint extraction runs
+# ==========================================
+class Checkpoint:
+    """
+    Progress of an extraction run, stored as "checkpoint.json" in the
+    output directory. It is updated (atomically) every time the sink
+    completes an output file, with the position in the dump of the last
+    record in that file, so that an interrupted run can be resumed from
+    there without losing or duplicating entities.
+
+    Arguments:
+        path (str): output directory.
+        input (str): path to the bz2 Wikidata dump.
+        chunk_size (int): size of the chunks in which the dump is split.
+        region (dict): region to which the entities are restricted (see utils.Region).
+        labels (bool): whether the English labels are stored too (the size of
+            the files of the label writer, set as labels, is then stored in
+            the checkpoint).
+        altnames (bool): whether the alternate names are stored too (the size
+            of the file of the altname writer, set as altnames, is then stored
+            in the checkpoint).
+    """
+    def __init__(self, path, input, chunk_size, region=None, labels=False, altnames=False):
+        self.labels = None
+        self.altnames = None
+        self.filename = os.path.join(path, "checkpoint.json")
+        self.state = {"input": os.path.abspath(input), "chunk_size": chunk_size, "region": region,
+                      "labels": [0, 0] if labels else None,
+                      "altnames": 0 if altnames else None, "offset": 0, "lines": 0, "last_id": None, "records": 0,
+                      "files": [], "pending": None, "done": False}
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def load(self):
+        with open(self.filename) as f:
+            state = json.load(f)
+        if state["input"] != self.state["input"] or state["chunk_size"] != self.state["chunk_size"] or state.get("region") != self.state["region"] or (state.get("labels") is None) != (self.state["labels"] is None) or (state.get("altnames") is None) != (self.state["altnames"] is None):
+            raise ValueError("The checkpoint in %s was created for %s (chunk size %d, region %s), use the same input, chunk size, region, labels and altnames options to resume it." % (self.filename, state["input"], state["chunk_size"], state.get("region")))
+        self.state = state
+
+    def save(self):
+        with open(self.filename + ".tmp", "w") as f:
+            json.dump(self.state, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.filename + ".tmp", self.filename)
+
+    def start(self, filename):
+        # The file the sink is about to write is recorded, so it can be
+        # removed if the run is interrupted before the file is committed:
+        self.state["pending"] = filename
+        self.save()
+
+    def commit(self, sink, filename, rows):
+        self.state["offset"], self.state["lines"] = sink.position
+        self.state["last_id"] = sink.last_id
+        self.state["records"] += rows
+        self.state["files"].append(filename)
+        if self.labels:
+            self.state["labels"] = self.labels.sizes()
+        if self.altnames:
+            self.state["altnames"] = self.altnames.size()
+        self.save()
+
+    def finish(self):
+        self.state["done"] = True
+        self.save()
+
+    def remove_uncommitted(self, path):
+        """
+        Function that removes the output file (and its temporary file) that
+        an interrupted run was writing when it stopped, if the checkpoint
+        records it as started but not committed. No other file is removed.
+        """
+        pending = self.state.get("pending")
+        if pending and pending not in self.state["files"]:
+            for filename in [pending, pending + ".tmp"]:
+                if os.path.exists(os.path.join(path, filename)):
+                    os.remove(os.path.join(path, filename))
+
+    def remove_written(self, path):
+        """
+        Function that removes all the output files that the checkpoint in the
+        output directory records as written (or started) by its run, so that
+        the run can be restarted.
+        """
+        with open(self.filename) as f:
+            state = json.load(f)
+        for filename in state.get("files", []) + ([state["pending"]] if state.get("pending") else []):
+            for name in [filename, filename + ".tmp"]:
+                if os.path.exists(os.path.join(path, name)):
+                    os.remove(os.path.join(path, name))
+
+
+def existing_outputs(path):
+    # Extracted files (of either format) already in the output directory:
+    return sorted(filename for pattern in ["part-*.parquet*", "*till_*_item.csv*"] for filename in glob.glob(os.path.join(path, pattern)))
 
 
 # ==========================================
 # Parse all WikiData
 # ==========================================
 
-### Uncomment the following to run this script (WARNING: This will take days to run, 40 hours on a machine with 64GiB of RAM):
-
-# path = r"../resources/wikidata/extracted/"
-# pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-
-# df_record_all = pd.DataFrame(columns=['wikidata_id', 'english_label', 'instance_of', 'description_set', 'alias_dict', 'nativelabel', 'population_dict', 'area', 'hcounties', 'date_opening', 'date_closing', 'inception_date', 'dissolved_date', 'follows', 'replaces', 'adm_regions', 'countries', 'continents', 'capital_of', 'borders', 'near_water', 'latitude', 'longitude', 'wikititle', 'geonamesIDs', 'toIDs', 'vchIDs', 'vob_placeIDs', 'vob_unitIDs', 'epns', 'os_grid_ref', 'connectswith', 'street_address', 'adjacent_stations', 'ukrailcode', 'connectline', 'heritage_designation', 'getty', 'street_located', 'postal_code', 'ownedby', 'connectservice'])
-
-# header=True
-# i = 0
-# for record in tqdm(wikidata('../resources/wikidata/latest-all.json.bz2')):
-    
-#     # Only extract items with geographical coordinates (P625)
-#     if pydash.has(record, 'claims.P625'):
-        
-#         # ==========================================
-#         # Store records in a csv
-#         # ==========================================
-#         df_record = parse_record(record)
-#         df_record_all = df_record_all.append(df_record, ignore_index=True)
-#         i += 1
-#         if (i % 5000 == 0):
-#             pd.DataFrame.to_csv(df_record_all, path_or_buf=path + '/till_'+record['id']+'_item.csv')
-#             print('i = '+str(i)+' item '+record['id']+'  Done!')
-#             print('CSV exported')
-#             df_record_all = pd.DataFrame(columns=['wikidata_id', 'english_label', 'instance_of', 'description_set', 'alias_dict', 'nativelabel', 'population_dict', 'area', 'hcounties', 'date_opening', 'date_closing', 'inception_date', 'dissolved_date', 'follows', 'replaces', 'adm_regions', 'countries', 'continents', 'capital_of', 'borders', 'near_water', 'latitude', 'longitude', 'wikititle', 'geonamesIDs', 'toIDs', 'vchIDs', 'vob_placeIDs', 'vob_unitIDs', 'epns', 'os_grid_ref', 'connectswith', 'street_address', 'adjacent_stations', 'ukrailcode', 'connectline'])
-#         else:
-#             continue
-            
-# pd.DataFrame.to_csv(df_record_all, path_or_buf=path + 'final_csv_till_'+record['id']+'_item.csv')
-# print('i = '+str(i)+' item '+record['id']+'  Done!')
-# print('All items finished, final CSV exported!')
\ No newline at end of file
+### WARNING: Running this script will take days if it is run on a single core (40 hours on a machine with 64GiB of RAM).
+### Use -n to parse the dump with several processes.
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", default="../resources/wikidata/latest-all.json.bz2",
+                        help="Path to the bz2 Wikidata dump")
+    parser.add_argument("-o", "--output", default="../resources/wikidata/extracted/",
+                        help="Directory where the extracted files are stored")
+    parser.add_argument("-f", "--format", default="parquet", choices=["parquet", "csv"],
+                        help="Output format: parquet (default, nested fields are stored as list/struct columns) or csv (one file per 5000 entities, nested fields are stored as strings)")
+    parser.add_argument("-n", "--number_cpus", default=-1,
+                        help="Number of CPUs to be used for processing. Default: -1 (use all). Use 1 to parse the dump sequentially")
+    parser.add_argument("-c", "--chunk_size", default=16 * 1024 * 1024,
+                        help="Size (in compressed bytes) of the chunks in which multi-stream dumps are split. Default: 16MiB")
+    parser.add_argument("-b", "--bbox", default=None,
+                        help="Only extract the entities within this boundary box, given as min_lon,min_lat,max_lon,max_lat (e.g. --bbox=-9.05,48.78,2.41,61.28 for the approximate UK boundary box)")
+    parser.add_argument("-p", "--polygon", default=None,
+                        help="Only extract the entities within the polygons of this file (e.g. a shapefile or a GeoJSON file)")
+    parser.add_argument("-l", "--labels", nargs="?", const="../processed/wikidata/labels/", default=None,
+                        help="Also store the English labels of all the entities in the dump as a label index in this directory (default: ../processed/wikidata/labels/)")
+    parser.add_argument("-a", "--altnames", action="store_true",
+                        help="Also store the alternate names of the extracted entities that come from Wikidata (English label, aliases and native labels) in altnames.tsv, in the output directory, in the long format of the altname-centric gazetteers")
+    parser.add_argument("--restart", action="store_true",
+                        help="Ignore the checkpoint of a previous run in the output directory and extract all items again (the files written by that run are removed)")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="Remove the extracted files (of either format) already in the output directory that no checkpoint records, instead of stopping")
+    args = parser.parse_args()
+    utils.enter_sandbox("wikidata", args, ["input", "output", "polygon", "labels"])
+
+    number_cpus = int(args.number_cpus)
+    if number_cpus < 0:
+        number_cpus = mp.cpu_count()
+
+    path = args.output
+    pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+
+    # ==========================================
+    # Resume an interrupted run from its checkpoint
+    # ==========================================
+    extraction_region = None
+    if args.bbox or args.polygon:
+        extraction_region = utils.Region(bbox=args.bbox.split(",") if args.bbox else None, polygon=args.polygon)
+
+    checkpoint = Checkpoint(path, args.input, int(args.chunk_size), extraction_region.spec if extraction_region else None, bool(args.labels), args.altnames)
+    if checkpoint.exists() and not args.restart:
+        checkpoint.load()
+        if checkpoint.state["done"]:
+            print('All items were already extracted to ' + path + ' (use --restart to extract them again).')
+            raise SystemExit
+        checkpoint.remove_uncommitted(path)
+        print('Resuming after item ' + str(checkpoint.state["last_id"]) + ' (' + str(checkpoint.state["records"]) + ' items already extracted).')
+    else:
+        if checkpoint.exists():
+            checkpoint.remove_written(path)
+        # Files that were not written by a checkpointed run (e.g. an earlier
+        # extraction) are only removed if asked to:
+        existing = existing_outputs(path)
+        if existing and not args.overwrite:
+            print('The output directory ' + path + ' already contains ' + str(len(existing)) + ' extracted files (e.g. ' + os.path.basename(existing[0]) + '): use another output directory, or --overwrite to remove them.')
+            raise SystemExit(1)
+        for filename in existing:
+            os.remove(filename)
+        checkpoint.save()
+
+    label_writer = None
+    if args.labels:
+        label_writer = utils.LabelWriter(path, checkpoint.state["labels"])
+        checkpoint.labels = label_writer
+
+    altname_writer = None
+    if args.altnames:
+        altname_writer = utils.AltnameWriter(path, checkpoint.state["altnames"])
+        checkpoint.altnames = altname_writer
+
+    start = (checkpoint.state["offset"], checkpoint.state["lines"])
+    records = parallel_wikidata(args.input, number_cpus, chunk_size=int(args.chunk_size), prefilter=True, start=start,
+                                extraction_region=extraction_region, on_labels=label_writer.write if label_writer else None)
+
+    if args.format == "parquet":
+        sink = utils.ParquetSink(path, first_shard=len(checkpoint.state["files"]), on_commit=checkpoint.commit, on_start=checkpoint.start)
+    else:
+        sink = utils.CsvSink(path, written=checkpoint.state["records"], on_commit=checkpoint.commit, on_start=checkpoint.start)
+
+    # ==========================================
+    # Store records as they are parsed
+    # ==========================================
+    for position, df_record in tqdm(records):
+        # Alternate names are written first, so that they are in the
+        # checkpoint if the record completes an output file:
+        if altname_writer:
+            altname_writer.write(df_record)
+        sink.write(df_record, position)
+    sink.close()
+    if altname_writer:
+        altname_writer.close()
+    if label_writer:
+        label_writer.build(args.labels)
+    checkpoint.finish()
+
+    print('All items finished, final file exported!')
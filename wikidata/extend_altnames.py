@@ -1,7 +1,18 @@
+import argparse
 import pandas as pd
 import ast
+import json
+import os
 import re
 from pathlib import Path
+import utils
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--full", action="store_true",
+                    help="Rebuild the altname gazetteer of GB (and the geonames and WikiGazetteer altnames it is built from) from scratch, rather than updating the altnames of the entities of the GB gazetteer that changed since it was created")
+args = parser.parse_args()
+
+utils.enter_sandbox("wikidata")
 
 ### --------------------------------------------
 ### Load GB gazetteer
@@ -21,6 +32,19 @@ print("\nLoading the GB stations gazetteer.")
 stationdf = pd.read_csv("../processed/wikidata/gb_stations_gazetteer.csv", header=0, index_col=None, low_memory=False)
 
 
+# The geonames and WikiGazetteer altnames are filtered from these source files
+# once, and filtered again when they change (size and modification time):
+source_files = ["../resources/wikigaz/wikigaz_en_basic.pkl", "../resources/geonames/alternateNamesV2.txt", "../resources/geonames/GB.txt"]
+
+def source_state(filenames):
+    state = dict()
+    for filename in filenames:
+        if Path(filename).exists():
+            stat = os.stat(filename)
+            state[os.path.basename(filename)] = (stat.st_size, stat.st_mtime_ns)
+    return state
+
+
 ### --------------------------------------------
 ### Process English WikiGazetteer altnames
 ### --------------------------------------------
@@ -28,7 +52,9 @@ stationdf = pd.read_csv("../processed/wikidata/gb_stations_gazetteer.csv", heade
 # The English WikiGazetteer can be downloaded from https://zenodo.org/record/4034819/: download the .zip. The only file we will need is 'wikigaz_en_basic.pkl', which should be stored in ../resources/wikigaz/.
 print("\nCreating the English WikiGazetteer altnames dataframe.")
 
-if not Path("../processed/wikidata/wikigaz_altnames.pkl").exists():
+wikigaz_state_path = "../processed/wikidata/wikigaz_altnames_state.pkl"
+wikigaz_state = {"sources": source_state(source_files[:1])}
+if args.full or not Path("../processed/wikidata/wikigaz_altnames.pkl").exists() or not Path(wikigaz_state_path).exists() or pd.read_pickle(wikigaz_state_path) != wikigaz_state:
     wikigaz_path = "../resources/wikigaz/wikigaz_en_basic.pkl"
     wikigaz_en = pd.read_pickle(wikigaz_path)
 
@@ -41,6 +67,7 @@ if not Path("../processed/wikidata/wikigaz_altnames.pkl").exists():
     wikigaz_altnames = wikigaz_en[["pid", "altname"]]
     wikigaz_altnames = wikigaz_altnames.drop_duplicates(subset=["pid", "altname"], ignore_index = True)
     wikigaz_altnames.to_pickle("../processed/wikidata/wikigaz_altnames.pkl")
+    pd.to_pickle(wikigaz_state, wikigaz_state_path)
     
 wikigaz_altnames = pd.read_pickle("../processed/wikidata/wikigaz_altnames.pkl")
         
@@ -59,16 +86,30 @@ wikigaz_altnames = pd.read_pickle("../processed/wikidata/wikigaz_altnames.pkl")
 
 print("\nProcessing geonames altnames.")
 
-if not Path("../processed/wikidata/geonames_altnames.pkl").exists():
-    geoaltnames = pd.read_csv("../resources/geonames/alternateNamesV2.txt", sep="\t", names=["alternateNameId", "geonameid", "isolanguage", "alternateName", "isPreferredName", "isShortName", "isColloquial", "isHistoric", "from", "to"], index_col=None, low_memory=False)
-
+# Only the alternate names of geonames entries that have a corresponding Wikidata
+# entry are kept, so the geonames IDs of the GB gazetteer are read first. The
+# altnames are filtered again when the source files change, or when the GB
+# gazetteer has geonames IDs that they were not filtered for (e.g. after a
+# refresh of the extraction, see refresh_extraction.py):
+def parse_geonames(geoIDs):
+    geonamesIDs = ast.literal_eval(geoIDs)
+    return [int(gn) for gn in geonamesIDs if type(gn) == str]
+
+brit_geonameIDs = set(britdf["geonamesIDs"].dropna().map(parse_geonames).explode().dropna().astype(int))
+
+geonames_state_path = "../processed/wikidata/geonames_altnames_state.pkl"
+geonames_state = None
+if not args.full and Path("../processed/wikidata/geonames_altnames.pkl").exists() and Path(geonames_state_path).exists():
+    geonames_state = pd.read_pickle(geonames_state_path)
+    if geonames_state["sources"] != source_state(source_files[1:]) or not brit_geonameIDs <= geonames_state["geonameIDs"]:
+        geonames_state = None
+
+if geonames_state is None:
     # Filter out alternate names that are actually pseudocodes:
     gn_pseudocodes = ["post", "link", "iata", "icao",
                       "faac", "tcid", "unlc", "abbr",
                       "wkdt", "phon", "piny", "fr_1793"] # Geonames pseucodes from here: https://www.geonames.org/manual.html
 
-    geoaltnames = geoaltnames[~geoaltnames["isolanguage"].isin(gn_pseudocodes)]
-
     # Filter by languages native to the British Isles or with strong influence in toponymy:
     # gd: Scottish Gaelic
     # kw: Cornish
@@ -81,16 +122,23 @@ if not Path("../processed/wikidata/geonames_altnames.pkl").exists():
     # fr: French
     # la: Latin
     gn_toplanguages = ["gd", "kw", "sco", "cy", "ga", "en", "gv", "br", "fr", "la"]
-    geoaltnames = geoaltnames[(geoaltnames["isolanguage"].isin(gn_toplanguages)) | (geoaltnames["isolanguage"].isnull())]
 
-    geoaltnames = geoaltnames.drop(columns=["alternateNameId", "isolanguage", "isPreferredName", "isShortName", "isColloquial", "isHistoric", "from", "to"])
+    # The alternate names of all countries are read in chunks, keeping only those of
+    # the GB geonames IDs (before any other filter), in the relevant languages:
+    geoaltnames = []
+    for chunk in pd.read_csv("../resources/geonames/alternateNamesV2.txt", sep="\t", names=["alternateNameId", "geonameid", "isolanguage", "alternateName", "isPreferredName", "isShortName", "isColloquial", "isHistoric", "from", "to"], usecols=["geonameid", "isolanguage", "alternateName"], index_col=None, chunksize=1000000):
+        chunk = chunk[chunk["geonameid"].isin(brit_geonameIDs)]
+        chunk = chunk[~chunk["isolanguage"].isin(gn_pseudocodes)]
+        chunk = chunk[(chunk["isolanguage"].isin(gn_toplanguages)) | (chunk["isolanguage"].isnull())]
+        geoaltnames.append(chunk[["geonameid", "alternateName"]])
+    geoaltnames = pd.concat(geoaltnames, ignore_index=True)
 
     # Keep asciiname and alternateName from the GB database:
-    gb_geonames = pd.read_csv("../resources/geonames/GB.txt", sep="\t", names=["geonameid", "name", "asciiname", "alternatenames", "latitude", "longitude", "fclass", "fcode", "ccode", "cc2", "admin1", "admin2", "admin3", "admin4", "population", "elevation", "dem", "timezone", "moddate"], index_col=None, low_memory=False)
-    gb_geonames = gb_geonames.drop(columns=["alternatenames", "latitude", "longitude", "fclass", "fcode", "ccode", "cc2", "admin1", "admin2", "admin3", "admin4", "population", "elevation", "dem", "timezone", "moddate"])
+    gb_geonames = pd.read_csv("../resources/geonames/GB.txt", sep="\t", names=["geonameid", "name", "asciiname", "alternatenames", "latitude", "longitude", "fclass", "fcode", "ccode", "cc2", "admin1", "admin2", "admin3", "admin4", "population", "elevation", "dem", "timezone", "moddate"], usecols=["geonameid", "name", "asciiname"], index_col=None, low_memory=False)
+    gb_geonames = gb_geonames[gb_geonames["geonameid"].isin(brit_geonameIDs)]
     gb_altnames = list(set(gb_geonames.groupby(['geonameid', 'name']).groups))
     gb_altnames.extend(list(set(gb_geonames.groupby(['geonameid', 'asciiname']).groups)))
-    gb_altnames = list(set(gb_altnames))
+    gb_altnames = sorted(set(gb_altnames))
     gb_geonames = pd.DataFrame(gb_altnames, columns = ["geonameid", "alternateName"])
 
     # Concatenate all altname dataframes and filter relevant rows:
@@ -98,34 +146,13 @@ if not Path("../processed/wikidata/geonames_altnames.pkl").exists():
     geonames_altnames = geonames_altnames.drop_duplicates(ignore_index=True)
 
     # Filter out alternate names if they are not in Latin alphabet:
-    def latin_alphabet(toponym):
-        latin_range = re.compile(u'[\u0040-\u007F\u0080-\u00FF\u0100-\u017F\u0180-\u024F]', flags=re.UNICODE)
-        if re.search(latin_range, toponym):
-            return True
-        else:
-            return False
-
-    geonames_altnames = geonames_altnames[geonames_altnames.apply(lambda x: latin_alphabet(x["alternateName"]), axis=1)]
-    
-    # For speed in later stage, keep only rows that have a corresponding Wikidata entry
-    def parse_geonames(geoIDs):
-        geonamesIDs = []
-        if type(geoIDs) == str:
-            geonamesIDs = ast.literal_eval(geoIDs)
-            geonamesIDs = [int(gn) for gn in geonamesIDs if type(gn) == str]
-        return geonamesIDs
-
-    brit_geonameIDs = []
-    for i, row in britdf.iterrows():
-        tmp_gnalt = parse_geonames(row["geonamesIDs"])
-        if tmp_gnalt:
-            brit_geonameIDs.extend(tmp_gnalt)
-
-    geonames_altnames = geonames_altnames[geonames_altnames["geonameid"].isin(brit_geonameIDs)]
+    latin_range = u'[\u0040-\u007F\u0080-\u00FF\u0100-\u017F\u0180-\u024F]'
+    geonames_altnames = geonames_altnames[geonames_altnames["alternateName"].str.contains(latin_range, regex=True, na=False)]
 
     # Convert geonames ids to strings:
     geonames_altnames.geonameid = geonames_altnames.geonameid.astype(str)
     geonames_altnames.to_pickle("../processed/wikidata/geonames_altnames.pkl")
+    pd.to_pickle({"sources": source_state(source_files[1:]), "geonameIDs": brit_geonameIDs}, geonames_state_path)
 
 geonames_altnames = pd.read_pickle("../processed/wikidata/geonames_altnames.pkl")
 
@@ -136,74 +163,143 @@ geonames_altnames = pd.read_pickle("../processed/wikidata/geonames_altnames.pkl"
 
 print("\nCreating an altnames-centric gazetteer of GB.")
 
-if not Path("../processed/wikidata/altname_gb_gazetteer.pkl").exists():
-    def obtain_altnames(elabel, aliases, nativelabel, wikipedia_title, geonamesIDs, wikigaz_altnames, geoaltnames):
-
-        altnames = dict()
-        if type(geonamesIDs) == str:
-            geonamesIDs = ast.literal_eval(geonamesIDs)
-            geon_altnames = set(geonames_altnames[geonames_altnames["geonameid"].isin(geonamesIDs)].alternateName.unique())
-            for ga in geon_altnames:
-                altnames[ga] = "geonames"
-
-        if type(wikipedia_title) == str:
-            wikipedia_title = wikipedia_title.replace(" ", "_")
-            wgaz_altnames = set(wikigaz_altnames[wikigaz_altnames["pid"] == wikipedia_title].altname.unique())
-            for wa in wgaz_altnames:
-                altnames[wa] = "wikigaz"
-
-        re_appo = r"(.+)(:?\(.+\)|(\,.+))$"
-        if type(nativelabel) == str:
-            nlabel = ast.literal_eval(nativelabel)
-            for nl in nlabel:
-                altnames[nl] = "native_label"
-
-        if type(aliases) == str:
-            aliases = ast.literal_eval(aliases)
-            for language in aliases:
-                for a in aliases[language]:
-                    if re.match(re_appo, a):
-                        a = re.match(re_appo, a).group(1).strip()
-                        a = re.sub(",$", "", a)
-                    altnames[a] = "wikidata_alias"
-
-        if type(elabel) == str:
-            if re.match(re_appo, elabel):
-                elabel = re.match(re_appo, elabel).group(1).strip()
-                elabel = re.sub(",$", "", elabel)
-            altnames[elabel] = "english_label"
-
-        return altnames
-
-    # Apply to GB gazetteer dataframe:
-    wkid = []
-    altname = []
-    source = []
-    lat = []
-    lon = []
-    dAltnames = dict()
-
-    for i, row in britdf.iterrows():
-        dAltnames = obtain_altnames(row["english_label"], row["alias_dict"], row["nativelabel"], row["wikititle"], row["geonamesIDs"], wikigaz_altnames, geonames_altnames)
-        for a in dAltnames:
-            wkid.append(row["wikidata_id"])
-            altname.append(a)
-            source.append(dAltnames[a])
-            lat.append(row["latitude"])
-            lon.append(row["longitude"])
+# The alternate names that come from Wikidata can be stored during the extraction
+# (see entity_extraction.py, option -a), so that they do not have to be parsed
+# from the gazetteer:
+wkdt_altnames_path = "../resources/wikidata/extracted/altnames.tsv"
+wkdt_checkpoint_path = "../resources/wikidata/extracted/checkpoint.json"
+wkdt_altnames = None
+if Path(wkdt_altnames_path).exists() and Path(wkdt_checkpoint_path).exists():
+    with open(wkdt_checkpoint_path) as f:
+        extraction_done = json.load(f)["done"]
+    if extraction_done:
+        print("* Loading the Wikidata altnames stored during the extraction.")
+        wkdt_altnames = dict()
+        altnames_df = pd.read_csv(wkdt_altnames_path, sep="\t", usecols=["wkid", "altname", "source"], dtype=str, keep_default_na=False)
+        altnames_df = altnames_df[altnames_df["wkid"].isin(britdf["wikidata_id"])]
+        for wkid, altname, source in altnames_df.itertuples(index=False):
+            wkdt_altnames.setdefault(wkid, dict())[altname] = source
+
+
+def build_altnames(entities):
+    """
+    Function that returns the rows of the altname-centric gazetteer (wkid,
+    altname, source, lat, lon) of the entities of the GB gazetteer.
+    """
+    # The altnames of each entity come from geonames (through its geonames IDs),
+    # the WikiGazetteer (through its Wikipedia title) and Wikidata, in this order:
+    # if an altname comes from several sources, it keeps the position of its
+    # first source and the name of its last source. Each source is joined with
+    # the exploded GB gazetteer (one row per entity and geonames ID or title),
+    # so the altname tables are only read once.
+    entities = entities.reset_index(drop=True)
+
+    geonames_ids = entities["geonamesIDs"].dropna().map(ast.literal_eval).explode().dropna()
+    geonames_ids = pd.DataFrame({"row": geonames_ids.index, "geonameid": geonames_ids.astype(str).values})
+    geonames_rows = geonames_ids.merge(geonames_altnames[["geonameid", "alternateName"]], on="geonameid")
+    geonames_rows = pd.DataFrame({"row": geonames_rows["row"], "altname": geonames_rows["alternateName"], "source": "geonames"})
+
+    titles = entities["wikititle"].dropna()
+    titles = pd.DataFrame({"row": titles.index, "pid": titles.astype(str).str.replace(" ", "_").values})
+    wikigaz_rows = titles.merge(wikigaz_altnames[["pid", "altname"]], on="pid")
+    wikigaz_rows = pd.DataFrame({"row": wikigaz_rows["row"], "altname": wikigaz_rows["altname"], "source": "wikigaz"})
+
+    # Native labels, aliases and English label (unless they were stored during the extraction):
+    wikidata_rows = []
+    for row, entity in enumerate(entities[["wikidata_id", "english_label", "alias_dict", "nativelabel"]].itertuples(index=False)):
+        if wkdt_altnames is not None:
+            row_altnames = wkdt_altnames.get(entity.wikidata_id, dict())
+        else:
+            nativelabel = ast.literal_eval(entity.nativelabel) if type(entity.nativelabel) == str else None
+            aliases = ast.literal_eval(entity.alias_dict) if type(entity.alias_dict) == str else None
+            elabel = entity.english_label if type(entity.english_label) == str else None
+            row_altnames = utils.wikidata_altnames(elabel, aliases, nativelabel)
+        wikidata_rows += [(row, altname, source) for altname, source in row_altnames.items()]
+    wikidata_rows = pd.DataFrame(wikidata_rows, columns=["row", "altname", "source"])
+
+    altnames = pd.concat([geonames_rows, wikigaz_rows, wikidata_rows], ignore_index=True)
+    altnames = altnames.sort_values("row", kind="stable").reset_index(drop=True)
+    first = altnames.drop_duplicates(subset=["row", "altname"], keep="first")[["row", "altname"]]
+    last = altnames.drop_duplicates(subset=["row", "altname"], keep="last")[["row", "altname", "source"]]
+    altnames = first.merge(last, on=["row", "altname"], how="left")
+    rows = altnames["row"].astype(int).values
 
     wkdtgazetteer = pd.DataFrame()
-    wkdtgazetteer["wkid"] = wkid
-    wkdtgazetteer["altname"] = altname
-    wkdtgazetteer["source"] = source
-    wkdtgazetteer["lat"] = lat
-    wkdtgazetteer["lon"] = lon
+    wkdtgazetteer["wkid"] = entities["wikidata_id"].values[rows]
+    wkdtgazetteer["altname"] = altnames["altname"].values
+    wkdtgazetteer["source"] = altnames["source"].values
+    wkdtgazetteer["lat"] = entities["latitude"].values[rows]
+    wkdtgazetteer["lon"] = entities["longitude"].values[rows]
 
     wkdtgazetteer = wkdtgazetteer.drop_duplicates(subset = ['wkid', 'altname'])
     wkdtgazetteer = wkdtgazetteer[wkdtgazetteer['altname'].notna()]
-    wkdtgazetteer.to_csv("../processed/wikidata/altname_gb_gazetteer.tsv", sep="\t", index=False)
-    
-wkdtgazetteer = pd.read_csv("../processed/wikidata/altname_gb_gazetteer.tsv", sep="\t")
+    return wkdtgazetteer
+
+
+def read_altname_gazetteer(filename):
+    # Altnames are read as they were written (e.g. "NA" is not a missing value):
+    return pd.read_csv(filename, sep="\t", dtype={"wkid": str, "altname": str, "source": str}, keep_default_na=False, na_values={"lat": [""], "lon": [""]})
+
+
+def write_changelog(previous, current, filename):
+    """
+    Function that stores the altname strings that were added to or removed
+    from an altname-centric gazetteer (e.g. for updating the DeezyMatch
+    candidate vectors), as a tsv file with an altname and a change column.
+    """
+    previous = set() if previous is None else set(previous["altname"])
+    current = set(current["altname"])
+    changes = pd.DataFrame([(a, "added") for a in sorted(current - previous)] + [(a, "removed") for a in sorted(previous - current)], columns=["altname", "change"])
+    changes.to_csv(filename, sep="\t", index=False)
+    print("* " + filename + ": " + str((changes["change"] == "added").sum()) + " added and " + str((changes["change"] == "removed").sum()) + " removed altnames.")
+
+
+# The altnames of an entity only depend on these fields of the GB gazetteer (and
+# on its Wikidata altnames, if they were stored during the extraction), so an
+# existing altname gazetteer is updated by recomputing the altnames of the
+# entities whose fields changed (or that were added or removed) only. It is
+# rebuilt when the source files of the geonames or WikiGazetteer altnames
+# change (the geonames altnames of the other entities do not change when they
+# are filtered for new geonames IDs):
+altname_fields = ["wikidata_id", "english_label", "alias_dict", "nativelabel", "wikititle", "geonamesIDs", "latitude", "longitude"]
+altname_gazetteer_path = "../processed/wikidata/altname_gb_gazetteer.tsv"
+altname_state_path = "../processed/wikidata/altname_gb_gazetteer_state.pkl"
+
+entity_fields = britdf[altname_fields].astype(str)
+if wkdt_altnames is not None:
+    entity_fields["wikidata_altnames"] = [str(list(wkdt_altnames.get(wkid, dict()).items())) for wkid in britdf["wikidata_id"]]
+entity_hashes = pd.Series(pd.util.hash_pandas_object(entity_fields, index=False).values, index=britdf["wikidata_id"].values)
+entity_hashes = entity_hashes.groupby(level=0, sort=False).sum()
+sources_key = (source_state(source_files), int(pd.util.hash_pandas_object(wikigaz_altnames, index=False).sum()), wkdt_altnames is not None)
+
+previous_state = None
+previous_gazetteer = None
+if Path(altname_gazetteer_path).exists():
+    previous_gazetteer = read_altname_gazetteer(altname_gazetteer_path)
+    if not args.full and Path(altname_state_path).exists():
+        previous_state = pd.read_pickle(altname_state_path)
+        if previous_state["sources"] != sources_key:
+            print("* The geonames, WikiGazetteer or Wikidata altnames changed: rebuilding the gazetteer.")
+            previous_state = None
+
+if previous_state is None:
+    wkdtgazetteer = build_altnames(britdf)
+else:
+    previous_hashes = previous_state["hashes"]
+    common = entity_hashes.index.intersection(previous_hashes.index)
+    changed = set(entity_hashes.index.difference(previous_hashes.index)) | set(previous_hashes.index.difference(entity_hashes.index))
+    changed |= set(common[entity_hashes[common].values != previous_hashes[common].values])
+    print("* Updating the altnames of " + str(len(changed)) + " added, changed or removed entities.")
+
+    wkdtgazetteer = pd.concat([previous_gazetteer[~previous_gazetteer["wkid"].isin(changed)], build_altnames(britdf[britdf["wikidata_id"].isin(changed)])], ignore_index=True)
+    # Keep the order of the entities in the GB gazetteer:
+    positions = pd.Series(range(len(britdf)), index=britdf["wikidata_id"].values)
+    positions = positions[~positions.index.duplicated()]
+    wkdtgazetteer = wkdtgazetteer.iloc[positions[wkdtgazetteer["wkid"]].values.argsort(kind="stable")]
+
+wkdtgazetteer.to_csv(altname_gazetteer_path, sep="\t", index=False)
+pd.to_pickle({"sources": sources_key, "hashes": entity_hashes}, altname_state_path)
+write_changelog(previous_gazetteer, wkdtgazetteer, "../processed/wikidata/altname_gb_gazetteer_changes.tsv")
 
 
 ### --------------------------------------------
@@ -221,19 +317,21 @@ wkdtgazetteer_stn = wkdtgazetteer[wkdtgazetteer["wkid"].isin(stationdf["wikidata
 re_station = r"(.*?)\b(:?([Rr]ailw[ae]y)|([Rr]ail)|([Uu]nderground)|([Tt]hameslink)|([Oo]verground)|([Tt]ube)|([Ss]ubway)|([Tt]rain)|([Mm]etrolink)|([Mm]etro)|([Tt]ram)|([Hh]alt)|([Hh]alt [Rr]ailw[ae]y))? ?(:?([Hh]alt)|([Ss]top)|([Ss]tation)|([Dd][Aa][Rr][Tt]))((\, .*)|( \(.*))?$"
 re_nostation = r".*\b(([Pp]olice [Ss]tation)|([Rr]elay [Ss]tation)|([Ff]ire [Ss]tation)|([Gg]enerating [Ss]tation)|([Ss]ignal [Ss]tation)|([Pp]ower [Ss]tation)|([Ll]ifeboat [Ss]tation)|([Pp]umping [Ss]tation)|([Tt]ransmitting [Ss]tation)|([Bb]us [Ss]tation)|([Ff]ishing [Ss]tation)).*$"
 
-penultimate_tokens = []
-antepenultimate_tokens = []
-for i, row in wkdtgazetteer_stn.iterrows():
-    
-    if re.match(re_station, row["altname"]) and not re.match(re_nostation, row["altname"]):
-        newaltname = re.sub(re_station, r"\1", row["altname"]).strip()
-        if newaltname:
-            wkdtgazetteer_stn = wkdtgazetteer_stn.append(pd.Series([row["wkid"], newaltname, "processed", row["lat"], row["lon"]], index=wkdtgazetteer_stn.columns), ignore_index=True)
+stn_altnames = wkdtgazetteer_stn["altname"].astype(str)
+is_station = stn_altnames.str.match(re_station) & ~stn_altnames.str.match(re_nostation) & wkdtgazetteer_stn["altname"].notna()
+newaltnames = stn_altnames[is_station].str.extract(re_station, expand=True)[0].str.strip()
+newaltnames = newaltnames[newaltnames.notna() & (newaltnames != "")]
+processed = wkdtgazetteer_stn.loc[newaltnames.index].assign(altname=newaltnames, source="processed")
+wkdtgazetteer_stn = pd.concat([wkdtgazetteer_stn, processed], ignore_index=True)
 
 wkdtgazetteer_stn = wkdtgazetteer_stn.drop_duplicates(subset = ['wkid', 'altname'])
 wkdtgazetteer_stn = wkdtgazetteer_stn[wkdtgazetteer_stn['altname'].notna()]
 wkdtgazetteer_stn = wkdtgazetteer_stn.reset_index(drop=True)
 
+previous_stations = None
+if Path("../processed/wikidata/altname_gb_stations_gazetteer.tsv").exists():
+    previous_stations = read_altname_gazetteer("../processed/wikidata/altname_gb_stations_gazetteer.tsv")
 wkdtgazetteer_stn.to_csv("../processed/wikidata/altname_gb_stations_gazetteer.tsv", sep="\t", index=False)
+write_changelog(previous_stations, wkdtgazetteer_stn, "../processed/wikidata/altname_gb_stations_gazetteer_changes.tsv")
 
 print("\nDone!")
\ No newline at end of file
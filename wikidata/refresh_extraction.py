@@ -0,0 +1,355 @@
+import argparse
+import glob
+import io
+import json
+import multiprocessing as mp
+import os
+import re
+import pandas as pd
+import pydash
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pathlib import Path
+from tqdm import tqdm
+import utils
+import entity_extraction
+import create_gazetteers
+
+
+# ==========================================
+# Find the entities that changed
+# ==========================================
+
+# The id of an entity is at the beginning of its line in the dump, and its
+# revision at the end, so they can be read without decoding the line:
+re_entity_id = re.compile(rb'"id": ?"(Q\d+)"')
+re_lastrevid = re.compile(rb'"lastrevid": ?(\d+)')
+
+# Revisions of the extracted entities (set in each worker by set_revisions):
+revisions = dict()
+
+
+def set_revisions(known_revisions, extraction_region=None):
+    global revisions
+    revisions = known_revisions
+    entity_extraction.set_region(extraction_region)
+
+
+def entity_revision(line):
+    """
+    Function that reads the id and the revision of an entity from its line
+    in the dump (or None if the line is not an entity).
+    """
+    entity_id = re_entity_id.search(line, 0, 200)
+    lastrevid = re_lastrevid.search(line, max(0, len(line) - 200)) or re_lastrevid.search(line)
+    if not entity_id:
+        return None, None
+    return entity_id.group(1).decode(), int(lastrevid.group(1)) if lastrevid else None
+
+
+def diff_lines(lines):
+    """
+    Function that compares the entities in a list of dump lines with the
+    extracted entities (whose revisions are in revisions), and parses only
+    the entities that are new or whose revision changed.
+
+    Returns:
+        changes (list): (entity id, record) pairs, where record is the
+            parsed record, or None if the entity no longer has coordinates
+            (or they are not in the region of the extraction anymore).
+        seen (list): ids of the extracted entities found in the lines.
+    """
+    changes = []
+    seen = []
+    for line in lines:
+        entity_id, lastrevid = entity_revision(line)
+        if entity_id is None:
+            continue
+        known = entity_id in revisions
+        if known:
+            seen.append(entity_id)
+            if lastrevid is not None and revisions[entity_id] == lastrevid:
+                continue
+        elif not entity_extraction.p625_bytes in line:
+            continue
+        try:
+            record = entity_extraction.json_loads(line.rstrip(b",\r\n"))
+        except ValueError:
+            continue
+        df_record = None
+        if pydash.has(record, 'claims.P625'):
+            df_record = entity_extraction.parse_record(record, entity_extraction.region)
+        if df_record is not None or known:
+            changes.append((entity_id, df_record))
+    return changes, seen
+
+
+def diff_chunk(chunk):
+    filename, start, end = chunk
+    return diff_lines(entity_extraction.chunk_lines(filename, start, end))
+
+
+def line_batches(filename, batch_size):
+    """
+    Function that yields batches of lines of a file of entities, either
+    a bz2 dump or an uncompressed file with one JSON entity per line.
+    """
+    if filename.endswith(".bz2"):
+        for batch in entity_extraction.dump_line_batches(filename, batch_size):
+            yield [line for number, line in batch]
+        return
+    with open(filename, "rb") as f:
+        batch = []
+        for line in f:
+            batch.append(line)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def entity_changes(filename, known_revisions, number_cpus, chunk_size=16 * 1024 * 1024, batch_size=5000, extraction_region=None):
+    """
+    Function that yields the (changes, seen) results of diff_lines for all
+    the lines of a dump (or of a file of changed entities), processed with
+    a pool of number_cpus workers. If extraction_region is given, entities
+    outside the region are treated as entities without coordinates.
+    """
+    set_revisions(known_revisions, extraction_region)
+    chunks = entity_extraction.bz2_chunks(filename, chunk_size) if filename.endswith(".bz2") else []
+    p = mp.Pool(processes=number_cpus, initializer=set_revisions, initargs=(known_revisions, extraction_region)) if number_cpus > 1 else None
+    imap = p.imap if p else map
+    try:
+        if len(chunks) > 1:
+            results = imap(diff_chunk, [(filename, start, end) for start, end in chunks])
+        else:
+            results = imap(diff_lines, line_batches(filename, batch_size))
+        for result in results:
+            yield result
+    finally:
+        if p:
+            p.terminate()
+
+
+# ==========================================
+# Patch the extracted entities
+# ==========================================
+def store_revisions(path):
+    """
+    Function that returns a dictionary with the revision of each entity in
+    the extracted Parquet files (-1 if the files were extracted before
+    revisions were stored, so that the entities are parsed again).
+    """
+    known_revisions = dict()
+    for filename in sorted(glob.glob(os.path.join(path, "part-*.parquet"))):
+        table = pq.read_table(filename, columns=[name for name in ['wikidata_id', 'lastrevid'] if name in pq.read_schema(filename).names])
+        ids = utils.column_values(table, 'wikidata_id')
+        revs = utils.column_values(table, 'lastrevid')
+        for entity_id, lastrevid in zip(ids, revs):
+            known_revisions[entity_id] = -1 if lastrevid is None else lastrevid
+    return known_revisions
+
+
+def patch_store(path, updates):
+    """
+    Function that patches the extracted Parquet files in place: entities in
+    updates are replaced by their new record (in the same position), or
+    removed if their new record is None. New entities are written to a new
+    file at the end.
+
+    Arguments:
+        path (str): directory of the extracted Parquet files.
+        updates (dict): new record (or None) for each entity id.
+
+    Returns:
+        The list of new records (i.e. of entities that were not extracted yet).
+    """
+    pending = dict(updates)
+    filenames = sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+    for filename in tqdm(filenames):
+        table = pq.read_table(filename)
+        ids = table.column('wikidata_id')
+        touched = pc.is_in(ids, value_set=pa.array(list(updates), type=pa.string()))
+        if not pc.any(touched).as_py():
+            continue
+        records = []
+        for record in utils.table_to_records(table):
+            if record['wikidata_id'] in updates:
+                record = pending.pop(record['wikidata_id'], None)
+            if record is not None:
+                records.append(record)
+        writer = pq.ParquetWriter(filename + ".tmp", utils.arrow_schema)
+        for i in range(0, len(records), 5000):
+            writer.write_table(pa.Table.from_batches([utils.records_to_batch(records[i:i + 5000])]))
+        writer.close()
+        os.replace(filename + ".tmp", filename)
+
+    new_records = [record for record in pending.values() if record is not None]
+    if new_records:
+        sink = utils.ParquetSink(path, first_shard=len(filenames))
+        for record in new_records:
+            sink.write(record)
+        sink.close()
+    return new_records
+
+
+def patch_altnames(path, updates):
+    """
+    Function that patches the alternate names stored during the extraction
+    (see utils.AltnameWriter), if any: the alternate names of the entities
+    in updates are removed, and those of their new records are added at the
+    end.
+    """
+    filename = os.path.join(path, "altnames.tsv")
+    if not os.path.exists(filename):
+        return
+    altnames_df = pd.read_csv(filename, sep="\t", dtype=str, keep_default_na=False)
+    altnames_df = altnames_df[~altnames_df["wkid"].isin(list(updates))]
+    altnames_df.to_csv(filename + ".tmp", sep="\t", index=False)
+    writer = utils.AltnameWriter(path, os.path.getsize(filename + ".tmp"), "altnames.tsv.tmp")
+    for record in updates.values():
+        if record is not None:
+            writer.write(record)
+    writer.close()
+    os.replace(filename + ".tmp", filename)
+
+
+# ==========================================
+# Patch the gazetteers
+# ==========================================
+def read_gazetteer(filename):
+    # All values are read as they are written in the csv file, so that the
+    # rows that are not patched are written back unchanged:
+    return pd.read_csv(filename, header=0, index_col=None, dtype=str, keep_default_na=False)
+
+
+def as_csv_rows(df):
+    # Rows as they would be written to (and read from) a gazetteer csv file:
+    return pd.read_csv(io.StringIO(df.to_csv(index=False)), header=0, index_col=None, dtype=str, keep_default_na=False)
+
+
+def patch_gazetteer(filename, updated_ids, new_rows):
+    """
+    Function that patches a gazetteer csv file in place: rows of updated
+    entities are replaced by their new row (in the same position), or
+    removed if they are not in new_rows anymore. Rows of entities that
+    were not in the gazetteer are added at the end.
+    """
+    gazdf = read_gazetteer(filename)
+    new_rows = new_rows.reindex(columns=gazdf.columns, fill_value="")
+    entity_rows = dict()
+    for row in new_rows.values.tolist():
+        entity_rows.setdefault(row[gazdf.columns.get_loc("wikidata_id")], []).append(row)
+    rows = []
+    for row in gazdf.itertuples(index=False):
+        entity_id = row.wikidata_id
+        if entity_id in updated_ids:
+            rows += entity_rows.pop(entity_id, [])
+        else:
+            rows.append(list(row))
+    for entity_id in entity_rows:
+        rows += entity_rows[entity_id]
+    gazdf = pd.DataFrame(rows, columns=gazdf.columns)
+    gazdf.to_csv(filename + ".tmp", index=False)
+    os.replace(filename + ".tmp", filename)
+    print("* " + filename + ": " + str(len(gazdf)) + " entities.")
+
+
+def patch_gazetteers(updates, shapefile_path="../resources/geoshapefiles/country_region.shp"):
+    """
+    Function that applies the filters of create_gazetteers.py to the new
+    records of the updated entities, and patches the approximate UK, GB and
+    GB stations gazetteers accordingly.
+    """
+    updated_ids = set(updates)
+    records = [record for record in updates.values() if record is not None]
+    df = pd.DataFrame(records, columns=utils.columns)
+
+    ukdf = as_csv_rows(create_gazetteers.uk_approx_subset(df))
+    patch_gazetteer("../processed/wikidata/uk_approx_gazetteer.csv", updated_ids, ukdf)
+
+    gbdf = pd.read_csv(io.StringIO(ukdf.to_csv(index=False)), header=0, index_col=None, low_memory=False)
+    if len(gbdf):
+        shapefile = create_gazetteers.gpd.read_file(shapefile_path)
+        gbdf = create_gazetteers.gb_subset(gbdf, shapefile)
+    gbdf = as_csv_rows(gbdf)
+    patch_gazetteer("../processed/wikidata/gb_gazetteer.csv", updated_ids, gbdf)
+
+    stationdf = pd.read_csv(io.StringIO(gbdf.to_csv(index=False)), header=0, index_col=None, low_memory=False)
+    stationdf = as_csv_rows(create_gazetteers.stations_subset(stationdf))
+    patch_gazetteer("../processed/wikidata/gb_stations_gazetteer.csv", updated_ids, stationdf)
+
+
+# ==========================================
+# Refresh the extracted entities and gazetteers
+# ==========================================
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", default="../resources/wikidata/latest-all.json.bz2",
+                        help="Path to a newer bz2 Wikidata dump, or to a file of changed entities (one JSON entity per line)")
+    parser.add_argument("-c", "--changes", action="store_true",
+                        help="The input is a file of changed entities, rather than a full dump (so entities that are not in it are kept)")
+    parser.add_argument("--force", action="store_true",
+                        help="Parse all the extracted entities in the input again, even if their revision did not change (e.g. after adding a new property to parse_record)")
+    parser.add_argument("-e", "--extracted", default="../resources/wikidata/extracted/",
+                        help="Directory of the extracted Parquet files to be refreshed")
+    parser.add_argument("-n", "--number_cpus", default=-1,
+                        help="Number of CPUs to be used for processing. Default: -1 (use all)")
+    args = parser.parse_args()
+    utils.enter_sandbox("wikidata", args, ["input", "extracted"])
+
+    number_cpus = int(args.number_cpus)
+    if number_cpus < 0:
+        number_cpus = mp.cpu_count()
+
+    path = args.extracted
+    if not glob.glob(os.path.join(path, "part-*.parquet")):
+        print("There are no extracted Parquet files in " + path + ": run entity_extraction.py first (the csv output cannot be refreshed).")
+        raise SystemExit
+
+    # Entities are refreshed within the same region as the extraction:
+    extraction_region = None
+    checkpoint = os.path.join(path, "checkpoint.json")
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            state = json.load(f)
+        if not state["done"]:
+            print("The extraction in " + path + " has not finished yet: resume it with entity_extraction.py first.")
+            raise SystemExit
+        if state.get("region"):
+            extraction_region = utils.Region(**state["region"])
+
+    known_revisions = store_revisions(path)
+    print("Extracted entities: " + str(len(known_revisions)))
+    if args.force:
+        known_revisions = dict.fromkeys(known_revisions)
+
+
+    updates = dict()
+    seen = set()
+    for changes, seen_ids in tqdm(entity_changes(args.input, known_revisions, number_cpus, extraction_region=extraction_region)):
+        updates.update(changes)
+        seen.update(seen_ids)
+    # A full dump contains all entities, so extracted entities that are not in
+    # it anymore (e.g. deleted or merged) are removed. A file of changed
+    # entities only contains the entities that changed.
+    if not args.changes:
+        for entity_id in set(known_revisions) - seen:
+            updates[entity_id] = None
+
+    print("Updated entities: " + str(sum(1 for r in updates.values() if r is not None)) + ", removed entities: " + str(sum(1 for r in updates.values() if r is None)))
+    if not updates:
+        raise SystemExit
+
+    print("\nPatching the extracted entities.")
+    new_records = patch_store(path, updates)
+    print("New entities: " + str(len(new_records)))
+    patch_altnames(path, updates)
+
+    if Path("../processed/wikidata/gb_stations_gazetteer.csv").exists():
+        print("\nPatching the gazetteers.")
+        patch_gazetteers(updates)
@@ -0,0 +1,761 @@
+import csv
+import hashlib
+import io
+import multiprocessing as mp
+import os
+import re
+from queue import Queue
+from threading import Thread
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# -----------------------------------------------
+# Fields of an extracted Wikidata record (as returned by
+# entity_extraction.parse_record) and how they are stored:
+#   * string: a string (or None).
+#   * float: a float (or None).
+#   * int: an integer (or None).
+#   * list: a list of strings (or None).
+#   * set: a set of strings, stored as a list.
+#   * dict: a dictionary of strings, stored as a list of key-value structs.
+#   * dict_list: a dictionary of lists of strings, stored as a list of key-value structs.
+#   * dict_interval: a dictionary of (start, end) tuples, stored as a list of key-value structs.
+#   * pair: an (amount, unit) tuple, stored as a struct.
+record_fields = [('wikidata_id', 'string'), ('english_label', 'string'), ('instance_of', 'list'),
+                 ('description_set', 'set'), ('alias_dict', 'dict_list'), ('nativelabel', 'list'),
+                 ('population_dict', 'dict'), ('area', 'pair'), ('hcounties', 'list'),
+                 ('date_opening', 'string'), ('date_closing', 'string'), ('inception_date', 'string'),
+                 ('dissolved_date', 'string'), ('follows', 'list'), ('replaces', 'list'),
+                 ('adm_regions', 'dict_interval'), ('countries', 'dict_interval'), ('continents', 'list'),
+                 ('capital_of', 'list'), ('borders', 'list'), ('near_water', 'list'),
+                 ('latitude', 'float'), ('longitude', 'float'), ('wikititle', 'string'),
+                 ('geonamesIDs', 'list'), ('toIDs', 'list'), ('vchIDs', 'list'),
+                 ('vob_placeIDs', 'list'), ('vob_unitIDs', 'dict'), ('epns', 'list'),
+                 ('os_grid_ref', 'string'), ('connectswith', 'list'), ('street_address', 'string'),
+                 ('adjacent_stations', 'list'), ('ukrailcode', 'list'), ('connectline', 'list'),
+                 ('heritage_designation', 'string'), ('getty', 'list'), ('street_located', 'string'),
+                 ('postal_code', 'list'), ('ownedby', 'list'), ('connectservice', 'list'),
+                 ('lastrevid', 'int')]
+
+columns = [name for name, kind in record_fields]
+
+arrow_types = {
+    'string': pa.string(),
+    'float': pa.float64(),
+    'int': pa.int64(),
+    'list': pa.list_(pa.string()),
+    'set': pa.list_(pa.string()),
+    'dict': pa.list_(pa.struct([('key', pa.string()), ('value', pa.string())])),
+    'dict_list': pa.list_(pa.struct([('key', pa.string()), ('value', pa.list_(pa.string()))])),
+    'dict_interval': pa.list_(pa.struct([('key', pa.string()), ('value', pa.struct([('start', pa.string()), ('end', pa.string())]))])),
+    'pair': pa.struct([('amount', pa.string()), ('unit', pa.string())]),
+}
+
+arrow_schema = pa.schema([(name, arrow_types[kind]) for name, kind in record_fields])
+
+# Dtypes of the fields when they are read from a csv file (so that they do not
+# depend on the values of each chunk, e.g. an integer field with a missing
+# value would otherwise be read as floats):
+csv_dtypes = {name: {'int': 'Int64', 'float': float}.get(kind, object) for name, kind in record_fields}
+
+
+# -----------------------------------------------
+def _string(value):
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+
+def to_arrow_value(value, kind):
+    """
+    Function that converts the value of a field of a parsed Wikidata
+    record into its Arrow-compatible representation.
+
+    Arguments:
+        value: value of the field, as returned by parse_record.
+        kind (str): kind of field (see record_fields).
+
+    Returns:
+        The value, as expected by arrow_types[kind].
+    """
+    if value is None:
+        return None
+    if kind == 'string':
+        return _string(value)
+    if kind == 'float':
+        return float(value)
+    if kind == 'int':
+        return int(value)
+    if kind in ['list', 'set']:
+        return [_string(v) for v in value]
+    if kind == 'dict':
+        return [{'key': _string(k), 'value': _string(v)} for k, v in value.items()]
+    if kind == 'dict_list':
+        return [{'key': _string(k), 'value': [_string(x) for x in v]} for k, v in value.items()]
+    if kind == 'dict_interval':
+        return [{'key': _string(k), 'value': {'start': _string(v[0]), 'end': _string(v[1])}} for k, v in value.items()]
+    if kind == 'pair':
+        return {'amount': _string(value[0]), 'unit': _string(value[1])}
+
+
+def from_arrow_value(value, kind):
+    """
+    Function that converts a value read from an Arrow column back into
+    the Python object returned by parse_record (so that, for example, it
+    is stored as in the original csv files when written with to_csv).
+
+    Arguments:
+        value: value of the field, as returned by pyarrow's to_pylist.
+        kind (str): kind of field (see record_fields).
+
+    Returns:
+        The value of the field.
+    """
+    if value is None:
+        return None
+    if kind == 'set':
+        return set(value)
+    if kind in ['dict', 'dict_list']:
+        return {kv['key']: kv['value'] for kv in value}
+    if kind == 'dict_interval':
+        return {kv['key']: (kv['value']['start'], kv['value']['end']) for kv in value}
+    if kind == 'pair':
+        return (value['amount'], value['unit'])
+    return value
+
+
+def records_to_batch(records):
+    """
+    Function that converts a list of parsed Wikidata records into an
+    Arrow record batch.
+    """
+    arrays = [pa.array([to_arrow_value(r[name], kind) for r in records], type=arrow_types[kind]) for name, kind in record_fields]
+    return pa.RecordBatch.from_arrays(arrays, schema=arrow_schema)
+
+
+def column_values(table, name):
+    """
+    Function that returns the values of a column of an Arrow table of
+    extracted Wikidata records as a list, or a list of None if the table
+    does not have the column (i.e. it was extracted before the field was
+    added to record_fields).
+    """
+    if name in table.column_names:
+        return table.column(name).to_pylist()
+    return [None] * table.num_rows
+
+
+def table_to_frame(table):
+    """
+    Function that converts an Arrow table (or record batch) of extracted
+    Wikidata records into a dataframe in which each cell holds the Python
+    object returned by parse_record.
+    """
+    df = pd.DataFrame()
+    for name, kind in record_fields:
+        values = column_values(table, name)
+        if kind == 'int':
+            df[name] = pd.array(values, dtype='Int64')
+        elif kind in ['string', 'float', 'list']:
+            df[name] = values
+        else:
+            df[name] = [from_arrow_value(v, kind) for v in values]
+    return df
+
+
+def table_to_records(table):
+    """
+    Function that converts an Arrow table of extracted Wikidata records
+    into a list of records, as returned by parse_record.
+    """
+    values = [[from_arrow_value(v, kind) for v in column_values(table, name)] for name, kind in record_fields]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def read_extracted(filename):
+    """
+    Function that reads a file of extracted Wikidata records, either a
+    Parquet file or a csv file (in which case nested fields are strings).
+    """
+    if filename.endswith(".parquet"):
+        return table_to_frame(pq.read_table(filename))
+    return pd.read_csv(filename, index_col=None, header=0, dtype=csv_dtypes)
+
+
+def iter_extracted(filename, chunk_size=100000, mask=None):
+    """
+    Function that reads a file of extracted Wikidata records in chunks of
+    at most chunk_size records (see read_extracted), so that only one
+    chunk is held in memory at a time.
+
+    Arguments:
+        filename (str): Parquet or csv file of extracted records.
+        chunk_size (int): maximum number of records per chunk.
+        mask (function): function that takes the arrays of latitudes and
+            longitudes of a chunk and returns a boolean array with the
+            records to keep (which, for Parquet files, is applied before
+            the nested fields are converted).
+
+    Returns:
+        A generator of dataframes.
+    """
+    if filename.endswith(".parquet"):
+        for batch in pq.ParquetFile(filename).iter_batches(batch_size=chunk_size):
+            table = pa.Table.from_batches([batch])
+            if mask is not None:
+                keep = mask(np.array(column_values(table, "latitude"), dtype=float), np.array(column_values(table, "longitude"), dtype=float))
+                table = table.filter(pa.array(keep, type=pa.bool_()))
+            yield table_to_frame(table)
+    else:
+        for df in pd.read_csv(filename, index_col=None, header=0, chunksize=chunk_size, dtype=csv_dtypes):
+            if mask is not None:
+                df = df[mask(df["latitude"].to_numpy(dtype=float), df["longitude"].to_numpy(dtype=float))]
+            yield df
+
+
+def prefetch(iterable, size=1):
+    """
+    Function that iterates over iterable in a background thread, so that
+    the next size items are read while the current one is processed.
+    """
+    queue = Queue(maxsize=size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                queue.put(item)
+        except Exception as e:
+            queue.put(e)
+        queue.put(done)
+
+    Thread(target=produce, daemon=True).start()
+    while True:
+        item = queue.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+# -----------------------------------------------
+class Region:
+    """
+    Region to which the extracted Wikidata entities are restricted: a
+    boundary box and/or a polygon (in WGS84 coordinates). Entities are in
+    the region if their coordinates fall within the boundary box (borders
+    included) and within the polygon.
+
+    Arguments:
+        bbox (tuple): (min longitude, min latitude, max longitude, max latitude).
+        polygon (str): path to a polygon file (e.g. a shapefile or a GeoJSON
+            file) readable by geopandas, in any coordinate system.
+    """
+    def __init__(self, bbox=None, polygon=None):
+        self.bbox = tuple(float(x) for x in bbox) if bbox else None
+        self.polygon = polygon
+        self.spec = {'bbox': list(self.bbox) if self.bbox else None, 'polygon': polygon}
+        self.geometry = None
+        self.prepared = None
+        if polygon:
+            import geopandas as gpd
+            self.geometry = gpd.read_file(polygon).to_crs(epsg=4326).unary_union
+            bounds = self.geometry.bounds
+            if self.bbox:
+                bounds = (max(bounds[0], self.bbox[0]), max(bounds[1], self.bbox[1]), min(bounds[2], self.bbox[2]), min(bounds[3], self.bbox[3]))
+            self.bbox = bounds
+
+    def __getstate__(self):
+        # Prepared geometries cannot be pickled (i.e. sent to the workers):
+        state = dict(self.__dict__)
+        state['prepared'] = None
+        return state
+
+    def contains(self, lat, lon):
+        if lat is None or lon is None:
+            return False
+        if self.bbox and not (self.bbox[1] <= lat <= self.bbox[3] and self.bbox[0] <= lon <= self.bbox[2]):
+            return False
+        if self.geometry is not None:
+            if self.prepared is None:
+                from shapely.prepared import prep
+                self.prepared = prep(self.geometry)
+            from shapely.geometry import Point
+            return self.prepared.intersects(Point(lon, lat))
+        return True
+
+
+# -----------------------------------------------
+class PolygonIndex:
+    """
+    Index of a set of polygons (e.g. the GB country regions of the OS
+    Boundary-Line shapefile) that finds which polygon contains each of a
+    large number of points. The parts of the polygons are stored in an
+    STR-tree, and a grid over the polygons records, for each cell, whether
+    it lies within a polygon, outside all of them, or on a boundary: only
+    the points in boundary cells are tested against the polygons. Points on
+    the boundary of a polygon are not contained in it, as with the
+    "contains" predicate.
+
+    Arguments:
+        polygons (GeoSeries): polygons, in a projected coordinate system.
+        cell_size (float): size of the grid cells, in the units of the
+            coordinate system (e.g. metres).
+        grid (np.array): precomputed grid (see save and load), computed
+            if None.
+        number_cpus (int): number of processes used to compute the grid.
+    """
+    outside = -1
+    boundary = -2
+
+    def __init__(self, polygons, cell_size=1000, grid=None, number_cpus=1):
+        import geopandas as gpd
+        self.cell_size = float(cell_size)
+        parts = gpd.GeoSeries(list(polygons), crs=polygons.crs).explode(index_parts=True)
+        # Position of the polygon to which each part belongs:
+        self.owners = parts.index.get_level_values(0).to_numpy()
+        self.parts = parts.reset_index(drop=True)
+        self.prepared = None
+        bounds = polygons.total_bounds
+        self.origin = (bounds[0], bounds[1])
+        self.shape = (int(np.ceil((bounds[3] - bounds[1]) / self.cell_size)) + 1, int(np.ceil((bounds[2] - bounds[0]) / self.cell_size)) + 1)
+        self.grid = grid if grid is not None else self.build_grid(number_cpus)
+
+    def __getstate__(self):
+        # Prepared geometries cannot be pickled (i.e. sent to the workers):
+        state = dict(self.__dict__)
+        state['prepared'] = None
+        return state
+
+    def prepare(self):
+        if self.prepared is None:
+            from shapely.prepared import prep
+            self.prepared = [prep(part) for part in self.parts]
+        return self.prepared
+
+    def classify_rows(self, rows):
+        """
+        Function that returns the state of the cells of a range of rows of
+        the grid: the position of the polygon within which the cell lies,
+        or outside or boundary.
+        """
+        from shapely.geometry import box
+        prepared = self.prepare()
+        states = np.full((len(rows), self.shape[1]), self.outside, dtype=np.int32)
+        for i, row in enumerate(rows):
+            y = self.origin[1] + row * self.cell_size
+            for column in range(self.shape[1]):
+                x = self.origin[0] + column * self.cell_size
+                cell = box(x, y, x + self.cell_size, y + self.cell_size)
+                for part in self.parts.sindex.query(cell):
+                    if prepared[part].contains_properly(cell):
+                        states[i, column] = self.owners[part]
+                        break
+                    if prepared[part].intersects(cell):
+                        states[i, column] = self.boundary
+        return states
+
+    def build_grid(self, number_cpus=1):
+        tasks = np.array_split(np.arange(self.shape[0]), max(1, number_cpus * 4))
+        if number_cpus == 1:
+            return np.concatenate([self.classify_rows(rows) for rows in tasks])
+        with mp.Pool(processes=number_cpus, initializer=set_polygon_index, initargs=(self,)) as p:
+            return np.concatenate(p.map(classify_rows, tasks))
+
+    def locate_exact(self, points):
+        # Position of the polygon that contains each point (tested against the polygons):
+        from shapely.geometry import Point
+        prepared = self.prepare()
+        located = np.full(len(points), self.outside, dtype=np.int32)
+        for i, (x, y) in enumerate(points):
+            point = Point(x, y)
+            for part in self.parts.sindex.query(point):
+                if prepared[part].contains(point):
+                    located[i] = self.owners[part]
+                    break
+        return located
+
+    def locate(self, x, y, number_cpus=1):
+        """
+        Function that returns the position of the polygon that contains each
+        of the points (or -1 for the points that are not within any polygon).
+
+        Arguments:
+            x, y (np.array): coordinates of the points.
+            number_cpus (int): number of processes used to test the points
+                in boundary cells against the polygons.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        rows = np.floor((y - self.origin[1]) / self.cell_size)
+        columns = np.floor((x - self.origin[0]) / self.cell_size)
+        valid = (rows >= 0) & (rows < self.shape[0]) & (columns >= 0) & (columns < self.shape[1])
+        located = np.full(len(x), self.outside, dtype=np.int32)
+        located[valid] = self.grid[rows[valid].astype(np.int64), columns[valid].astype(np.int64)]
+
+        exact = np.flatnonzero(located == self.boundary)
+        tasks = np.array_split(np.column_stack([x[exact], y[exact]]), max(1, number_cpus * 4))
+        if number_cpus == 1 or len(exact) < 10000:
+            results = [self.locate_exact(points) for points in tasks]
+        else:
+            with mp.Pool(processes=number_cpus, initializer=set_polygon_index, initargs=(self,)) as p:
+                results = p.map(locate_exact, tasks)
+        located[exact] = np.concatenate(results) if results else []
+        return located
+
+    @staticmethod
+    def fingerprint(polygons, cell_size):
+        digest = hashlib.md5(str(float(cell_size)).encode("utf-8"))
+        for polygon in polygons:
+            digest.update(polygon.wkb)
+        return digest.hexdigest()
+
+    def save(self, path, key):
+        np.savez(path, grid=self.grid, key=np.array(key))
+
+    @classmethod
+    def cached(cls, polygons, path, cell_size=1000, number_cpus=1):
+        """
+        Function that returns the index of the polygons, with the grid read
+        from path if it was computed for the same polygons and cell size, or
+        computed (and stored in path) otherwise.
+        """
+        key = cls.fingerprint(polygons, cell_size)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if str(data["key"]) == key:
+                    return cls(polygons, cell_size, grid=data["grid"])
+        index = cls(polygons, cell_size, number_cpus=number_cpus)
+        index.save(path, key)
+        return index
+
+
+# Polygon index used by the workers (set in each worker by set_polygon_index):
+polygon_index = None
+
+
+def set_polygon_index(index):
+    global polygon_index
+    polygon_index = index
+
+
+def classify_rows(rows):
+    return polygon_index.classify_rows(rows)
+
+
+def locate_exact(points):
+    return polygon_index.locate_exact(points)
+
+
+# -----------------------------------------------
+class ParquetSink:
+    """
+    Streaming writer of parsed Wikidata records. Records are buffered and
+    written as fixed-size record batches (i.e. Parquet row groups) into
+    Parquet files ("part-00000.parquet", "part-00001.parquet", etc.) of at
+    most shard_size records, so memory stays flat regardless of the number
+    of records. A file is only given its final name once it is complete,
+    at which point on_commit (if given) is called with the sink and the
+    name of the file.
+
+    Arguments:
+        path (str): output directory.
+        batch_size (int): number of records per record batch.
+        shard_size (int): maximum number of records per file.
+        first_shard (int): number of the first file (when resuming a run).
+        on_commit (function): function called whenever a file is complete.
+        on_start (function): function called with the name of a file before
+            it is written.
+    """
+    def __init__(self, path, batch_size=5000, shard_size=500000, first_shard=0, on_commit=None, on_start=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.shard_size = shard_size
+        self.on_commit = on_commit
+        self.on_start = on_start
+        self.buffer = []
+        self.writer = None
+        self.shard = first_shard
+        self.shard_rows = 0
+        self.position = None
+        self.last_id = None
+
+    def shard_path(self, shard):
+        return os.path.join(self.path, "part-%05d.parquet" % shard)
+
+    def write(self, record, position=None):
+        self.buffer.append(record)
+        self.position = position
+        self.last_id = record['wikidata_id']
+        if len(self.buffer) == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.writer is None:
+            if self.on_start:
+                self.on_start(os.path.basename(self.shard_path(self.shard)))
+            self.writer = pq.ParquetWriter(self.shard_path(self.shard) + ".tmp", arrow_schema)
+        self.writer.write_table(pa.Table.from_batches([records_to_batch(self.buffer)]))
+        self.shard_rows += len(self.buffer)
+        self.buffer = []
+        if self.shard_rows >= self.shard_size:
+            self.close_shard()
+
+    def close_shard(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        filename = self.shard_path(self.shard)
+        os.replace(filename + ".tmp", filename)
+        rows = self.shard_rows
+        self.writer = None
+        self.shard += 1
+        self.shard_rows = 0
+        if self.on_commit:
+            self.on_commit(self, os.path.basename(filename), rows)
+
+    def close(self):
+        self.flush()
+        self.close_shard()
+
+
+class CsvSink:
+    """
+    Streaming writer of parsed Wikidata records into csv files of
+    batch_size records each, named after the last record they contain
+    ("till_<QID>_item.csv", and "final_csv_till_<QID>_item.csv" for the
+    last one). Each file is written under a temporary name and renamed
+    once it is complete, at which point on_commit (if given) is called
+    with the sink and the name of the file.
+
+    Arguments:
+        path (str): output directory.
+        batch_size (int): number of records per csv file.
+        written (int): number of records already written (when resuming a run).
+        on_commit (function): function called whenever a file is complete.
+        on_start (function): function called with the name of a file before
+            it is written.
+    """
+    def __init__(self, path, batch_size=5000, written=0, on_commit=None, on_start=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.on_commit = on_commit
+        self.on_start = on_start
+        self.buffer = []
+        self.written = written
+        self.position = None
+        self.last_id = None
+
+    def write(self, record, position=None):
+        self.buffer.append(record)
+        self.position = position
+        self.last_id = record['wikidata_id']
+        if len(self.buffer) == self.batch_size:
+            self.flush("till_")
+
+    def flush(self, prefix):
+        if not self.buffer:
+            return
+        last_id = self.buffer[-1]['wikidata_id']
+        filename = os.path.join(self.path, prefix + last_id + "_item.csv")
+        if self.on_start:
+            self.on_start(os.path.basename(filename))
+        pd.DataFrame(self.buffer, columns=columns).to_csv(filename + ".tmp")
+        os.replace(filename + ".tmp", filename)
+        rows = len(self.buffer)
+        self.written += rows
+        self.buffer = []
+        print('i = ' + str(self.written) + ' item ' + last_id + '  Done!')
+        if self.on_commit:
+            self.on_commit(self, os.path.basename(filename), rows)
+
+    def close(self):
+        self.flush("final_csv_till_")
+
+
+# -----------------------------------------------
+class LabelWriter:
+    """
+    Writer of the English labels of all the entities of the dump (not only
+    of the extracted ones). Labels are appended, as they are read, to
+    "labels.blob.tmp" (UTF-8 labels, one after the other) and their QIDs and
+    lengths to "labels.qids.tmp" (pairs of 64-bit integers), in the output
+    directory. Both files can be truncated to the sizes returned by sizes
+    (e.g. when resuming a run), and build turns them into a label index
+    (see build).
+
+    Arguments:
+        path (str): output directory.
+        sizes (list): sizes to which the files are truncated (when resuming a run).
+    """
+    def __init__(self, path, sizes=None):
+        self.qids_path = os.path.join(path, "labels.qids.tmp")
+        self.blob_path = os.path.join(path, "labels.blob.tmp")
+        sizes = sizes or [0, 0]
+        self.qids_file = open(self.qids_path, "ab")
+        self.blob_file = open(self.blob_path, "ab")
+        self.qids_file.truncate(sizes[0])
+        self.blob_file.truncate(sizes[1])
+
+    def write(self, qids, lengths, blob):
+        self.qids_file.write(np.column_stack([qids, lengths]).astype(np.int64).tobytes())
+        self.blob_file.write(blob)
+
+    def sizes(self):
+        sizes = []
+        for f in [self.qids_file, self.blob_file]:
+            f.flush()
+            os.fsync(f.fileno())
+            sizes.append(f.tell())
+        return sizes
+
+    def build(self, output):
+        """
+        Function that builds the label index in the output directory: the
+        labels ("labels.bin") and, for each QID number, the offset of its
+        label in labels.bin ("starts.npy", -1 if the entity has no English
+        label) and its length in bytes ("lengths.npy"). The arrays can be
+        memory-mapped, so that each label is read in constant time.
+        """
+        self.sizes()
+        self.qids_file.close()
+        self.blob_file.close()
+        os.makedirs(output, exist_ok=True)
+        entries = np.fromfile(self.qids_path, dtype=np.int64).reshape(-1, 2)
+        qids, lengths = entries[:, 0], entries[:, 1]
+        offsets = np.cumsum(lengths) - lengths
+        size = int(qids.max()) + 1 if len(qids) else 0
+        starts = np.lib.format.open_memmap(os.path.join(output, "starts.npy"), mode="w+", dtype=np.int64, shape=(size,))
+        starts[:] = -1
+        starts[qids] = offsets
+        starts.flush()
+        label_lengths = np.lib.format.open_memmap(os.path.join(output, "lengths.npy"), mode="w+", dtype=np.int32, shape=(size,))
+        label_lengths[:] = 0
+        label_lengths[qids] = lengths
+        label_lengths.flush()
+        del starts, label_lengths
+        os.replace(self.blob_path, os.path.join(output, "labels.bin"))
+        os.remove(self.qids_path)
+
+
+# -----------------------------------------------
+# Appositive or comma-separated qualifiers at the end of a name, which are
+# removed from the alternate names (e.g. "Hope (Derbyshire)" or "Hope, Derbyshire"):
+re_appo = r"(.+)(:?\(.+\)|(\,.+))$"
+
+
+def remove_appositive(name):
+    if re.match(re_appo, name):
+        name = re.match(re_appo, name).group(1).strip()
+        name = re.sub(",$", "", name)
+    return name
+
+
+def wikidata_altnames(english_label, alias_dict, nativelabel):
+    """
+    Function that returns the alternate names of a Wikidata entity that
+    come from Wikidata itself, i.e. from its native labels, its aliases
+    and its English label, in this order (if a name comes from more than
+    one source, the last one is kept).
+
+    Arguments:
+        english_label (str): English label of the entity (or None).
+        alias_dict (dict): aliases of the entity, by language (or None).
+        nativelabel (list): native labels of the entity (or None).
+
+    Returns:
+        A dictionary with the source of each alternate name.
+    """
+    altnames = dict()
+    for nl in nativelabel or []:
+        altnames[nl] = "native_label"
+    for language in alias_dict or dict():
+        for a in alias_dict[language]:
+            altnames[remove_appositive(a)] = "wikidata_alias"
+    if english_label is not None:
+        altnames[remove_appositive(english_label)] = "english_label"
+    return altnames
+
+
+class AltnameWriter:
+    """
+    Writer of the alternate names of the extracted Wikidata entities that
+    come from Wikidata itself (see wikidata_altnames), in the long format of
+    the altname-centric gazetteers, i.e. as (wkid, altname, source, lat, lon)
+    rows of a tsv file ("altnames.tsv" in the output directory). The file
+    can be truncated to the size returned by size (e.g. when resuming a run).
+
+    Arguments:
+        path (str): output directory.
+        size (int): size to which the file is truncated (when resuming a run).
+        filename (str): name of the file.
+    """
+    columns = ["wkid", "altname", "source", "lat", "lon"]
+
+    def __init__(self, path, size=0, filename="altnames.tsv"):
+        self.path = os.path.join(path, filename)
+        self.file = open(self.path, "ab")
+        self.file.truncate(size)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, delimiter="\t", lineterminator="\n")
+        if size == 0:
+            self.writer.writerow(self.columns)
+
+    def write(self, record):
+        altnames = wikidata_altnames(record["english_label"], record["alias_dict"], record["nativelabel"])
+        for altname, source in altnames.items():
+            self.writer.writerow([record["wikidata_id"], altname, source, record["latitude"], record["longitude"]])
+        if self.buffer.tell() > 1024 * 1024:
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer.getvalue().encode("utf-8"))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def size(self):
+        self.flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.size()
+        self.file.close()
+
+
+# -----------------------------------------------
+# Development sandbox created by dev_sample.py (relative to the folder of a stage):
+sandbox_path = "../dev/station-to-station/"
+
+
+def sandbox_relative(value):
+    """
+    Function that tells whether a path is one of the pipeline (i.e. relative
+    to the ../resources/ or ../processed/ folders), which the sandbox mirrors.
+    """
+    return os.path.normpath(value).split(os.sep)[:2] in (["..", "resources"], ["..", "processed"])
+
+
+def enter_sandbox(stage, args=None, path_args=()):
+    """
+    Function that runs the scripts of a stage on the sampled development
+    subset (see dev_sample.py) if S2S_DEV is set, by moving to the folder
+    of the stage in the sandbox. The pipeline paths (in ../resources/ and
+    ../processed/) then resolve inside the sandbox, whereas any other
+    relative path given in the path_args of the parsed arguments (e.g. a
+    dump passed with -i) is resolved from the folder the script is run from.
+    """
+    if not os.environ.get("S2S_DEV"):
+        return
+    for name in path_args:
+        value = getattr(args, name)
+        if value and not os.path.isabs(value) and not sandbox_relative(value):
+            setattr(args, name, os.path.abspath(value))
+    os.chdir(os.path.join(sandbox_path, stage))